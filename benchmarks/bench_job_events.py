@@ -0,0 +1,102 @@
+"""
+Database queries issued while N clients wait for their jobs to finish:
+clients polling GET /api/jobs/<id> (the previous pattern) against clients
+following GET /api/jobs/<id>/events, which reads the job once and is then
+fed by the shared LISTEN connection. Runs in-process with get_job counted
+and notifications injected into the hub, so no Postgres is needed.
+
+    python benchmarks/bench_job_events.py --clients 10,100,500 --seconds 3
+"""
+import argparse
+import threading
+import time
+
+from fakes import ROOT  # noqa: F401  (puts the repo root on sys.path)
+
+import job_events
+import server
+
+
+class CountingJobs:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.status = {}
+
+    def get_job(self, job_id):
+        with self.lock:
+            self.queries += 1
+            return {'id': job_id, 'status': self.status.get(job_id, 'pending')}
+
+
+def install(jobs):
+    hub = job_events.JobEventHub(listen=False)
+    job_events.hub = hub
+    server.get_job = jobs.get_job
+    return hub
+
+
+def run_polling(clients, seconds, interval):
+    jobs = CountingJobs()
+    install(jobs)
+    client = server.app.test_client()
+    deadline = time.monotonic() + seconds
+
+    def poll(job_id):
+        while time.monotonic() < deadline:
+            client.get(f'/api/jobs/{job_id}')
+            time.sleep(interval)
+
+    threads = [threading.Thread(target=poll, args=(f'job-{i}',)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return jobs.queries
+
+
+def run_events(clients, seconds):
+    jobs = CountingJobs()
+    hub = install(jobs)
+    client = server.app.test_client()
+
+    def follow(job_id):
+        resp = client.get(f'/api/jobs/{job_id}/events', buffered=False)
+        for _ in resp.response:
+            pass
+
+    job_ids = [f'job-{i}' for i in range(clients)]
+    threads = [threading.Thread(target=follow, args=(job_id,)) for job_id in job_ids]
+    for t in threads:
+        t.start()
+    while hub.subscriber_count() < clients:
+        time.sleep(0.01)
+    for status in ('processing', 'completed'):
+        time.sleep(seconds / 2)
+        for job_id in job_ids:
+            jobs.status[job_id] = status
+            hub.publish({'id': job_id, 'status': status})
+    for t in threads:
+        t.join()
+    return jobs.queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', default='10,100,500')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"clients waiting {args.seconds:.0f}s for their job; polling every {args.poll_interval}s")
+    print(f"{'clients':>8} {'poll queries/s':>15} {'events queries/s':>17} {'events total':>13}")
+    for clients in map(int, args.clients.split(',')):
+        polled = run_polling(clients, args.seconds, args.poll_interval)
+        streamed = run_events(clients, args.seconds)
+        # A streaming client costs one read when it connects and nothing after.
+        waiting = streamed - clients
+        print(f"{clients:>8} {polled / args.seconds:>15.0f} {waiting / args.seconds:>17.0f} {streamed:>13}")
+
+
+if __name__ == '__main__':
+    main()
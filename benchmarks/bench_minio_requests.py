@@ -0,0 +1,54 @@
+"""
+MinIO requests issued per job by process_job, by API call, with the bucket
+check memoized (current behaviour) and with it repeated for every job (the
+previous ensure_bucket). Runs against the in-memory MinIO, which counts calls.
+
+    python benchmarks/bench_minio_requests.py --jobs 100
+"""
+import argparse
+import io
+from types import SimpleNamespace
+
+from fakes import FakeChannel, FakeMinio, isolate_processor, minio_event
+
+from PIL import Image
+
+import image_processor
+import storage
+
+
+def run(jobs: int, memoized: bool, profile: str) -> FakeMinio:
+    fake = FakeMinio()
+    isolate_processor(image_processor, fake)
+    image_processor.STREAMING_MODE = True
+    renditions = image_processor.resolve_renditions(profile)
+    image_processor.get_job = lambda job_id: {'id': job_id, 'renditions': renditions}
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), 'teal').save(buffer, format='JPEG')
+    channel = FakeChannel()
+    for i in range(jobs):
+        key = f'{i:08d}-0000-0000-0000-000000000000_bench.jpg'
+        fake.objects[('uploads', key)] = buffer.getvalue()
+        if not memoized:
+            storage.forget_bucket(fake, image_processor.BUCKET_NAME)
+        image_processor.process_job(channel, SimpleNamespace(delivery_tag=i), None, minio_event('uploads', key))
+    return fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=100)
+    args = parser.parse_args()
+
+    for profile in ('default', 'web'):
+        print(f"profile '{profile}', {args.jobs} jobs")
+        print(f"  {'bucket check':<14} {'requests/job':>12}  breakdown per job")
+        for label, memoized in (('every job', False), ('memoized', True)):
+            fake = run(args.jobs, memoized, profile)
+            breakdown = ', '.join(f'{m}={n / args.jobs:.2f}' for m, n in sorted(fake.requests.items()))
+            print(f"  {label:<14} {fake.calls / args.jobs:>12.2f}  {breakdown}")
+
+
+if __name__ == '__main__':
+    main()
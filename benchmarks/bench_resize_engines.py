@@ -0,0 +1,68 @@
+"""
+Conformance and speed of every installed resize engine (resize_engines.py)
+over the benchmark corpus: images/sec rendering the `web` profile, and the
+mean absolute pixel difference of each engine's output from Pillow's
+`quality` mode, rendition by rendition.
+
+    python benchmarks/bench_resize_engines.py --repeat 3 --mode balanced
+
+Engines whose library is not installed are skipped. Sources an engine
+cannot handle natively (GIF, CMYK, ...) are rendered by Pillow, so their
+rows match Pillow's.
+"""
+import argparse
+import io
+import statistics
+import time
+
+from corpus import LARGE_SPECS, SUITE_SPECS, ensure_corpus
+from fakes import ROOT  # noqa: F401  (puts the repo root on sys.path)
+
+from PIL import Image, ImageChops, ImageStat
+
+import resize_engines
+from renditions import RENDITION_PROFILES
+
+
+def difference(a: bytes, b: bytes) -> float:
+    """Mean absolute per-channel difference of two encoded images, 0-255."""
+    with Image.open(io.BytesIO(a)) as first, Image.open(io.BytesIO(b)) as second:
+        if first.size != second.size:
+            return float("inf")
+        diff = ImageChops.difference(first.convert("RGB"), second.convert("RGB"))
+        return sum(ImageStat.Stat(diff).mean) / 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mode", default=resize_engines.RESIZE_MODE, choices=sorted(resize_engines.RESIZE_MODES))
+    parser.add_argument("--profile", default="web", choices=sorted(RENDITION_PROFILES))
+    args = parser.parse_args()
+
+    renditions = RENDITION_PROFILES[args.profile]
+    paths = ensure_corpus(SUITE_SPECS) + ensure_corpus(LARGE_SPECS)
+    engines = resize_engines.available_engines()
+    print(f"engines: {', '.join(e.name for e in engines)}; mode {args.mode}, profile {args.profile}")
+    print(f"{'file':<18} {'engine':<8} {'ms (median)':>12} {'img/s':>8} {'max diff':>9}")
+    totals = {engine.name: 0.0 for engine in engines}
+    for path in paths:
+        data = path.read_bytes()
+        reference = resize_engines.PillowEngine().render(io.BytesIO(data), renditions, "quality")
+        for engine in engines:
+            times = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                outputs = engine.render(io.BytesIO(data), renditions, args.mode)
+                times.append(time.perf_counter() - started)
+            worst = max(difference(out, ref) for (out, _), (ref, _) in zip(outputs, reference))
+            median = statistics.median(times)
+            totals[engine.name] += median
+            print(f"{path.name:<18} {engine.name:<8} {median * 1000:>12.1f} {1 / median:>8.1f} {worst:>9.2f}")
+    print()
+    for name, seconds in totals.items():
+        print(f"{name:<8} {len(paths) / seconds:>8.1f} images/sec over the corpus")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Decode+resize time and peak RSS of resize_image for each RESIZE_MODES entry
+over a corpus of large JPEG/PNG/WebP files.
+
+    python benchmarks/bench_resize_modes.py --repeat 3
+
+Every measurement runs in a freshly spawned process so ru_maxrss reflects
+that single decode.
+"""
+import argparse
+import io
+import multiprocessing
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus import ensure_corpus
+from fakes import ROOT  # noqa: F401  (puts the repo root on sys.path)
+
+import image_processor
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(path: str, mode: str, size: tuple[int, int]) -> tuple[float, float, float]:
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    image_processor.resize_image(path, io.BytesIO(), size, mode=mode)
+    elapsed = time.perf_counter() - started
+    return elapsed, baseline, peak_rss_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--size", default="256x256")
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.split("x"))
+
+    paths = ensure_corpus()
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'file':<18} {'mode':<9} {'ms (median)':>12} {'peak RSS MB':>12} {'delta MB':>9}")
+    for path in paths:
+        for mode in image_processor.RESIZE_MODES:
+            times, peaks, deltas = [], [], []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    elapsed, baseline, peak = pool.submit(measure, str(path), mode, size).result()
+                times.append(elapsed)
+                peaks.append(peak)
+                deltas.append(peak - baseline)
+            print(
+                f"{path.name:<18} {mode:<9} {statistics.median(times) * 1000:>12.1f} "
+                f"{max(peaks):>12.1f} {max(deltas):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compare per-job latency and disk I/O of the file-based and streaming
+paths in image_processor.process_job against an in-memory MinIO.
+
+    python benchmarks/bench_streaming.py --jobs 50 --size 2048x1536
+"""
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from fakes import FakeChannel, FakeMinio, isolate_processor, minio_event
+
+from PIL import Image
+
+import image_processor
+
+
+def read_proc_io() -> dict[str, int]:
+    """Return this process' I/O counters (Linux only, else empty)."""
+    try:
+        with open("/proc/self/io") as fh:
+            return {k: int(v) for k, v in (line.split(": ") for line in fh)}
+    except OSError:
+        return {}
+
+
+def make_source(width: int, height: int, fmt: str) -> bytes:
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def run(mode: str, jobs: int, payload: bytes, ext: str) -> dict:
+    fake = FakeMinio()
+    isolate_processor(image_processor, fake)
+    image_processor.STREAMING_MODE = mode == "streaming"
+
+    keys = []
+    for i in range(jobs):
+        key = f"{i:08d}-0000-0000-0000-000000000000_bench.{ext}"
+        fake.objects[("uploads", key)] = payload
+        keys.append(key)
+
+    channel = FakeChannel()
+    latencies = []
+    io_before = read_proc_io()
+    for i, key in enumerate(keys):
+        started = time.perf_counter()
+        image_processor.process_job(channel, SimpleNamespace(delivery_tag=i), None, minio_event("uploads", key))
+        latencies.append(time.perf_counter() - started)
+    io_after = read_proc_io()
+
+    assert len(channel.acked) == jobs
+    return {
+        "mode": mode,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "read_bytes": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+        "write_bytes": io_after.get("wchar", 0) - io_before.get("wchar", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=30)
+    parser.add_argument("--size", default="2048x1536")
+    parser.add_argument("--format", default="JPEG")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    payload = make_source(width, height, args.format)
+    ext = args.format.lower()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_processor.UPLOADS_DIR = os.path.join(workdir, "uploads")
+        image_processor.RESIZED_DIR = os.path.join(workdir, "resized")
+        os.makedirs(image_processor.UPLOADS_DIR)
+        os.makedirs(image_processor.RESIZED_DIR)
+
+        print(f"{args.jobs} jobs, {args.size} {args.format}, source {len(payload)} bytes")
+        print(f"{'mode':<10} {'p50 ms':>9} {'mean ms':>9} {'read B/job':>12} {'write B/job':>12}")
+        for mode in ("file", "streaming"):
+            result = run(mode, args.jobs, payload, ext)
+            print(
+                f"{result['mode']:<10} {result['p50_ms']:>9.2f} {result['mean_ms']:>9.2f} "
+                f"{result['read_bytes'] // args.jobs:>12} {result['write_bytes'] // args.jobs:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
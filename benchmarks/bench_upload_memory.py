@@ -0,0 +1,107 @@
+"""
+Load test for /api/upload memory use: streams increasingly large uploads
+through a real HTTP server (MinIO and Postgres stubbed out) and reports the
+server's peak RSS after each one. With streaming pass-through the peak
+should stay flat as the upload size grows.
+
+    python benchmarks/bench_upload_memory.py --sizes 8,64,256 --concurrency 4
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import ROOT  # noqa: F401  (puts the repo root on sys.path)
+
+BOUNDARY = "----bench-boundary"
+CHUNK = 256 * 1024
+
+
+def serve(port: int):
+    from werkzeug.serving import make_server
+
+    import server
+
+    def discard_put_object(bucket, name, data, length, part_size, content_type):
+        while data.read(part_size):
+            pass
+
+    server.minio_client.put_object = discard_put_object
+    server.create_job = lambda **kwargs: None
+    server.app.config["MAX_CONTENT_LENGTH"] = None
+    make_server("127.0.0.1", port, server.app, threaded=True).serve_forever()
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def upload(port: int, size: int):
+    head = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="image"; filename="big.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+
+    def body():
+        yield head
+        block = os.urandom(CHUNK)
+        sent = 0
+        while sent < size:
+            yield block[: min(CHUNK, size - sent)]
+            sent += CHUNK
+        yield tail
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    conn.request(
+        "POST",
+        "/api/upload",
+        body=body(),
+        headers={
+            "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+            "Content-Length": str(len(head) + size + len(tail)),
+        },
+    )
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 202, response.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="8,32,128,256", help="upload sizes in MiB")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(args.port,), daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            http.client.HTTPConnection("127.0.0.1", args.port, timeout=1).connect()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    print(f"server idle peak RSS: {peak_rss_mb(process.pid):.1f} MB")
+    print(f"{'upload MiB':>10} {'x conc':>6} {'seconds':>8} {'peak RSS MB':>12}")
+    try:
+        for size_mb in (int(v) for v in args.sizes.split(",")):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(lambda _: upload(args.port, size_mb * 1024 * 1024), range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            print(f"{size_mb:>10} {args.concurrency:>6} {elapsed:>8.2f} {peak_rss_mb(process.pid):>12.1f}")
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Measure process_job throughput of the concurrent execution engine as the
+number of CPU workers grows, over N queued events against an in-memory MinIO.
+
+    python benchmarks/bench_workers.py --events 200 --size 1600x1200
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from fakes import FakeMinio, isolate_processor, minio_event
+
+from PIL import Image
+
+import image_processor
+
+
+class FakeConnection:
+    """Runs threadsafe callbacks inline and counts acks."""
+
+    def __init__(self, expected: int):
+        self.lock = threading.Lock()
+        self.acked = 0
+        self.done = threading.Event()
+        self.expected = expected
+
+    def add_callback_threadsafe(self, callback):
+        with self.lock:
+            callback()
+
+    def basic_ack(self, delivery_tag):
+        self.acked += 1
+        if self.acked == self.expected:
+            self.done.set()
+
+
+def run(workers: int, events: int, payload: bytes) -> float:
+    fake = FakeMinio()
+    isolate_processor(image_processor, fake)
+    image_processor.STREAMING_MODE = True
+
+    bodies = []
+    for i in range(events):
+        key = f"{i:08d}-0000-0000-0000-000000000000_bench.jpg"
+        fake.objects[("uploads", key)] = payload
+        bodies.append(minio_event("uploads", key))
+
+    connection = FakeConnection(events)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the pool so process start-up is not timed.
+        list(pool.map(abs, range(workers)))
+        image_processor.cpu_pool = pool
+        executor = image_processor.JobExecutor(connection, io_threads=2 * workers)
+        started = time.perf_counter()
+        for i, body in enumerate(bodies):
+            executor.on_message(connection, SimpleNamespace(delivery_tag=i), None, body)
+        connection.done.wait()
+        elapsed = time.perf_counter() - started
+        executor.shutdown()
+        image_processor.cpu_pool = None
+    return events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--size", default="1600x1200")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    buf = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buf, format="JPEG")
+    payload = buf.getvalue()
+
+    counts = sorted({1, 2, 4, 8, 16, args.max_workers} & set(range(1, args.max_workers + 1)))
+    print(f"{args.events} events, {args.size} JPEG")
+    print(f"{'workers':>7} {'images/s':>9} {'speedup':>8}")
+    baseline = None
+    for workers in counts:
+        rate = run(workers, args.events, payload)
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>9.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Deterministic synthetic image corpus for the benchmarks.
+
+Images are generated from gradients and seeded noise so that every run
+produces byte-identical files, and are cached under benchmarks/corpus/.
+"""
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+
+# name, (width, height), format, mode[, frames]
+LARGE_SPECS = [
+    ("photo-24mp.jpg", (6000, 4000), "JPEG", "RGB"),
+    ("photo-12mp.jpg", (4032, 3024), "JPEG", "RGB"),
+    ("scan-12mp.png", (4000, 3000), "PNG", "RGB"),
+    ("photo-12mp.webp", (4032, 3024), "WEBP", "RGB"),
+]
+
+# Smaller, varied inputs for the regression suite (suite.py): every format
+# and mode the processor is expected to handle.
+SUITE_SPECS = [
+    ("rgb-vga.jpg", (640, 480), "JPEG", "RGB"),
+    ("rgb-fullhd.jpg", (1920, 1080), "JPEG", "RGB"),
+    ("cmyk-1mp.jpg", (1200, 900), "JPEG", "CMYK"),
+    ("gray-1mp.jpg", (1200, 900), "JPEG", "L"),
+    ("rgba-1mp.png", (1200, 900), "PNG", "RGBA"),
+    ("palette-svga.png", (800, 600), "PNG", "P"),
+    ("rgb-1mp.webp", (1200, 900), "WEBP", "RGB"),
+    ("animated-8f.gif", (400, 300), "GIF", "P", 8),
+]
+
+
+def synthetic_image(size: tuple[int, int], mode: str = "RGB", seed: int = 0) -> Image.Image:
+    """Photo-like content: colour gradients, shapes and a little noise."""
+    rng = random.Random(seed)
+    width, height = size
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = Image.linear_gradient("L").rotate(90).resize(size)
+    img = Image.merge("RGB", (red, green, blue))
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4 + 1), y0 + rng.randrange(height // 4 + 1)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x0, y0, x1, y1), fill=colour)
+
+    # Seeded noise (Image.effect_noise depends on the C rand() state, so
+    # the output would vary with how many images were generated before).
+    noise_size = (min(width, 512), min(height, 512))
+    noise = Image.frombytes("L", noise_size, rng.randbytes(noise_size[0] * noise_size[1])).resize(size)
+    img = Image.blend(img, Image.merge("RGB", (noise,) * 3), 0.15)
+    if mode == "RGBA":
+        img.putalpha(Image.radial_gradient("L").resize(size))
+        return img
+    if mode == "P":
+        return img.convert("P", palette=Image.Palette.ADAPTIVE)
+    return img.convert(mode) if mode != "RGB" else img
+
+
+def ensure_corpus(specs=LARGE_SPECS, directory: Path = CORPUS_DIR) -> list[Path]:
+    """Generate any missing corpus files and return their paths."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for seed, (name, size, fmt, mode, *frames) in enumerate(specs):
+        path = directory / name
+        if not path.exists():
+            images = [synthetic_image(size, mode, seed * 100 + i) for i in range(frames[0] if frames else 1)]
+            if len(images) > 1:
+                images[0].save(path, format=fmt, save_all=True, append_images=images[1:], duration=80, loop=0)
+            else:
+                images[0].save(path, format=fmt)
+        paths.append(path)
+    return paths
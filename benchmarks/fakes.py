@@ -0,0 +1,108 @@
+"""
+In-memory stand-ins for the external services used by the benchmarks, so
+they can run without MinIO, Postgres or RabbitMQ.
+"""
+import io
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+from urllib.parse import quote
+
+# Make the top-level service modules importable from benchmarks/.
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+os.environ.setdefault("SKIP_EXTERNAL_INIT", "1")
+
+
+class FakeResponse(io.BytesIO):
+    """Mimics the urllib3 response returned by Minio.get_object."""
+
+    def stream(self, amt=64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """Dict-backed object store exposing the Minio methods we call."""
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.buckets: set[str] = set()
+        self.calls = 0
+        self.requests: Counter[str] = Counter()
+
+    def _record(self, method: str):
+        self.calls += 1
+        self.requests[method] += 1
+
+    def bucket_exists(self, bucket):
+        self._record("bucket_exists")
+        return bucket in self.buckets
+
+    def make_bucket(self, bucket):
+        self._record("make_bucket")
+        self.buckets.add(bucket)
+
+    def get_object(self, bucket, name, *args, **kwargs):
+        self._record("get_object")
+        return FakeResponse(self.objects[(bucket, name)])
+
+    def fget_object(self, bucket, name, file_path):
+        self._record("fget_object")
+        with open(file_path, "wb") as fh:
+            fh.write(self.objects[(bucket, name)])
+
+    def put_object(self, bucket, name, data, length, content_type=None, **kwargs):
+        self._record("put_object")
+        self.buckets.add(bucket)
+        self.objects[(bucket, name)] = data.read() if length < 0 else data.read(length)
+
+    def copy_object(self, bucket, name, source, **kwargs):
+        self._record("copy_object")
+        self.objects[(bucket, name)] = self.objects[(source.bucket_name, source.object_name)]
+
+    def fput_object(self, bucket, name, file_path, content_type=None, **kwargs):
+        self._record("fput_object")
+        self.buckets.add(bucket)
+        with open(file_path, "rb") as fh:
+            self.objects[(bucket, name)] = fh.read()
+
+
+def isolate_processor(image_processor, minio: FakeMinio, dedup: bool = False):
+    """Point image_processor at `minio` and stub out every database call."""
+    image_processor.minio_client = minio
+    image_processor.safe_update_job_status = lambda *args, **kwargs: None
+    image_processor.get_job = lambda job_id: None
+    image_processor.DEDUP_ENABLED = dedup
+    cache = {}
+    image_processor.find_cached_renditions = lambda keys: {k: cache[k] for k in keys if k in cache}
+    image_processor.record_cached_renditions = lambda entries: cache.update((k, obj) for k, obj, _ in entries)
+    image_processor.record_cache_hits = lambda keys: None
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.published = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+
+def minio_event(bucket: str, key: str) -> bytes:
+    """Build the body of a MinIO bucket-notification AMQP message."""
+    return json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": quote(key)}}}]}
+    ).encode("utf-8")
@@ -0,0 +1,190 @@
+"""
+Load test comparing the Flask server (gunicorn, threaded) with the ASGI
+server (uvicorn) on the same routes: requests/sec and p50/p99/max latency
+with many concurrent clients, each keeping one connection open.
+
+    python benchmarks/load_test.py --clients 500 --requests 20000
+
+Without URLs both servers are started locally with in-memory stand-ins
+for Postgres and MinIO; --db-latency sets the simulated round-trip of each
+query, which is where a thread-per-request server runs out of threads.
+To measure real deployments (e.g. the compose stack) pass their URLs and
+an existing job id:
+
+    python benchmarks/load_test.py --flask-url http://localhost:5000 \\
+        --asgi-url http://localhost:5001 --path /api/jobs/<job-id>
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from fakes import ROOT  # noqa: F401  (puts the repo root on sys.path)
+from suite import percentile
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_JOB_ID = "00000000-0000-0000-0000-000000000001"
+FAKE_JOB = {
+    "id": FAKE_JOB_ID,
+    "filename": f"{FAKE_JOB_ID}_photo.jpg",
+    "original_filename": "photo.jpg",
+    "status": "completed",
+    "error_message": None,
+    "renditions": None,
+    "cache_hit": False,
+    "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+    "updated_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+}
+
+
+def serve(kind: str, port: int, db_latency: float, threads: int):
+    """Run one server with faked storage until killed (child process)."""
+    import server
+
+    if kind == "flask":
+        def get_job(job_id):
+            time.sleep(db_latency)
+            return dict(FAKE_JOB) if job_id == FAKE_JOB_ID else None
+
+        server.get_job = get_job
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            print("[WARN] gunicorn is not installed; using werkzeug's threaded server")
+            from werkzeug.serving import run_simple
+            run_simple("127.0.0.1", port, server.app, threaded=True)
+            return
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in {
+                    "bind": f"127.0.0.1:{port}",
+                    "worker_class": "gthread",
+                    "threads": threads,
+                    "workers": 1,
+                    "loglevel": "warning",
+                    "backlog": 2048,
+                }.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return server.app
+
+        Server().run()
+    else:
+        import uvicorn
+        import server_async
+
+        async def get_job(job_id):
+            await asyncio.sleep(db_latency)
+            return dict(FAKE_JOB) if job_id == FAKE_JOB_ID else None
+
+        server_async.get_job = get_job
+        uvicorn.run(server_async.app, host="127.0.0.1", port=port, log_level="warning", backlog=2048)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind: str, db_latency: float, threads: int) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ, SKIP_EXTERNAL_INIT="1")
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--serve", kind, "--port", str(port),
+         "--db-latency", str(db_latency), "--threads", str(threads)],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+
+async def run_load(base_url: str, path: str, clients: int, requests: int, timeout: float) -> dict:
+    """`clients` concurrent clients send `requests` GETs between them."""
+    latencies: list[float] = []
+    errors = 0
+    remaining = requests
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        # Warm-up: open the connections before the clock starts.
+        await asyncio.gather(*(client.get(path) for _ in range(min(clients, 50))), return_exceptions=True)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else float("nan"),
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else float("nan"),
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--path", default=f"/api/jobs/{FAKE_JOB_ID}")
+    parser.add_argument("--flask-url")
+    parser.add_argument("--asgi-url")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Simulated query time in seconds.")
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads, as in the Dockerfile.")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--serve", choices=["flask", "asgi"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.db_latency, args.threads)
+        return
+
+    print(f"{args.requests} x GET {args.path} from {args.clients} concurrent clients")
+    print(f"{'server':<8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for kind, url in (("flask", args.flask_url), ("asgi", args.asgi_url)):
+        proc = None
+        if url is None:
+            proc, url = start_server(kind, args.db_latency, args.threads)
+        try:
+            result = asyncio.run(run_load(url, args.path, args.clients, args.requests, args.timeout))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        print(f"{kind:<8} {result['rps']:>9.0f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{result['max_ms']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
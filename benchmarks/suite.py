@@ -0,0 +1,232 @@
+"""
+Regression suite for the resize pipeline. Times resize_image and
+process_job end to end (in-memory MinIO, no DB or broker) over the
+deterministic SUITE_SPECS corpus, writes throughput, p50/p99 latency and
+peak RSS per case to JSON, and compares them with a stored baseline.
+
+    python benchmarks/suite.py                    # run and compare
+    python benchmarks/suite.py --update-baseline  # accept the current numbers
+
+Exits with status 1 when a case is slower or bigger than the baseline by
+more than the tolerance. Baselines are machine-specific: regenerate
+baseline.json on the machine that runs the comparison.
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+from corpus import SUITE_SPECS, ensure_corpus
+from fakes import FakeChannel, FakeMinio, isolate_processor, minio_event
+
+import PIL
+
+import image_processor
+
+HERE = Path(__file__).resolve().parent
+BASELINE_PATH = HERE / "baseline.json"
+RESULTS_PATH = HERE / "results.json"
+
+
+def _proc_status_mb(field: str) -> float | None:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> float:
+    """
+    Reset the peak-RSS high-water mark where Linux allows it, so the peak of
+    the imports does not hide the case's own; returns the RSS it starts from.
+    """
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        return peak_rss_mb()
+    return _proc_status_mb("VmRSS") or peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = _proc_status_mb("VmHWM")
+    # ru_maxrss is KiB on Linux.
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run_case(kind: str, path: str, repeat: int, profile: str) -> dict:
+    """Run one case in this (freshly spawned) process and summarise it."""
+    data = Path(path).read_bytes()
+    if kind == "resize_image":
+        def once(_i):
+            image_processor.resize_image(io.BytesIO(data), io.BytesIO())
+    else:
+        fake = FakeMinio()
+        isolate_processor(image_processor, fake)
+        image_processor.STREAMING_MODE = True
+        renditions = image_processor.resolve_renditions(profile)
+        image_processor.get_job = lambda job_id: {"id": job_id, "renditions": renditions}
+        image_processor.print = lambda *args, **kwargs: None
+        channel = FakeChannel()
+        # minio is imported lazily by the first ensure_bucket; like the other
+        # imports, that belongs before the baseline, not in the case's peak.
+        image_processor.ensure_bucket()
+
+        def once(i):
+            key = f"{i:08d}-0000-0000-0000-000000000000_{Path(path).name}"
+            fake.objects[("uploads", key)] = data
+            image_processor.process_job(channel, SimpleNamespace(delivery_tag=i), None, minio_event("uploads", key))
+            del fake.objects[("uploads", key)]
+
+    baseline = reset_peak_rss()
+    once(-1)  # warm-up: imports, codec initialisation
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        once(i)
+        samples.append(time.perf_counter() - started)
+    return {
+        "throughput": len(samples) / sum(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb() - baseline,
+        "samples": len(samples),
+    }
+
+
+def suite_cases() -> dict[str, tuple[str, str]]:
+    """Case name -> (kind, corpus path)."""
+    paths = ensure_corpus(SUITE_SPECS)
+    return {
+        f"{kind}[{path.name}]": (kind, str(path))
+        for kind in ("resize_image", "process_job")
+        for path in paths
+    }
+
+
+def run_isolated(name: str, kind: str, path: str, repeat: int, profile: str) -> dict:
+    # A fresh process per case keeps its peak RSS its own.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        result = pool.submit(run_case, kind, path, repeat, profile).result()
+    print(
+        f"{name:<42} {result['throughput']:>8.1f}/s {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+        f"{result['peak_rss_mb']:>8.1f}"
+    )
+    return result
+
+
+def best_of(a: dict, b: dict) -> dict:
+    return {
+        "throughput": max(a["throughput"], b["throughput"]),
+        "p50_ms": min(a["p50_ms"], b["p50_ms"]),
+        "p99_ms": min(a["p99_ms"], b["p99_ms"]),
+        "peak_rss_mb": min(a["peak_rss_mb"], b["peak_rss_mb"]),
+        "samples": a["samples"] + b["samples"],
+    }
+
+
+def run_suite(repeat: int, profile: str) -> dict:
+    cases = {
+        name: run_isolated(name, kind, path, repeat, profile)
+        for name, (kind, path) in suite_cases().items()
+    }
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "resize_mode": image_processor.RESIZE_MODE,
+            "resize_engine": image_processor.resize_engine.name,
+            "profile": profile,
+            "repeat": repeat,
+        },
+        "cases": cases,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, memory_tolerance: float) -> list[str]:
+    """Human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for name, base in baseline["cases"].items():
+        current = results["cases"].get(name)
+        if current is None:
+            print(f"[WARN] {name} is in the baseline but was not run")
+            continue
+        # The p99 of a few dozen samples is nearly the maximum, so it gets
+        # twice the slack of the median.
+        for metric, slack in (("p50_ms", tolerance), ("p99_ms", 2 * tolerance)):
+            if current[metric] > base[metric] * (1 + slack):
+                regressions.append(f"{name} {metric}: {base[metric]:.2f} -> {current[metric]:.2f}")
+        if current["throughput"] < base["throughput"] / (1 + tolerance):
+            regressions.append(f"{name} throughput: {base['throughput']:.1f} -> {current['throughput']:.1f}/s")
+        # Small absolute slack: RSS deltas of a few MB are allocator noise.
+        if current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + memory_tolerance) + 2:
+            regressions.append(f"{name} peak_rss_mb: {base['peak_rss_mb']:.1f} -> {current['peak_rss_mb']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--profile", default="default", help="Rendition profile for process_job cases.")
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed latency/throughput regression.")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2, help="Allowed peak RSS regression.")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'case':<42} {'throughput':>10} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8}")
+    results = run_suite(args.repeat, args.profile)
+    args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+    print(f"Wrote {args.output}")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print(f"Updated {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["meta"] != results["meta"]:
+        print(f"[WARN] Baseline was recorded with {baseline['meta']}, now {results['meta']}")
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    if regressions:
+        # Rerun suspect cases once and keep the better numbers, so a noisy
+        # neighbour alone does not fail the run.
+        suspects = {regression.split(" ", 1)[0] for regression in regressions}
+        print(f"Re-running {len(suspects)} case(s) to confirm")
+        for name, (kind, path) in suite_cases().items():
+            if name in suspects:
+                rerun = run_isolated(name, kind, path, args.repeat, args.profile)
+                results["cases"][name] = best_of(results["cases"][name], rerun)
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 import os
+import re
+import threading
+import time
 import uuid
+from collections import deque
+from contextlib import contextmanager
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions
+from psycopg2.extras import Json, RealDictCursor, execute_values
 
 
 DATABASE_URL = os.environ.get(
@@ -10,97 +16,600 @@ DATABASE_URL = os.environ.get(
     "postgresql://image_resize:image_resize@db:5432/image_resize",
 )
 
+# Connection pool shared by every thread of the server and the processor.
+# Idle connections older than DB_POOL_HEALTHCHECK_SECONDS are pinged before
+# being handed out, and broken ones are replaced transparently.
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_HEALTHCHECK_SECONDS = float(os.environ.get("DB_POOL_HEALTHCHECK_SECONDS", 30))
+# Server-side prepared statements for the hot job queries. Disable when
+# running behind a transaction-pooling proxy such as PgBouncer.
+DB_PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "1") == "1"
+
+# NOTIFY channel carrying every job status transition as a JSON payload.
+JOB_STATUS_CHANNEL = "job_status"
+
+# Processing lanes a job can be queued in, and the tenant jobs are
+# attributed to when the client does not name one.
+JOB_PRIORITIES = ("interactive", "bulk")
+DEFAULT_TENANT = "default"
+
+# Every status a job moves through, from creation to a terminal state.
+JOB_STATUSES = ("pending", "in_progress", "retrying", "completed", "error")
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that remembers which statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool holding up to `maxconn` open connections. Unlike
+    psycopg2.pool it keeps every returned connection open for reuse and
+    blocks (up to `timeout`) instead of failing when all are in use.
+    """
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_seconds=DB_POOL_HEALTHCHECK_SECONDS,
+                 connect=None):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.healthcheck_seconds = healthcheck_seconds
+        self._connect = connect or (lambda: psycopg2.connect(dsn, connection_factory=PooledConnection))
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        for _ in range(minconn):
+            try:
+                self._idle.append((self._connect(), time.monotonic()))
+            except psycopg2.OperationalError as e:
+                print(f"[WARN] Could not pre-open pooled DB connection: {e}")
+                break
+
+    def _is_healthy(self, conn, idle_since) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout("timed out waiting for a database connection")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._connect()
+                conn, idle_since = item
+                if self._is_healthy(conn, idle_since):
+                    return conn
+                self._close(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        try:
+            if not discard and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool: ConnectionPool | None = None
+_pool_pid: int | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """The process-wide pool, created on first use (and again after fork)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(DATABASE_URL)
+                _pool_pid = pid
+    return _pool
+
 
 def get_connection():
-    return psycopg2.connect(DATABASE_URL)
+    """A new, unpooled connection."""
+    return psycopg2.connect(DATABASE_URL, connection_factory=PooledConnection)
 
 
-def init_db():
-    """Create the image_jobs table if it does not exist."""
-    conn = get_connection()
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection for one transaction: committed on success,
+    rolled back on error. Connections that fail at the protocol level are
+    discarded so the next caller gets a fresh one.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS image_jobs (
-                    id UUID PRIMARY KEY,
-                    filename TEXT NOT NULL,
-                    original_filename TEXT,
-                    status TEXT NOT NULL,
-                    error_message TEXT,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_image_jobs_filename
-                ON image_jobs (filename);
-                """
-            )
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
     finally:
-        conn.close()
+        pool.putconn(conn, discard=discard)
+
+
+def execute_prepared(cur, name: str, sql: str, types: str, params: tuple):
+    """
+    Run `sql` (with %s placeholders) as the server-side prepared statement
+    `name`, preparing it on first use on this connection. Must be the first
+    statement of its transaction, since the PREPARE is committed on its own.
+    """
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if not DB_PREPARED_STATEMENTS or prepared is None:
+        cur.execute(sql, params)
+        return
+    if name not in prepared:
+        counter = iter(range(1, len(params) + 1))
+        positional = re.sub(r"%s", lambda _m: f"${next(counter)}", sql).strip().rstrip(";")
+        cur.execute(f"PREPARE {name} ({types}) AS {positional}")
+        conn.commit()
+        prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def init_db():
+    """Create the image_jobs and rendition_cache tables if they do not exist."""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS image_jobs (
+                id UUID PRIMARY KEY,
+                filename TEXT NOT NULL,
+                original_filename TEXT,
+                status TEXT NOT NULL,
+                error_message TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        cur.execute(
+            """
+            ALTER TABLE image_jobs
+            ADD COLUMN IF NOT EXISTS renditions JSONB,
+            ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN,
+            ADD COLUMN IF NOT EXISTS priority TEXT NOT NULL DEFAULT 'interactive',
+            ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT 'default';
+            """
+        )
+        # Content-addressed map from (source hash, rendition) to an
+        # existing object in the resized bucket.
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rendition_cache (
+                cache_key TEXT PRIMARY KEY,
+                object_key TEXT NOT NULL,
+                size_bytes BIGINT NOT NULL,
+                hits BIGINT NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_image_jobs_filename
+            ON image_jobs (filename);
+            """
+        )
+        # Serves the resized-image listing: equality on status, then a
+        # keyset walk over (updated_at, id).
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_image_jobs_status_updated
+            ON image_jobs (status, updated_at, id);
+            """
+        )
+        # Serves the bulk job lookup when it filters on a time window but
+        # not on status; the status index above covers the other case.
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_image_jobs_updated
+            ON image_jobs (updated_at, id);
+            """
+        )
+        # Publish status transitions to LISTENers (see job_events.py). The
+        # trigger covers both the single-row and the batched status writes;
+        # notifications are delivered when the writing transaction commits.
+        # filename and renditions let the API drop cached renditions.
+        cur.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION notify_job_status() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{JOB_STATUS_CHANNEL}', json_build_object(
+                    'id', NEW.id,
+                    'status', NEW.status,
+                    'filename', NEW.filename,
+                    'renditions', NEW.renditions,
+                    'error_message', left(NEW.error_message, 1000),
+                    'cache_hit', NEW.cache_hit,
+                    'updated_at', NEW.updated_at
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        cur.execute(
+            """
+            CREATE OR REPLACE TRIGGER image_jobs_notify_status
+            AFTER UPDATE OF status ON image_jobs
+            FOR EACH ROW
+            WHEN (OLD.status IS DISTINCT FROM NEW.status)
+            EXECUTE FUNCTION notify_job_status();
+            """
+        )
 
 
 def create_job(
     filename: str,
     original_filename: str | None = None,
     job_id: str | None = None,
+    renditions: list[dict] | None = None,
+    priority: str = "interactive",
+    tenant: str = DEFAULT_TENANT,
 ) -> str:
-    """Insert a new image job with status 'pending' and return its UUID."""
+    """
+    Insert a new image job with status 'pending' and return its UUID.
+    `renditions` is the job's rendition spec; None means the default profile.
+    `priority` (one of JOB_PRIORITIES) and `tenant` decide how the
+    processor schedules it.
+    """
     if job_id is None:
         job_id = str(uuid.uuid4())
-    conn = get_connection()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO image_jobs (id, filename, original_filename, status)
-                VALUES (%s, %s, %s, 'pending');
-                """,
-                (job_id, filename, original_filename),
-            )
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor() as cur:
+        execute_prepared(
+            cur,
+            "create_job",
+            """
+            INSERT INTO image_jobs (id, filename, original_filename, status, renditions, priority, tenant)
+            VALUES (%s, %s, %s, 'pending', %s, %s, %s);
+            """,
+            "uuid, text, text, jsonb, text, text",
+            (job_id, filename, original_filename, Json(renditions) if renditions is not None else None,
+             priority, tenant),
+        )
     return job_id
 
 
-def update_job_status(job_id: str, status: str, error_message: str | None = None) -> None:
-    """Update the status (and optional error message) for a job."""
-    conn = get_connection()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE image_jobs
-                SET status = %s,
-                    error_message = %s,
-                    updated_at = NOW()
-                WHERE id = %s;
-                """,
-                (status, error_message, job_id),
-            )
-    finally:
-        conn.close()
+def create_jobs(jobs: list[tuple], priority: str = "bulk", tenant: str = DEFAULT_TENANT) -> None:
+    """
+    Insert many pending jobs with a single multi-row INSERT. Each job is
+    (job_id, filename, original_filename, renditions); all share `priority`
+    and `tenant`.
+    """
+    if not jobs:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO image_jobs (id, filename, original_filename, status, renditions, priority, tenant)
+            VALUES %s;
+            """,
+            [
+                (job_id, filename, original_filename, Json(renditions) if renditions is not None else None,
+                 priority, tenant)
+                for job_id, filename, original_filename, renditions in jobs
+            ],
+            template="(%s, %s, %s, 'pending', %s, %s, %s)",
+            page_size=len(jobs),
+        )
+
+
+def update_job_status(
+    job_id: str,
+    status: str,
+    error_message: str | None = None,
+    cache_hit: bool | None = None,
+) -> None:
+    """
+    Update the status (and optional error message) for a job. `cache_hit`
+    is left unchanged when None.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        execute_prepared(
+            cur,
+            "update_job_status",
+            """
+            UPDATE image_jobs
+            SET status = %s,
+                error_message = %s,
+                cache_hit = COALESCE(%s, cache_hit),
+                updated_at = NOW()
+            WHERE id = %s;
+            """,
+            "text, text, boolean, uuid",
+            (status, error_message, cache_hit, job_id),
+        )
+
+
+def update_job_statuses(updates: list[tuple]) -> None:
+    """
+    Apply many status transitions in one statement. Each update is
+    (job_id, status, error_message, cache_hit); a None cache_hit leaves the
+    column unchanged. Job ids must be unique. updated_at is the database's
+    clock, not the caller's, so the `since` feeds of list_completed_jobs
+    and get_jobs see rows in the order the database wrote them.
+    """
+    if not updates:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            UPDATE image_jobs AS j
+            SET status = v.status,
+                error_message = v.error_message,
+                cache_hit = COALESCE(v.cache_hit, j.cache_hit),
+                updated_at = NOW()
+            FROM (VALUES %s) AS v(id, status, error_message, cache_hit)
+            WHERE j.id = v.id;
+            """,
+            updates,
+            template="(%s::uuid, %s, %s, %s::boolean)",
+            page_size=len(updates),
+        )
 
 
 def get_job(job_id: str) -> dict | None:
     """Fetch a job record by ID."""
-    conn = get_connection()
-    try:
-        with conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT id, filename, original_filename, status, error_message,
-                       created_at, updated_at
-                FROM image_jobs
-                WHERE id = %s;
-                """,
-                (job_id,),
-            )
-            row = cur.fetchone()
-            return dict(row) if row else None
-    finally:
-        conn.close()
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        execute_prepared(
+            cur,
+            "get_job",
+            """
+            SELECT id, filename, original_filename, status, error_message,
+                   renditions, cache_hit, priority, tenant, created_at, updated_at
+            FROM image_jobs
+            WHERE id = %s;
+            """,
+            "uuid",
+            (job_id,),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+
+def get_job_lane(job_id: str) -> tuple[str, str] | None:
+    """(priority, tenant) of a job, or None if it does not exist."""
+    with connection() as conn, conn.cursor() as cur:
+        execute_prepared(
+            cur,
+            "get_job_lane",
+            "SELECT priority, tenant FROM image_jobs WHERE id = %s;",
+            "uuid",
+            (job_id,),
+        )
+        row = cur.fetchone()
+        return (row[0], row[1]) if row else None
+
+
+def list_completed_jobs(
+    limit: int,
+    cursor: tuple | None = None,
+    since=None,
+) -> list[dict]:
+    """
+    Completed jobs, newest first, using keyset pagination. `cursor` is the
+    (updated_at, id) of the last row of the previous page; `since` keeps
+    only jobs completed after that time.
+    """
+    conditions = ["status = 'completed'"]
+    params = []
+    if since is not None:
+        conditions.append("updated_at > %s")
+        params.append(since)
+    if cursor is not None:
+        conditions.append("(updated_at, id) < (%s, %s)")
+        params.extend(cursor)
+    params.append(limit)
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            f"""
+            SELECT id, filename, renditions, updated_at
+            FROM image_jobs
+            WHERE {' AND '.join(conditions)}
+            ORDER BY updated_at DESC, id DESC
+            LIMIT %s;
+            """,
+            params,
+        )
+        return [dict(row) for row in cur.fetchall()]
+
+
+def get_jobs(
+    job_ids: list[str] | None = None,
+    statuses: list[str] | None = None,
+    since=None,
+    until=None,
+    limit: int | None = None,
+    cursor: tuple | None = None,
+) -> list[dict]:
+    """
+    Compact status rows for many jobs in one query, newest first. Any
+    combination of `job_ids` (valid UUIDs), `statuses` and an updated_at
+    window [since, until) narrows the result; `limit` and `cursor` (the
+    (updated_at, id) of the previous page's last row) page through it.
+    """
+    conditions = []
+    params = []
+    if job_ids is not None:
+        conditions.append("id = ANY(%s::uuid[])")
+        params.append(list(job_ids))
+    if statuses:
+        conditions.append("status = ANY(%s)")
+        params.append(list(statuses))
+    if since is not None:
+        conditions.append("updated_at > %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("updated_at <= %s")
+        params.append(until)
+    if cursor is not None:
+        conditions.append("(updated_at, id) < (%s, %s)")
+        params.extend(cursor)
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "LIMIT %s"
+        params.append(limit)
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            f"""
+            SELECT id, status, error_message, cache_hit, updated_at
+            FROM image_jobs
+            WHERE {' AND '.join(conditions) or 'TRUE'}
+            ORDER BY updated_at DESC, id DESC
+            {limit_clause};
+            """,
+            params,
+        )
+        return [dict(row) for row in cur.fetchall()]
+
+
+def find_cached_renditions(cache_keys: list[str]) -> dict[str, str]:
+    """Map each known cache key to the resized object that holds it."""
+    if not cache_keys:
+        return {}
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT cache_key, object_key
+            FROM rendition_cache
+            WHERE cache_key = ANY(%s);
+            """,
+            (list(cache_keys),),
+        )
+        return dict(cur.fetchall())
+
+
+def record_cached_renditions(entries: list[tuple[str, str, int]]) -> None:
+    """
+    Store (cache_key, object_key, size_bytes) rows. A key that is already
+    known now points at the new object: it is only re-rendered when the old
+    one could not be copied.
+    """
+    if not entries:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO rendition_cache (cache_key, object_key, size_bytes)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET object_key = EXCLUDED.object_key,
+                size_bytes = EXCLUDED.size_bytes;
+            """,
+            entries,
+        )
+
+
+def forget_cached_renditions(cache_keys: list[str]) -> None:
+    """Drop cache entries whose object has gone from the resized bucket."""
+    if not cache_keys:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            DELETE FROM rendition_cache
+            WHERE cache_key = ANY(%s);
+            """,
+            (list(cache_keys),),
+        )
+
+
+def record_cache_hits(cache_keys: list[str]) -> None:
+    """Count one hit against each of the given cache keys."""
+    if not cache_keys:
+        return
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE rendition_cache
+            SET hits = hits + 1
+            WHERE cache_key = ANY(%s);
+            """,
+            (list(cache_keys),),
+        )
+
 
+def get_cache_stats() -> dict:
+    """Job-level hit rate and rendition bytes served by copy instead of resize."""
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT COUNT(*) FILTER (WHERE cache_hit) AS job_hits,
+                   COUNT(*) AS completed_jobs
+            FROM image_jobs
+            WHERE status = 'completed';
+            """
+        )
+        jobs = cur.fetchone()
+        cur.execute(
+            """
+            SELECT COUNT(*) AS entries,
+                   COALESCE(SUM(hits), 0) AS rendition_hits,
+                   COALESCE(SUM(hits * size_bytes), 0) AS bytes_saved
+            FROM rendition_cache;
+            """
+        )
+        cache = cur.fetchone()
+    completed = jobs['completed_jobs']
+    return {
+        'job_hits': jobs['job_hits'],
+        'completed_jobs': completed,
+        'hit_rate': jobs['job_hits'] / completed if completed else 0.0,
+        'entries': cache['entries'],
+        'rendition_hits': int(cache['rendition_hits']),
+        'bytes_saved': int(cache['bytes_saved']),
+    }
@@ -0,0 +1,180 @@
+"""
+asyncpg counterparts of the db.py queries used by the ASGI server. Rows
+come back with the same keys and Python types as db.py (ids as strings,
+renditions decoded from JSON), so both servers render identical JSON.
+The schema is still owned by db.init_db().
+"""
+import json
+import os
+
+import asyncpg
+
+from db import DATABASE_URL, DB_PREPARED_STATEMENTS, DEFAULT_TENANT
+
+
+DB_ASYNC_POOL_MIN = int(os.environ.get("DB_ASYNC_POOL_MIN", 2))
+DB_ASYNC_POOL_MAX = int(os.environ.get("DB_ASYNC_POOL_MAX", 20))
+DB_ASYNC_POOL_TIMEOUT = float(os.environ.get("DB_ASYNC_POOL_TIMEOUT", 10))
+
+_pool: asyncpg.Pool | None = None
+
+
+async def _init_connection(conn):
+    for codec_type in ("json", "jsonb"):
+        await conn.set_type_codec(codec_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def open_pool() -> asyncpg.Pool:
+    """Create the process-wide pool; call once from the event loop that uses it."""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_ASYNC_POOL_MIN,
+            max_size=DB_ASYNC_POOL_MAX,
+            init=_init_connection,
+            # asyncpg prepares every statement; a size of 0 turns that off
+            # for transaction-pooling proxies, like DB_PREPARED_STATEMENTS.
+            statement_cache_size=100 if DB_PREPARED_STATEMENTS else 0,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        raise RuntimeError("open_pool() has not been awaited")
+    return _pool
+
+
+def _row(record) -> dict:
+    row = dict(record)
+    if "id" in row:
+        row["id"] = str(row["id"])
+    return row
+
+
+async def create_job(
+    filename: str,
+    original_filename: str | None = None,
+    job_id: str | None = None,
+    renditions: list[dict] | None = None,
+    priority: str = "interactive",
+    tenant: str = DEFAULT_TENANT,
+) -> str:
+    """Insert a new image job with status 'pending' and return its UUID."""
+    await get_pool().execute(
+        """
+        INSERT INTO image_jobs (id, filename, original_filename, status, renditions, priority, tenant)
+        VALUES ($1, $2, $3, 'pending', $4, $5, $6);
+        """,
+        job_id, filename, original_filename, renditions, priority, tenant,
+        timeout=DB_ASYNC_POOL_TIMEOUT,
+    )
+    return job_id
+
+
+async def update_job_status(job_id: str, status: str, error_message: str | None = None) -> None:
+    """Update the status (and optional error message) for a job."""
+    await get_pool().execute(
+        """
+        UPDATE image_jobs
+        SET status = $1, error_message = $2, updated_at = NOW()
+        WHERE id = $3::text::uuid;
+        """,
+        status, error_message, job_id,
+        timeout=DB_ASYNC_POOL_TIMEOUT,
+    )
+
+
+async def get_job(job_id: str) -> dict | None:
+    """Fetch a job record by ID; None when it does not exist or is not a UUID."""
+    try:
+        record = await get_pool().fetchrow(
+            """
+            SELECT id, filename, original_filename, status, error_message,
+                   renditions, cache_hit, priority, tenant, created_at, updated_at
+            FROM image_jobs
+            WHERE id = $1::text::uuid;
+            """,
+            job_id,
+            timeout=DB_ASYNC_POOL_TIMEOUT,
+        )
+    except asyncpg.InvalidTextRepresentationError:
+        return None
+    return _row(record) if record else None
+
+
+async def list_completed_jobs(limit: int, cursor: tuple | None = None, since=None) -> list[dict]:
+    """Completed jobs, newest first, with the keyset pagination of db.list_completed_jobs."""
+    conditions = ["status = 'completed'"]
+    params = []
+    if since is not None:
+        params.append(since)
+        conditions.append(f"updated_at > ${len(params)}")
+    if cursor is not None:
+        params.extend(cursor)
+        conditions.append(f"(updated_at, id) < (${len(params) - 1}, ${len(params)}::text::uuid)")
+    params.append(limit)
+    records = await get_pool().fetch(
+        f"""
+        SELECT id, filename, renditions, updated_at
+        FROM image_jobs
+        WHERE {' AND '.join(conditions)}
+        ORDER BY updated_at DESC, id DESC
+        LIMIT ${len(params)};
+        """,
+        *params,
+        timeout=DB_ASYNC_POOL_TIMEOUT,
+    )
+    return [_row(record) for record in records]
+
+
+async def get_jobs(
+    job_ids: list[str] | None = None,
+    statuses: list[str] | None = None,
+    since=None,
+    until=None,
+    limit: int | None = None,
+    cursor: tuple | None = None,
+) -> list[dict]:
+    """Compact status rows for many jobs in one query; see db.get_jobs."""
+    conditions = []
+    params = []
+    if job_ids is not None:
+        params.append(list(job_ids))
+        conditions.append(f"id = ANY(${len(params)}::text[]::uuid[])")
+    if statuses:
+        params.append(list(statuses))
+        conditions.append(f"status = ANY(${len(params)}::text[])")
+    if since is not None:
+        params.append(since)
+        conditions.append(f"updated_at > ${len(params)}")
+    if until is not None:
+        params.append(until)
+        conditions.append(f"updated_at <= ${len(params)}")
+    if cursor is not None:
+        params.extend(cursor)
+        conditions.append(f"(updated_at, id) < (${len(params) - 1}, ${len(params)}::text::uuid)")
+    limit_clause = ""
+    if limit is not None:
+        params.append(limit)
+        limit_clause = f"LIMIT ${len(params)}"
+    records = await get_pool().fetch(
+        f"""
+        SELECT id, status, error_message, cache_hit, updated_at
+        FROM image_jobs
+        WHERE {' AND '.join(conditions) or 'TRUE'}
+        ORDER BY updated_at DESC, id DESC
+        {limit_clause};
+        """,
+        *params,
+        timeout=DB_ASYNC_POOL_TIMEOUT,
+    )
+    return [_row(record) for record in records]
@@ -1,50 +1,598 @@
+import argparse
+import atexit
+import functools
+import hashlib
+import io
 import json
+import math
 import os
+import random
+import signal
 import time
-import socket
+import tempfile
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
 from urllib.parse import unquote
 
 import pika
-from minio import Minio
-from minio.error import S3Error
+import psycopg2
 from PIL import Image
 
-from db import init_db, update_job_status
+import metrics
+from db import (
+    DEFAULT_TENANT,
+    JOB_PRIORITIES,
+    find_cached_renditions,
+    forget_cached_renditions,
+    get_job,
+    get_job_lane,
+    init_db,
+    record_cache_hits,
+    record_cached_renditions,
+    update_job_status,
+    update_job_statuses,
+)
+import storage
+from renditions import DEFAULT_PROFILE, DEFAULT_RENDITION, rendition_key, resolve_renditions
+from resize_engines import (
+    RESIZE_ENGINE, RESIZE_MODE, RESIZE_MODES, ImageTooLarge, MemoryBudget, load_engine, plan_decode,
+)
 
 
 RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'localhost')
-MINIO_ROOT_USER = os.environ.get('MINIO_ROOT_USER', 'minioadmin')
-MINIO_ROOT_PASSWORD = os.environ.get('MINIO_ROOT_PASSWORD', 'minioadmin')
-MINIO_ENDPOINT = os.environ.get('MINIO_ENDPOINT', 'minio:9000')
 
 UPLOADS_DIR = './uploads'
 RESIZED_DIR = './resized'
 BUCKET_NAME = 'resized'
 
-# Connect to MinIO
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ROOT_USER,
-    secret_key=MINIO_ROOT_PASSWORD,
-    secure=False
-)
+# Streaming mode keeps source and result in memory instead of round-tripping
+# through UPLOADS_DIR/RESIZED_DIR. Buffers larger than SPOOL_MAX_BYTES spill
+# to a temp file in SPOOL_DIR (point it at a tmpfs such as /dev/shm).
+STREAMING_MODE = os.environ.get('PROCESSOR_STREAMING', '1') == '1'
+SPOOL_MAX_BYTES = int(os.environ.get('PROCESSOR_SPOOL_MAX_BYTES', 32 * 1024 * 1024))
+SPOOL_DIR = os.environ.get('PROCESSOR_SPOOL_DIR') or None
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Content-hash deduplication: renditions already produced from identical
+# source bytes are copied server-side instead of being decoded again. Bump
+# CACHE_VERSION whenever rendering changes in a way that alters the output.
+DEDUP_ENABLED = os.environ.get('PROCESSOR_DEDUP', '1') == '1'
+CACHE_VERSION = 2
+
+# Resize engine (see resize_engines.py): pillow, vips or opencv. A missing
+# optional engine falls back to Pillow. PROCESSOR_RESIZE_MODE picks the
+# quality-vs-speed trade-off of whichever engine runs.
+resize_engine = load_engine(RESIZE_ENGINE)
+
+# Decode memory admission. Before a job decodes, its image header is read
+# (without decoding) to estimate the job's peak memory, and the job
+# reserves that much of MEMORY_BUDGET, waiting in arrival order while it is
+# taken; a job may always run alone. Images that would need more than
+# DECODE_REDUCE_BYTES are decoded at reduced resolution where the format
+# allows it (JPEG), and anything still above DECODE_MAX_BYTES is rejected
+# as a permanent error. Admitted decodes skip Pillow's own pixel limit,
+# which would refuse large JPEGs before they could be decoded reduced;
+# every other decode in the process keeps it.
+MEMORY_BUDGET = int(os.environ.get('PROCESSOR_MEMORY_BUDGET', 1024 * 1024 * 1024))
+DECODE_MAX_BYTES = int(os.environ.get('PROCESSOR_DECODE_MAX_BYTES', MEMORY_BUDGET))
+DECODE_REDUCE_BYTES = int(os.environ.get('PROCESSOR_DECODE_REDUCE_BYTES', MEMORY_BUDGET // 4))
+
+# Execution engine: PROCESSOR_WORKERS processes decode/resize while
+# PROCESSOR_IO_THREADS threads handle MinIO/DB I/O. 0 workers resizes on the
+# I/O threads. The AMQP prefetch window defaults to the number of I/O threads
+# so every thread always has a message to work on.
+CPU_WORKERS = int(os.environ.get('PROCESSOR_WORKERS', os.cpu_count() or 1))
+IO_THREADS = int(os.environ.get('PROCESSOR_IO_THREADS', max(2, 2 * CPU_WORKERS)))
+PREFETCH_COUNT = int(os.environ.get('PROCESSOR_PREFETCH', IO_THREADS))
+
+# Job status transitions are queued and written in batches of up to
+# STATUS_BATCH_SIZE jobs, at least every STATUS_FLUSH_INTERVAL seconds.
+STATUS_BATCH_SIZE = int(os.environ.get('PROCESSOR_STATUS_BATCH_SIZE', 100))
+STATUS_FLUSH_INTERVAL = float(os.environ.get('PROCESSOR_STATUS_FLUSH_INTERVAL', 0.5))
+
+# Failed jobs are never retried in place. A transient failure (object not
+# there yet, MinIO or DB unavailable) republishes the event to a retry
+# queue whose TTL dead-letters it back onto JOBS_QUEUE after the delay for
+# that attempt; after MAX_ATTEMPTS, or on a permanent failure such as an
+# undecodable image, the event goes to DEAD_LETTER_QUEUE.
+JOBS_QUEUE = 'minio_events_queue'
+DEAD_LETTER_QUEUE = 'minio_events_dlq'
+RETRY_DELAYS = [int(d) for d in os.environ.get('PROCESSOR_RETRY_DELAYS', '2,5,15,60').split(',')]
+MAX_ATTEMPTS = int(os.environ.get('PROCESSOR_MAX_ATTEMPTS', 5))
+ATTEMPT_HEADER = 'x-attempt'
+RETRYABLE_S3_CODES = {'NoSuchKey', 'NoSuchBucket', 'SlowDown', 'InternalError', 'ServiceUnavailable', 'RequestTimeout'}
+
+# Startup and reconnects: the worker consumes as soon as RabbitMQ accepts a
+# connection, retrying with full-jitter exponential backoff from
+# CONNECT_BACKOFF_BASE up to CONNECT_BACKOFF_MAX seconds so replicas do not
+# reconnect in lockstep. Postgres and MinIO are warmed up in the background.
+# On SIGTERM the worker stops consuming, hands back deliveries that have not
+# started, and gives running jobs DRAIN_SECONDS to finish before exiting.
+CONNECT_BACKOFF_BASE = 0.1
+CONNECT_BACKOFF_MAX = float(os.environ.get('PROCESSOR_CONNECT_BACKOFF_MAX', 10))
+DRAIN_SECONDS = float(os.environ.get('PROCESSOR_DRAIN_SECONDS', 25))
+
+# Priority lanes. MinIO publishes every upload event to JOBS_QUEUE; the
+# router moves each one to the queue of its job's lane (see server.py's
+# job_tags), tagged with the tenant. Bulk messages get a RabbitMQ priority
+# that drops as the tenant's recent volume grows (one step per doubling past
+# TENANT_BURST events, decaying with a TENANT_HALF_LIFE), so a small batch
+# overtakes a large backlog. Workers always leave INTERACTIVE_RESERVED of
+# the IO_THREADS job slots to the interactive lane, and a tenant already
+# running TENANT_MAX_JOBS jobs only gets a slot no other tenant is waiting for.
+LANE_QUEUES = {'interactive': 'minio_events_interactive', 'bulk': 'minio_events_bulk'}
+TENANT_HEADER = 'x-tenant'
+BULK_MAX_PRIORITY = 9
+TENANT_BURST = int(os.environ.get('PROCESSOR_TENANT_BURST', 10))
+TENANT_HALF_LIFE = float(os.environ.get('PROCESSOR_TENANT_HALF_LIFE', 60))
+INTERACTIVE_RESERVED = int(os.environ.get('PROCESSOR_INTERACTIVE_RESERVED', max(1, IO_THREADS // 4)))
+TENANT_MAX_JOBS = int(os.environ.get('PROCESSOR_TENANT_MAX_JOBS', max(1, IO_THREADS // 2)))
+# Bulk deliveries beyond the running jobs wait in the worker, so the window
+# is wide enough for other tenants' messages to arrive while one tenant's
+# wait. Routing is a single indexed lookup, so the router prefetches more.
+BULK_PREFETCH = int(os.environ.get('PROCESSOR_BULK_PREFETCH', 2 * IO_THREADS))
+ROUTER_PREFETCH = 64
+ROUTER_THREADS = 2
+
+# Prometheus-style metrics, served at :PROCESSOR_METRICS_PORT/metrics
+# (0 disables the endpoint). Decode, resize and encode are timed inside the
+# worker process and reported back with the rendered bytes.
+METRICS_PORT = int(os.environ.get('PROCESSOR_METRICS_PORT', 9100))
+STAGE_SECONDS = metrics.Histogram(
+    'image_processor_stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+JOB_SECONDS = metrics.Histogram(
+    'image_processor_job_seconds', 'End-to-end processing time per job.', ['outcome'])
+JOBS_TOTAL = metrics.Counter(
+    'image_processor_jobs_total', 'Jobs processed, by outcome.', ['outcome'])
+JOBS_IN_PROGRESS = metrics.Gauge(
+    'image_processor_jobs_in_progress', 'Jobs currently being processed.')
+BYTES_IN = metrics.Counter(
+    'image_processor_bytes_in_total', 'Source bytes downloaded from MinIO.')
+BYTES_OUT = metrics.Counter(
+    'image_processor_bytes_out_total', 'Rendition bytes uploaded to MinIO.')
+QUEUE_LAG_SECONDS = metrics.Histogram(
+    'image_processor_queue_lag_seconds', 'Delay between the MinIO event and the start of processing.')
+RETRIES_SCHEDULED = metrics.Counter(
+    'image_processor_retries_total', 'Jobs requeued through a delayed-retry queue.')
+DEAD_LETTERED = metrics.Counter(
+    'image_processor_dead_letters_total', 'Jobs routed to the dead-letter queue.')
+EVENTS_ROUTED = metrics.Counter(
+    'image_processor_events_routed_total', 'Upload events moved to a lane queue.', ['lane'])
+JOBS_WAITING = metrics.Gauge(
+    'image_processor_jobs_waiting', 'Delivered jobs waiting for a free slot, by lane.', ['lane'])
+STARTUP_SECONDS = metrics.Gauge(
+    'image_processor_startup_seconds', 'Seconds from importing the worker to its last start of consuming.')
+PROCESS_STARTED = time.monotonic()
+MEMORY_BUDGET_BYTES = metrics.Gauge(
+    'image_processor_memory_budget_bytes', 'Decode memory jobs may reserve at once.')
+MEMORY_RESERVED_BYTES = metrics.Gauge(
+    'image_processor_memory_reserved_bytes', 'Estimated decode memory reserved by running jobs.')
+DECODES_REDUCED = metrics.Counter(
+    'image_processor_reduced_decodes_total', 'Images decoded at reduced resolution to fit the memory limits.')
+DECODES_REJECTED = metrics.Counter(
+    'image_processor_decode_rejections_total', 'Images rejected for needing more than the decode memory cap.')
+
+# Set by main() when CPU_WORKERS > 0.
+cpu_pool: 'ProcessPoolExecutor | None' = None
+_cpu_pool_lock = threading.Lock()
+# Set by main(); without it status updates are written synchronously.
+status_writer: 'StatusWriter | None' = None
+# Set by SIGTERM/SIGINT; main() drains and returns.
+shutdown_requested = threading.Event()
+
+# One keep-alive connection per I/O thread, built on first use.
+minio_client = storage.LazyClient(pool_size=IO_THREADS)
+
+
+memory_budget = MemoryBudget(MEMORY_BUDGET, MEMORY_RESERVED_BYTES)
+MEMORY_BUDGET_BYTES.set(MEMORY_BUDGET)
 
 
 def ensure_bucket():
-    if not minio_client.bucket_exists(BUCKET_NAME):
-        minio_client.make_bucket(BUCKET_NAME)
+    """Memoized: only the first job (or the first after a NoSuchBucket) checks."""
+    storage.ensure_bucket(minio_client, BUCKET_NAME)
+
+
+def render_renditions(source, renditions: list[dict], mode: str | None = None,
+                      timings: dict | None = None, reduced: bool = False,
+                      admitted: bool = False) -> list[tuple[bytes, str]]:
+    """
+    Decode `source` (a path or binary file object) once and return the
+    encoded bytes and format of every rendition, in input order, using the
+    configured resize engine. Seconds spent decoding, resizing and encoding
+    are added to `timings`. `reduced` asks for a reduced-resolution decode,
+    and `admitted` (only from admit_render) lifts Pillow's pixel limit.
+    """
+    return resize_engine.render(source, renditions, mode, timings, reduced, admitted)
+
+
+def admit_render(source, renditions: list[dict], render):
+    """
+    Call `render(renditions, reduced)` once the job's estimated decode
+    memory fits in memory_budget; `render` passes admitted=True on. The
+    estimate comes from the header of `source` (a path or seekable file
+    object); raises ImageTooLarge when even a reduced decode would need
+    more than DECODE_MAX_BYTES.
+    """
+    try:
+        size, estimate, reduced = plan_decode(source, renditions, DECODE_MAX_BYTES, DECODE_REDUCE_BYTES)
+    except ImageTooLarge:
+        DECODES_REJECTED.inc()
+        raise
+    if reduced:
+        DECODES_REDUCED.inc()
+        print(f"Decoding {size[0]}x{size[1]} image at reduced resolution to fit the memory limits.")
+    with STAGE_SECONDS.time(stage='memory_wait'):
+        memory_budget.acquire(estimate)
+    try:
+        return render(renditions, reduced)
+    finally:
+        memory_budget.release(estimate)
+
+
+def resize_image(image_path, output_path, size=(256, 256), mode: str | None = None):
+    """
+    Resize `image_path` into `output_path` and return the output format.
+    Both arguments may be paths or binary file objects; the result is
+    encoded in the source format. `mode` is a RESIZE_MODES key and defaults
+    to RESIZE_MODE.
+    """
+    rendition = {'name': DEFAULT_RENDITION, 'width': size[0], 'height': size[1], 'fit': 'stretch'}
+    [(data, fmt)] = render_renditions(image_path, [rendition], mode)
+    if hasattr(output_path, 'write'):
+        output_path.write(data)
+    else:
+        with open(output_path, 'wb') as fh:
+            fh.write(data)
+    return fmt
+
 
+def render_bytes(data: bytes, renditions: list[dict], reduced: bool = False,
+                 admitted: bool = False) -> tuple[list[tuple[bytes, str]], dict]:
+    """Picklable render entry point for the CPU process pool."""
+    timings = {}
+    return render_renditions(io.BytesIO(data), renditions, timings=timings, reduced=reduced, admitted=admitted), timings
 
-def resize_image(image_path, output_path, size=(256, 256)):
-    with Image.open(image_path) as img:
-        img = img.resize(size)
-        img.save(output_path)
 
+def record_stage_timings(timings: dict):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def render_source(source, renditions: list[dict], reduced: bool = False,
+                  admitted: bool = False) -> list[tuple[bytes, str]]:
+    """Render a source file object, on the CPU pool when one is running."""
+    if cpu_pool is None:
+        timings = {}
+        results = render_renditions(source, renditions, timings=timings, reduced=reduced, admitted=admitted)
+    else:
+        pool = cpu_pool
+        try:
+            results, timings = pool.submit(render_bytes, source.read(), renditions, reduced, admitted).result()
+        except BrokenProcessPool:
+            # A render child died (OOM kill, decoder crash) and took the pool
+            # with it; the job is retried (see is_retryable) on a fresh pool.
+            replace_cpu_pool(pool)
+            raise
+    record_stage_timings(timings)
+    return results
+
+
+def replace_cpu_pool(broken: ProcessPoolExecutor):
+    """Swap a broken CPU pool for a new one, once however many jobs saw it break."""
+    global cpu_pool
+    with _cpu_pool_lock:
+        if cpu_pool is not broken:
+            return
+        print("[WARN] A render process died; starting a new CPU pool.")
+        cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS)
+    broken.shutdown(wait=False)
+
+
+def spooled_buffer():
+    """In-memory buffer that spills to SPOOL_DIR past SPOOL_MAX_BYTES."""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, dir=SPOOL_DIR)
+
+
+def fetch_object(bucket_name: str, object_name: str, digest=None):
+    """
+    Stream an object from MinIO into a spooled buffer, rewound to 0,
+    feeding each chunk to the hashlib object `digest` when given.
+    """
+    buffer = spooled_buffer()
+    response = minio_client.get_object(bucket_name, object_name)
+    received = 0
+    try:
+        for chunk in response.stream(STREAM_CHUNK_SIZE):
+            buffer.write(chunk)
+            received += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+    except Exception:
+        buffer.close()
+        raise
+    finally:
+        response.close()
+        response.release_conn()
+        BYTES_IN.inc(received)
+    buffer.seek(0)
+    return buffer
+
+
+def load_renditions(job_id: str | None) -> list[dict]:
+    """
+    Renditions requested for a job, or the default profile when it has no
+    row or asked for none. A database error propagates, so the event is
+    retried instead of rendered with the wrong renditions.
+    """
+    if job_id:
+        with STAGE_SECONDS.time(stage='db_lookup'):
+            job = get_job(job_id)
+        if job and job.get('renditions'):
+            return job['renditions']
+    return resolve_renditions(DEFAULT_PROFILE)
+
+
+def rendition_cache_key(source_hash: str, rendition: dict) -> str:
+    """
+    Content address of a rendition: the source bytes' hash plus everything
+    that affects the output pixels. The rendition name only affects the key
+    it is stored under, so it is left out.
+    """
+    params = {k: v for k, v in rendition.items() if k != 'name'}
+    material = json.dumps([CACHE_VERSION, source_hash, resize_engine.name, RESIZE_MODE, params], sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def copy_cached_rendition(source_key: str, target_key: str) -> bool:
+    """Server-side copy of an existing rendition; False if it has gone."""
+    if source_key == target_key:
+        return True
+    from minio.commonconfig import CopySource
+
+    try:
+        minio_client.copy_object(BUCKET_NAME, target_key, CopySource(BUCKET_NAME, source_key))
+        return True
+    except storage.S3Error as e:
+        if e.code == "NoSuchKey":
+            return False
+        raise
+
+
+def publish_renditions(filename: str, renditions: list[dict], source_hash: str | None, render, store) -> bool:
+    """
+    Write every rendition of `filename` to BUCKET_NAME. Renditions already
+    produced from identical source bytes are copied server-side; the rest
+    are built with `render(renditions)` and written with
+    `store(key, data, fmt)`. Returns True when nothing had to be decoded.
+    """
+    cache_keys = [None] * len(renditions)
+    cached = {}
+    if source_hash is not None:
+        cache_keys = [rendition_cache_key(source_hash, r) for r in renditions]
+        try:
+            with STAGE_SECONDS.time(stage='cache_lookup'):
+                cached = find_cached_renditions(cache_keys)
+        except Exception as e:
+            print(f"[WARN] Rendition cache lookup failed: {e}")
 
-def safe_update_job_status(job_id: str, status: str, error_message: str | None = None):
+    with STAGE_SECONDS.time(stage='ensure_bucket'):
+        ensure_bucket()
+    hits, missing, stale = [], [], []
+    for rendition, cache_key in zip(renditions, cache_keys):
+        target_key = rendition_key(filename, rendition)
+        source_key = cached.get(cache_key)
+        copied = False
+        if source_key:
+            with STAGE_SECONDS.time(stage='copy'):
+                copied = copy_cached_rendition(source_key, target_key)
+            if not copied:
+                stale.append(cache_key)
+        if copied:
+            hits.append(cache_key)
+        else:
+            missing.append((rendition, cache_key, target_key))
+    if stale:
+        # The render below re-records these keys; dropping them first keeps
+        # other jobs from copying a missing object if that render fails.
+        try:
+            forget_cached_renditions(stale)
+        except Exception as e:
+            print(f"[WARN] Failed to drop stale rendition cache entries: {e}")
+
+    new_entries = []
+    if missing:
+        outputs = render([rendition for rendition, _, _ in missing])
+        print(f"Successfully resized {filename}.")
+        for (rendition, cache_key, target_key), (data, fmt) in zip(missing, outputs):
+            with STAGE_SECONDS.time(stage='upload'):
+                store(target_key, data, fmt)
+            BYTES_OUT.inc(len(data))
+            if cache_key is not None:
+                new_entries.append((cache_key, target_key, len(data)))
+    else:
+        print(f"Served all renditions of {filename} from the dedup cache.")
+
+    try:
+        with STAGE_SECONDS.time(stage='cache_record'):
+            record_cache_hits(hits)
+            record_cached_renditions(new_entries)
+    except Exception as e:
+        print(f"[WARN] Failed to update rendition cache: {e}")
+    return not missing
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_object_on_disk(bucket_name: str, filename: str, renditions: list[dict]) -> bool:
+    """File-based path: download, resize and upload via UPLOADS_DIR/RESIZED_DIR."""
+    input_path = os.path.join(UPLOADS_DIR, os.path.basename(filename))
+
+    with STAGE_SECONDS.time(stage='download'):
+        minio_client.fget_object(bucket_name, filename, input_path)
+    # Print file size for debugging
+    try:
+        file_size = os.path.getsize(input_path)
+        print(f"Downloaded file size: {file_size} bytes")
+        BYTES_IN.inc(file_size)
+    except Exception as e:
+        print(f"Error checking file size: {e}")
+
+    def store(key, data, fmt):
+        output_path = os.path.join(RESIZED_DIR, key)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as fh:
+            fh.write(data)
+        minio_client.fput_object(
+            BUCKET_NAME,
+            key,
+            output_path,
+            content_type=Image.MIME.get(fmt, 'application/octet-stream'),
+        )
+
+    def render(todo, reduced):
+        timings = {}
+        results = render_renditions(input_path, todo, timings=timings, reduced=reduced, admitted=True)
+        record_stage_timings(timings)
+        return results
+
+    source_hash = None
+    if DEDUP_ENABLED:
+        with STAGE_SECONDS.time(stage='hash'):
+            source_hash = hash_file(input_path)
+    return publish_renditions(
+        filename, renditions, source_hash, lambda todo: admit_render(input_path, todo, render), store)
+
+
+def process_object_streaming(bucket_name: str, filename: str, renditions: list[dict]) -> bool:
+    """Streaming path: get_object -> resize in memory -> put_object."""
+    def store(key, data, fmt):
+        minio_client.put_object(
+            BUCKET_NAME,
+            key,
+            io.BytesIO(data),
+            length=len(data),
+            content_type=Image.MIME.get(fmt, 'application/octet-stream'),
+        )
+
+    digest = hashlib.sha256() if DEDUP_ENABLED else None
+    with STAGE_SECONDS.time(stage='download'):
+        source = fetch_object(bucket_name, filename, digest)
+    with source:
+        print(f"Downloaded file size: {source.seek(0, os.SEEK_END)} bytes")
+        source.seek(0)
+        return publish_renditions(
+            filename,
+            renditions,
+            digest.hexdigest() if digest else None,
+            lambda todo: admit_render(source, todo, functools.partial(render_source, source, admitted=True)),
+            store,
+        )
+
+
+class StatusWriter:
+    """
+    Queues job status transitions and writes them in batches from a
+    background thread, so a slow or unavailable database never blocks image
+    processing. Transitions for the same job collapse to the latest one;
+    a flush that fails with a connection error is retried on the next cycle
+    without overriding anything newer. close() flushes whatever is pending.
+    """
+
+    def __init__(self, write=update_job_statuses, batch_size: int = STATUS_BATCH_SIZE,
+                 interval: float = STATUS_FLUSH_INTERVAL):
+        self.write = write
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending: dict[str, tuple] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='status-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, job_id: str, status: str, error_message: str | None = None,
+               cache_hit: bool | None = None):
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            print(f"[WARN] Ignoring status '{status}' for invalid job id {job_id!r}")
+            return
+        with self._cond:
+            previous = self._pending.get(job_id)
+            if cache_hit is None and previous is not None:
+                cache_hit = previous[3]
+            self._pending[job_id] = (job_id, status, error_message, cache_hit)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write everything queued so far; safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            updates = list(batch.values())
+            try:
+                with STAGE_SECONDS.time(stage='db_status'):
+                    self.write(updates)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                print(f"[WARN] Failed to flush {len(updates)} job status updates, will retry: {e}")
+                with self._cond:
+                    for job_id, update in batch.items():
+                        # Anything submitted meanwhile is newer and wins.
+                        self._pending.setdefault(job_id, update)
+            except Exception as e:
+                # A bad row poisons the whole statement; fall back to one
+                # update per job so the others still land.
+                print(f"[WARN] Batched status flush failed, writing individually: {e}")
+                for update in updates:
+                    try:
+                        self.write([update])
+                    except Exception as inner:
+                        print(f"[WARN] Failed to update job {update[0]} to '{update[1]}': {inner}")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+def safe_update_job_status(
+    job_id: str,
+    status: str,
+    error_message: str | None = None,
+    cache_hit: bool | None = None,
+):
     """Best-effort status update that never aborts job processing."""
+    if status_writer is not None:
+        status_writer.submit(job_id, status, error_message=error_message, cache_hit=cache_hit)
+        return
     try:
-        update_job_status(job_id, status, error_message=error_message)
+        with STAGE_SECONDS.time(stage='db_status'):
+            update_job_status(job_id, status, error_message=error_message, cache_hit=cache_hit)
     except Exception as e:
         print(f"[WARN] Failed to update job {job_id} to '{status}': {e}")
 
@@ -62,6 +610,58 @@ def extract_job_id_from_key(object_key: str) -> str | None:
 
 
 def process_job(ch, method, properties, body):
+    """Synchronous on_message_callback: handle the event, then settle it."""
+    outcome, error = handle_event(body, message_attempt(properties))
+    settle_delivery(ch, method.delivery_tag, properties, body, outcome, error)
+
+
+def event_lag_seconds(record: dict) -> float | None:
+    """Seconds since the event's eventTime, or None if it is missing."""
+    try:
+        event_time = datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00'))
+    except (KeyError, AttributeError, ValueError):
+        return None
+    return max(0.0, (datetime.now(timezone.utc) - event_time).total_seconds())
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Whether a failure may go away by itself, e.g. an upload still in flight."""
+    import urllib3
+
+    if isinstance(exc, storage.S3Error):
+        return exc.code in RETRYABLE_S3_CODES
+    return isinstance(exc, (
+        ConnectionError,
+        TimeoutError,
+        urllib3.exceptions.HTTPError,
+        psycopg2.OperationalError,
+        psycopg2.InterfaceError,
+        # warm_up may still be creating the schema of a fresh database.
+        psycopg2.errors.UndefinedTable,
+        BrokenProcessPool,
+    ))
+
+
+def handle_event(body: bytes, attempt: int = 1) -> tuple[str, str | None]:
+    """
+    Process one MinIO event end to end; never raises. Returns the outcome
+    ('completed', 'cached', 'retry' or 'error') and the error message, if any.
+    """
+    started = time.perf_counter()
+    outcome, error = 'error', None
+    JOBS_IN_PROGRESS.inc()
+    try:
+        outcome, error = _handle_event(body, attempt)
+    finally:
+        JOBS_IN_PROGRESS.dec()
+        JOBS_TOTAL.inc(outcome=outcome)
+        JOB_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+    return outcome, error
+
+
+def _handle_event(body: bytes, attempt: int) -> tuple[str, str | None]:
+    """handle_event without the bookkeeping."""
+    job_id = None
     try:
         event = json.loads(body.decode())
         record = event['Records'][0]
@@ -70,115 +670,724 @@ def process_job(ch, method, properties, body):
         # MinIO/S3 events URL-encode object keys; decode before use
         filename = unquote(raw_key)
 
+        lag = event_lag_seconds(record)
+        if lag is not None:
+            QUEUE_LAG_SECONDS.observe(lag)
+
         job_id = extract_job_id_from_key(filename)
-        print(f"Processing MinIO event for {filename} in bucket {bucket_name}, job_id={job_id}")
+        print(f"Processing MinIO event for {filename} in bucket {bucket_name}, job_id={job_id}, attempt {attempt}")
 
         # Mark job as in progress (best-effort)
         if job_id:
             safe_update_job_status(job_id, "in_progress")
 
-        input_path = os.path.join(UPLOADS_DIR, os.path.basename(filename))
-        output_path = os.path.join(RESIZED_DIR, os.path.basename(filename))
+        renditions = load_renditions(job_id)
+        if STREAMING_MODE:
+            cache_hit = process_object_streaming(bucket_name, filename, renditions)
+        else:
+            cache_hit = process_object_on_disk(bucket_name, filename, renditions)
+        print(f"Successfully uploaded resized {filename} to MinIO.")
+
+        # Mark job as completed (best-effort)
+        if job_id:
+            safe_update_job_status(job_id, "completed", cache_hit=cache_hit)
+        return ('cached' if cache_hit else 'completed'), None
+
+    except Exception as e:
+        if isinstance(e, storage.S3Error) and e.code == 'NoSuchBucket':
+            # The bucket was removed under us; the retry recreates it.
+            storage.forget_bucket(minio_client, BUCKET_NAME)
+        retry = is_retryable(e) and attempt < MAX_ATTEMPTS
+        print(f"Error processing MinIO event (attempt {attempt}, {'will retry' if retry else 'giving up'}): {e}")
+        if job_id:
+            safe_update_job_status(job_id, "retrying" if retry else "error", error_message=str(e))
+        return ('retry' if retry else 'error'), str(e)
+
+
+def message_attempt(properties) -> int:
+    """1-based delivery attempt recorded in the message headers."""
+    headers = getattr(properties, 'headers', None) or {}
+    try:
+        return max(1, int(headers.get(ATTEMPT_HEADER, 1)))
+    except (TypeError, ValueError):
+        return 1
+
 
-        # Download the image from MinIO, with a few retries to give the
-        # client time to finish the presigned upload.
-        max_attempts = 5
-        for attempt in range(1, max_attempts + 1):
+def retry_queue_name(attempt: int) -> str:
+    """Retry queue holding a message that failed on `attempt`."""
+    delay = RETRY_DELAYS[min(attempt, len(RETRY_DELAYS)) - 1]
+    return f'{JOBS_QUEUE}_retry_{delay}s'
+
+
+def declare_topology(channel):
+    """
+    Declare the jobs queue, the lane queues, one TTL queue per retry delay
+    and the dead-letter queue. Retry queues have no consumers: when a
+    message's TTL expires RabbitMQ dead-letters it back onto JOBS_QUEUE to
+    be routed again. One queue per delay keeps every queue FIFO by expiry
+    time.
+    """
+    channel.queue_declare(queue=JOBS_QUEUE, durable=True)
+    channel.exchange_declare(exchange='minio-events', exchange_type='fanout', durable=True)
+    channel.queue_bind(queue=JOBS_QUEUE, exchange='minio-events', routing_key='minio.uploaded')
+    channel.queue_declare(queue=LANE_QUEUES['interactive'], durable=True)
+    channel.queue_declare(
+        queue=LANE_QUEUES['bulk'],
+        durable=True,
+        arguments={'x-max-priority': BULK_MAX_PRIORITY},
+    )
+    for delay in sorted(set(RETRY_DELAYS)):
+        channel.queue_declare(
+            queue=f'{JOBS_QUEUE}_retry_{delay}s',
+            durable=True,
+            arguments={
+                'x-message-ttl': delay * 1000,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': JOBS_QUEUE,
+            },
+        )
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+
+
+def republish(ch, queue: str, properties, body: bytes, headers: dict, priority: int | None = None):
+    """Publish a persistent copy of a message to `queue` via the default exchange."""
+    merged = dict(getattr(properties, 'headers', None) or {})
+    merged.update(headers)
+    ch.basic_publish(
+        exchange='',
+        routing_key=queue,
+        body=body,
+        properties=pika.BasicProperties(
+            content_type=getattr(properties, 'content_type', None),
+            delivery_mode=2,
+            headers=merged,
+            priority=priority,
+        ),
+    )
+
+
+def settle_delivery(ch, delivery_tag, properties, body: bytes, outcome: str, error: str | None):
+    """
+    Route a handled message onwards, then ack it. Runs on the connection
+    thread. The copy is published before the ack, so a crash in between
+    redelivers the original rather than losing it.
+    """
+    attempt = message_attempt(properties)
+    if outcome == 'retry':
+        republish(ch, retry_queue_name(attempt), properties, body, {
+            ATTEMPT_HEADER: attempt + 1,
+            'x-last-error': (error or '')[:1000],
+        })
+        RETRIES_SCHEDULED.inc()
+    elif outcome == 'error':
+        republish(ch, DEAD_LETTER_QUEUE, properties, body, {
+            ATTEMPT_HEADER: attempt,
+            'x-last-error': (error or '')[:1000],
+            'x-dead-lettered-at': datetime.now(timezone.utc).isoformat(),
+        })
+        DEAD_LETTERED.inc()
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+
+def replay_dead_letters(channel, limit: int | None = None) -> int:
+    """
+    Move up to `limit` messages (all, by default) from DEAD_LETTER_QUEUE
+    back onto JOBS_QUEUE with a fresh attempt count; returns how many.
+    """
+    replayed = 0
+    while limit is None or replayed < limit:
+        method, properties, body = channel.basic_get(queue=DEAD_LETTER_QUEUE, auto_ack=False)
+        if method is None:
+            break
+        republish(channel, JOBS_QUEUE, properties, body, {ATTEMPT_HEADER: 1})
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    return replayed
+
+
+def message_tenant(properties) -> str:
+    headers = getattr(properties, 'headers', None) or {}
+    return str(headers.get(TENANT_HEADER) or DEFAULT_TENANT)
+
+
+def event_lane(body: bytes) -> tuple[str, str]:
+    """
+    (lane, tenant) of an upload event. Direct uploads carry them as object
+    metadata; otherwise the job row is looked up. Unknown jobs and lookup
+    failures go to the interactive lane, as every job did before lanes.
+    """
+    try:
+        record = json.loads(body.decode())['Records'][0]
+        s3_object = record['s3']['object']
+        filename = unquote(s3_object['key'])
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        # A worker dead-letters it.
+        return 'interactive', DEFAULT_TENANT
+    metadata = {k.lower(): v for k, v in (s3_object.get('userMetadata') or {}).items()}
+    priority = metadata.get('x-amz-meta-priority')
+    tenant = metadata.get('x-amz-meta-tenant')
+    if priority is None:
+        job_id = extract_job_id_from_key(filename)
+        lane = None
+        if job_id:
             try:
-                minio_client.fget_object(bucket_name, filename, input_path)
-                print(f"Successfully downloaded {filename} from MinIO on attempt {attempt}.")
-                break
-            except S3Error as e:
-                # If the object is not yet there, wait a bit and retry.
-                if e.code == "NoSuchKey" and attempt < max_attempts:
-                    wait_seconds = 2 * attempt
-                    print(f"{filename} not found yet (attempt {attempt}), retrying in {wait_seconds}s...")
-                    time.sleep(wait_seconds)
-                    continue
-                # Any other error or final failed attempt: re-raise.
-                raise
-        # Print file size for debugging
+                with STAGE_SECONDS.time(stage='route_lookup'):
+                    lane = get_job_lane(job_id)
+            except Exception as e:
+                print(f"[WARN] Could not look up the lane of job {job_id}: {e}")
+        if lane is not None:
+            priority, tenant = lane
+    if priority not in JOB_PRIORITIES:
+        priority = 'interactive'
+    return priority, tenant or DEFAULT_TENANT
+
+
+class TenantRates:
+    """Events routed per tenant, decaying with a half-life. Not thread-safe."""
+
+    def __init__(self, half_life: float = TENANT_HALF_LIFE, clock=time.monotonic):
+        self.half_life = half_life
+        self.clock = clock
+        self._counts: dict[str, tuple[float, float]] = {}
+
+    def add(self, tenant: str) -> float:
+        """Count one event for `tenant`; returns its decayed count before it."""
+        now = self.clock()
+        count, updated = self._counts.get(tenant, (0.0, now))
+        count *= 0.5 ** ((now - updated) / self.half_life)
+        self._counts[tenant] = (count + 1, now)
+        if len(self._counts) > 10000:
+            self._counts = {
+                t: (c, u) for t, (c, u) in self._counts.items()
+                if c * 0.5 ** ((now - u) / self.half_life) >= 0.5
+            }
+        return count
+
+
+def bulk_priority(recent: float) -> int:
+    """RabbitMQ priority of a bulk event from a tenant with `recent` events."""
+    return max(0, BULK_MAX_PRIORITY - int(math.log2(1 + recent / TENANT_BURST)))
+
+
+def forward_event(ch, delivery_tag, properties, body: bytes, lane: str, tenant: str, rates: TenantRates):
+    """Publish an event to its lane queue, then ack it; on the connection thread."""
+    priority = bulk_priority(rates.add(tenant)) if lane == 'bulk' else None
+    republish(ch, LANE_QUEUES[lane], properties, body, {TENANT_HEADER: tenant}, priority=priority)
+    EVENTS_ROUTED.inc(lane=lane)
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+
+class EventRouter:
+    """
+    Consumes JOBS_QUEUE and forwards each event to its lane queue. Lookups
+    run on a small thread pool; publishing and acking are marshalled back
+    onto the connection thread, like JobExecutor does.
+    """
+
+    def __init__(self, connection, threads: int = ROUTER_THREADS):
+        self.connection = connection
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job-router')
+        self.rates = TenantRates()
+
+    def on_message(self, ch, method, properties, body):
+        future = self.pool.submit(event_lane, body)
+        future.add_done_callback(functools.partial(self._forward, ch, method.delivery_tag, properties, body))
+
+    def _forward(self, ch, delivery_tag, properties, body, future):
+        lane, tenant = future.result()
         try:
-            file_size = os.path.getsize(input_path)
-            print(f"Downloaded file size: {file_size} bytes")
+            self.connection.add_callback_threadsafe(
+                functools.partial(forward_event, ch, delivery_tag, properties, body, lane, tenant, self.rates)
+            )
         except Exception as e:
-            print(f"Error checking file size: {e}")
+            print(f"[WARN] Could not route delivery {delivery_tag}: {e}")
 
-        # Resize the image
-        resize_image(input_path, output_path)
-        print(f"Successfully resized {filename}.")
+    def shutdown(self, wait: bool = True):
+        self.pool.shutdown(wait=wait)
 
-        # Ensure the 'resized-images' bucket exists
-        ensure_bucket()
 
-        # Upload the resized image to the 'resized-images' bucket
-        minio_client.fput_object(BUCKET_NAME, os.path.basename(filename), output_path)
-        print(f"Successfully uploaded resized {filename} to MinIO.")
+class FairScheduler:
+    """
+    Picks which delivered job runs next on `slots` job threads. Interactive
+    jobs go first, and bulk jobs never hold more than `slots - reserved`
+    threads, so an interactive job always finds one soon. Within a lane,
+    tenants take turns; a tenant already running `max_per_tenant` jobs only
+    gets a thread that no other waiting tenant can use, so one tenant can
+    use every slot when alone but cannot crowd others out.
+    """
 
-        # Mark job as completed (best-effort)
-        if job_id:
-            safe_update_job_status(job_id, "completed")
+    def __init__(self, slots: int, reserved: int = INTERACTIVE_RESERVED, max_per_tenant: int = TENANT_MAX_JOBS):
+        self.slots = slots
+        self.bulk_slots = max(1, slots - reserved)
+        self.max_per_tenant = max_per_tenant
+        self._waiting = {lane: OrderedDict() for lane in LANE_QUEUES}
+        self._running = Counter()
+        self._running_lanes = Counter()
+        self._lock = threading.Lock()
 
-    except Exception as e:
-        print(f"Error processing MinIO event: {e}")
-        # Best-effort: try to recover job_id from the event again
+    def add(self, lane: str, tenant: str, job) -> list[tuple]:
+        """Queue a job; returns the (lane, tenant, job) triples to start now."""
+        with self._lock:
+            self._waiting[lane].setdefault(tenant, deque()).append(job)
+            return self._drain()
+
+    def finish(self, lane: str, tenant: str) -> list[tuple]:
+        """Record a finished job; returns the jobs to start in its place."""
+        with self._lock:
+            self._running[tenant] -= 1
+            if self._running[tenant] <= 0:
+                del self._running[tenant]
+            self._running_lanes[lane] -= 1
+            return self._drain()
+
+    def waiting(self, lane: str) -> int:
+        with self._lock:
+            return sum(len(jobs) for jobs in self._waiting[lane].values())
+
+    def clear(self) -> list:
+        """Remove and return every job still waiting for a thread."""
+        with self._lock:
+            jobs = [job for lane in self._waiting.values() for queue in lane.values() for job in queue]
+            for lane in self._waiting:
+                self._waiting[lane].clear()
+                JOBS_WAITING.set(0, lane=lane)
+            return jobs
+
+    def _next(self, lane: str):
+        tenants = self._waiting[lane]
+        if not tenants:
+            return None
+        tenant = next((t for t in tenants if self._running[t] < self.max_per_tenant), None)
+        if tenant is None:
+            tenant = min(tenants, key=lambda t: self._running[t])
+        jobs = tenants.pop(tenant)
+        job = jobs.popleft()
+        if jobs:
+            # Back of the line: the next pick starts with another tenant.
+            tenants[tenant] = jobs
+        return tenant, job
+
+    def _drain(self) -> list[tuple]:
+        started = []
+        while sum(self._running_lanes.values()) < self.slots:
+            picked = self._next('interactive')
+            lane = 'interactive'
+            if picked is None and self._running_lanes['bulk'] < self.bulk_slots:
+                picked = self._next('bulk')
+                lane = 'bulk'
+            if picked is None:
+                break
+            tenant, job = picked
+            self._running[tenant] += 1
+            self._running_lanes[lane] += 1
+            started.append((lane, tenant, job))
+        for lane in self._waiting:
+            JOBS_WAITING.set(sum(len(jobs) for jobs in self._waiting[lane].values()), lane=lane)
+        return started
+
+
+class JobExecutor:
+    """
+    Runs handle_event on a thread pool so the pika I/O loop (and with it the
+    heartbeat) is never blocked by a job. Deliveries from both lanes go
+    through a FairScheduler, which decides when each one gets a thread.
+    Retries, dead-lettering and acks are marshalled back onto the connection
+    thread with add_callback_threadsafe, since pika channels are not
+    thread-safe.
+    """
+
+    def __init__(self, connection, io_threads: int = IO_THREADS, scheduler: FairScheduler | None = None):
+        self.connection = connection
+        self.io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='job-io')
+        self.scheduler = scheduler or FairScheduler(io_threads)
+        self.running = 0
+        self._running_lock = threading.Lock()
+
+    def on_message(self, ch, method, properties, body, lane: str = 'interactive'):
+        job = (ch, method.delivery_tag, properties, body)
+        for started in self.scheduler.add(lane, message_tenant(properties), job):
+            self._start(*started)
+
+    def _start(self, lane, tenant, job):
+        ch, delivery_tag, properties, body = job
+        with self._running_lock:
+            self.running += 1
+        future = self.io_pool.submit(handle_event, body, message_attempt(properties))
+        future.add_done_callback(functools.partial(self._settle, ch, delivery_tag, properties, body, lane, tenant))
+
+    def _settle(self, ch, delivery_tag, properties, body, lane, tenant, future):
+        try:
+            outcome, error = future.result()
+        except Exception as e:
+            outcome, error = 'retry', str(e)
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(settle_delivery, ch, delivery_tag, properties, body, outcome, error)
+            )
+        except Exception as e:
+            # The connection dropped; the broker will redeliver the message.
+            print(f"[WARN] Could not settle delivery {delivery_tag}: {e}")
+        finally:
+            with self._running_lock:
+                self.running -= 1
         try:
-            event = json.loads(body.decode())
-            record = event['Records'][0]
-            raw_key = record['s3']['object']['key']
-            filename = unquote(raw_key)
-            job_id = extract_job_id_from_key(filename)
-            if job_id:
-                safe_update_job_status(job_id, "error", error_message=str(e))
-        except Exception as inner:
-            print(f"Additionally failed to update job status: {inner}")
+            for started in self.scheduler.finish(lane, tenant):
+                self._start(*started)
+        except RuntimeError:
+            # Shut down; waiting deliveries are redelivered on reconnect.
+            pass
 
-    # Acknowledge the message
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    def drain(self, timeout: float = DRAIN_SECONDS) -> int:
+        """
+        Graceful stop, on the connection thread once consuming has stopped:
+        requeue deliveries that have not started, then keep settling until
+        the running jobs finish or `timeout` passes. Returns how many jobs
+        were still running; the broker redelivers those once the connection
+        closes.
+        """
+        for ch, delivery_tag, _properties, _body in self.scheduler.clear():
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.1)
+        # Run the settle callbacks of the jobs that just finished.
+        self.connection.process_data_events(time_limit=0)
+        return self.running
 
+    def shutdown(self, wait: bool = True):
+        self.io_pool.shutdown(wait=wait)
 
-def check_connection(host, port):
-    try:
-        with socket.create_connection((host, port), timeout=5):
-            print(f"Successfully connected to {host}:{port}")
-            return True
-    except OSError as err:
-        print(f"Failed to connect to {host}:{port}: {err}")
-        return False
 
+def backoff_delays(base: float = CONNECT_BACKOFF_BASE, cap: float = CONNECT_BACKOFF_MAX, rng=random.random):
+    """Endless full-jitter exponential backoff: uniform in [0, min(cap, base * 2**n)]."""
+    attempt = 0
+    while True:
+        yield rng() * min(cap, base * 2 ** attempt)
+        attempt = min(attempt + 1, 32)
 
-def main():
-    # Ensure DB schema exists
+
+def warm_up():
+    """
+    Ensure the DB schema and the resized bucket in the background, retrying
+    with backoff, so neither delays consuming. A job that arrives first
+    simply pays for the connection itself, or is retried if the schema is
+    not there yet.
+    """
+    for step, action in (('initialise the database', init_db), (f"ensure bucket '{BUCKET_NAME}'", ensure_bucket)):
+        for delay in backoff_delays():
+            try:
+                action()
+                break
+            except Exception as e:
+                print(f"[WARN] Failed to {step}, retrying in {delay:.1f}s: {e}")
+                if shutdown_requested.wait(delay):
+                    return
+
+
+def request_shutdown(channel=None):
+    """Signal handler body: stop consuming; main() then drains and returns."""
+    if shutdown_requested.is_set():
+        return
+    print('Shutdown requested; draining...')
+    shutdown_requested.set()
+    if channel is not None and channel.is_open:
+        # Cancels every consumer and returns from start_consuming; pika
+        # rejects deliveries it had buffered but not dispatched.
+        channel.connection.add_callback_threadsafe(channel.stop_consuming)
+
+
+def consume(connection, channel) -> bool:
+    """
+    Declare the topology, consume until start_consuming returns, then drain.
+    Returns True once a requested shutdown has been drained.
+    """
+    router = executor = None
     try:
-        init_db()
-    except Exception as e:
-        print(f"[WARN] Failed to initialise database in image-processor: {e}")
+        declare_topology(channel)
+        # Retry and dead-letter copies must be stored before the
+        # original is acked.
+        channel.confirm_delivery()
+        # Prefetch is per consumer, so each basic_qos applies to the
+        # consumer registered after it.
+        router = EventRouter(connection)
+        channel.basic_qos(prefetch_count=ROUTER_PREFETCH)
+        channel.basic_consume(queue=JOBS_QUEUE, on_message_callback=router.on_message)
+        executor = JobExecutor(connection)
+        for lane, prefetch in (('interactive', PREFETCH_COUNT), ('bulk', BULK_PREFETCH)):
+            channel.basic_qos(prefetch_count=prefetch)
+            channel.basic_consume(
+                queue=LANE_QUEUES[lane],
+                on_message_callback=functools.partial(executor.on_message, lane=lane),
+            )
+        STARTUP_SECONDS.set(time.monotonic() - PROCESS_STARTED)
+        print(f"Waiting for MinIO event jobs ({time.monotonic() - PROCESS_STARTED:.2f}s after start)...")
+        if not shutdown_requested.is_set():
+            channel.start_consuming()
+        if not shutdown_requested.is_set():
+            return False
+        # Routed events are published and acked as their lookups finish.
+        router.shutdown(wait=True)
+        unfinished = executor.drain()
+        if unfinished:
+            print(f"[WARN] {unfinished} jobs did not finish within {DRAIN_SECONDS}s; they will be redelivered")
+        return True
+    finally:
+        if router is not None:
+            router.shutdown(wait=False)
+        if executor is not None:
+            # Unacked messages are redelivered on the next connection.
+            executor.shutdown(wait=False)
 
-    # Check connections before starting
-    check_connection(RABBITMQ_HOST, 5672)
-    check_connection(MINIO_ENDPOINT.split(':')[0], int(MINIO_ENDPOINT.split(':')[1]))
 
-    time.sleep(10)
-    while True:
+def main():
+    global cpu_pool, status_writer
+    if CPU_WORKERS > 0:
+        cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS)
+    status_writer = StatusWriter()
+    # Pending status updates must reach the database on any exit.
+    atexit.register(status_writer.close)
+    print(f"Execution engine: {CPU_WORKERS} CPU workers, {IO_THREADS} I/O threads, "
+          f"prefetch {PREFETCH_COUNT} interactive / {BULK_PREFETCH} bulk")
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+        print(f"Serving metrics on :{METRICS_PORT}/metrics")
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+    connection = channel = None
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: request_shutdown(channel))
+    delays = backoff_delays()
+    while not shutdown_requested.is_set():
         try:
             connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+            delays = backoff_delays()
             channel = connection.channel()
-            # Declare the queue and bind to minio-events exchange
-            queue_name = 'minio_events_queue'
-            channel.queue_declare(queue=queue_name, durable=True)
-            channel.exchange_declare(exchange='minio-events', exchange_type='fanout', durable=True)
-            channel.queue_bind(queue=queue_name, exchange='minio-events', routing_key='minio.uploaded')
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=queue_name, on_message_callback=process_job)
-            print('Waiting for MinIO event jobs...')
-            channel.start_consuming()
+            if consume(connection, channel):
+                break
         except pika.exceptions.AMQPConnectionError as e:
-            print(f"Connection error: {e}, retrying in 5s...")
-            time.sleep(5)
+            delay = next(delays)
+            print(f"Connection error: {e}, retrying in {delay:.1f}s...")
+            shutdown_requested.wait(delay)
         except Exception as e:
-            print(f"An unexpected error occurred: {e}, retrying in 5s...")
-            time.sleep(5)
+            delay = next(delays)
+            print(f"An unexpected error occurred: {e}, retrying in {delay:.1f}s...")
+            shutdown_requested.wait(delay)
+        finally:
+            if connection is not None and connection.is_open:
+                try:
+                    connection.close()
+                except Exception as e:
+                    print(f"[WARN] Could not close the RabbitMQ connection: {e}")
+    status_writer.close()
+    if cpu_pool is not None:
+        cpu_pool.shutdown()
+    print('Image processor stopped.')
+
+
+def parse_location(location: str) -> tuple[str | None, str]:
+    """
+    's3://bucket/prefix' -> (bucket, 'prefix/'), the prefix being treated as
+    a directory; a local path -> (None, path).
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        prefix = prefix.strip('/')
+        return bucket, prefix + '/' if prefix else ''
+    return None, location
+
+
+def list_sources(location: str):
+    """Yield the name of every image under `location`, relative to it, in order."""
+    bucket, path = parse_location(location)
+    if bucket is not None:
+        for obj in minio_client.list_objects(bucket, prefix=path, recursive=True):
+            if not obj.is_dir:
+                yield obj.object_name[len(path):]
+        return
+    extensions = Image.registered_extensions()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield os.path.relpath(os.path.join(root, name), path)
+
+
+def read_source(location: str, name: str) -> bytes:
+    bucket, path = parse_location(location)
+    if bucket is None:
+        with open(os.path.join(path, name), 'rb') as fh:
+            return fh.read()
+    response = minio_client.get_object(bucket, path + name)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def write_output(location: str, key: str, data: bytes, fmt: str):
+    bucket, path = parse_location(location)
+    if bucket is None:
+        output_path = os.path.join(path, key)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as fh:
+            fh.write(data)
+        return
+    storage.ensure_bucket(minio_client, bucket)
+    minio_client.put_object(
+        bucket,
+        path + key,
+        io.BytesIO(data),
+        length=len(data),
+        content_type=Image.MIME.get(fmt, 'application/octet-stream'),
+    )
+
+
+class Checkpoint:
+    """Append-only record of finished names, so an interrupted run can resume."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as fh:
+                self.done = {line.rstrip('\n') for line in fh if line.strip()}
+        self._fh = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.done
+
+    def add(self, name: str):
+        self.done.add(name)
+        self._fh.write(name + '\n')
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
+
+def default_checkpoint_path(source: str, dest: str, renditions: list[dict]) -> str:
+    material = json.dumps([source, dest, renditions], sort_keys=True)
+    return f".bulk-resize-{hashlib.sha256(material.encode('utf-8')).hexdigest()[:12]}.checkpoint"
+
+
+def bulk_resize(source: str, dest: str, renditions: list[dict], workers: int = CPU_WORKERS,
+                io_threads: int = IO_THREADS, checkpoint_path: str | None = None,
+                progress_interval: float = 5.0) -> dict:
+    """
+    Render every image under `source` into `dest` without the queue or the
+    database. Either side may be a local directory or 's3://bucket/prefix';
+    outputs use the same keys as the processor, below the source's relative
+    directory. I/O threads read sources and write results while the CPU
+    pool renders, with at most two items per thread in flight, and every
+    finished name is checkpointed so a rerun skips it. Failed items are
+    reported and retried on the next run.
+    """
+    checkpoint = Checkpoint(checkpoint_path or default_checkpoint_path(source, dest, renditions))
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='bulk-io')
+    stats = {'processed': 0, 'skipped': 0, 'failed': 0}
+
+    def process_one(name):
+        data = read_source(source, name)
+
+        def render(todo, reduced):
+            if pool is None:
+                return render_renditions(io.BytesIO(data), todo, reduced=reduced, admitted=True)
+            return pool.submit(render_bytes, data, todo, reduced, True).result()[0]
+
+        outputs = admit_render(io.BytesIO(data), renditions, render)
+        prefix = os.path.dirname(name)
+        for rendition, (output, fmt) in zip(renditions, outputs):
+            write_output(dest, os.path.join(prefix, rendition_key(name, rendition)), output, fmt)
+
+    def settle(done):
+        for future in done:
+            name = in_flight.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"[WARN] Failed to resize {name}: {e}")
+            else:
+                stats['processed'] += 1
+                checkpoint.add(name)
+
+    started = last_report = time.perf_counter()
+    in_flight = {}
+    try:
+        for name in list_sources(source):
+            if name in checkpoint:
+                stats['skipped'] += 1
+                continue
+            if len(in_flight) >= 2 * io_threads:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                settle(done)
+            in_flight[io_pool.submit(process_one, name)] = name
+            now = time.perf_counter()
+            if now - last_report >= progress_interval:
+                last_report = now
+                print(f"{stats['processed']} images, {stats['processed'] / (now - started):.1f} images/sec")
+        settle(wait(in_flight).done)
+    finally:
+        io_pool.shutdown(wait=True)
+        if pool is not None:
+            pool.shutdown()
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = elapsed
+    stats['images_per_sec'] = stats['processed'] / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Resized {stats['processed']} images in {elapsed:.1f}s ({stats['images_per_sec']:.1f} images/sec); "
+        f"{stats['skipped']} already done, {stats['failed']} failed."
+    )
+    return stats
+
+
+def replay_main(limit: int | None = None):
+    """Push dead-lettered jobs back onto the jobs queue and exit."""
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    try:
+        channel = connection.channel()
+        declare_topology(channel)
+        channel.confirm_delivery()
+        replayed = replay_dead_letters(channel, limit)
+        print(f"Replayed {replayed} message(s) from {DEAD_LETTER_QUEUE} onto {JOBS_QUEUE}.")
+    finally:
+        connection.close()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Image-processor worker.')
+    commands = parser.add_subparsers(dest='command')
+    replay_parser = commands.add_parser('replay-dlq', help='Move dead-lettered jobs back onto the jobs queue.')
+    replay_parser.add_argument('--limit', type=int, help='Replay at most this many messages.')
+    bulk_parser = commands.add_parser(
+        'bulk', help='Resize a local directory or s3://bucket/prefix offline, without the queue.')
+    bulk_parser.add_argument('source', help='Local directory or s3://bucket/prefix to read.')
+    bulk_parser.add_argument('dest', help='Local directory or s3://bucket/prefix to write.')
+    bulk_choice = bulk_parser.add_mutually_exclusive_group()
+    bulk_choice.add_argument('--profile', default=DEFAULT_PROFILE, help='Rendition profile (default: %(default)s).')
+    bulk_choice.add_argument('--renditions', help='JSON list of rendition specs.')
+    bulk_choice.add_argument('--size', help='Single stretched rendition of WIDTHxHEIGHT.')
+    bulk_parser.add_argument('--workers', type=int, default=CPU_WORKERS, help='Render processes; 0 renders in threads.')
+    bulk_parser.add_argument('--io-threads', type=int, default=IO_THREADS)
+    bulk_parser.add_argument('--checkpoint', help='Progress file; defaults to one derived from the arguments.')
+    args = parser.parse_args()
+    if args.command == 'replay-dlq':
+        replay_main(args.limit)
+    elif args.command == 'bulk':
+        if args.size:
+            width, height = (int(v) for v in args.size.lower().split('x'))
+            bulk_renditions = resolve_renditions(renditions=[
+                {'name': DEFAULT_RENDITION, 'width': width, 'height': height, 'fit': 'stretch'}])
+        elif args.renditions:
+            bulk_renditions = resolve_renditions(renditions=json.loads(args.renditions))
+        else:
+            bulk_renditions = resolve_renditions(args.profile)
+        stats = bulk_resize(args.source, args.dest, bulk_renditions, workers=args.workers,
+                            io_threads=args.io_threads, checkpoint_path=args.checkpoint)
+        raise SystemExit(1 if stats['failed'] else 0)
+    else:
+        main()
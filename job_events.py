@@ -0,0 +1,138 @@
+"""
+Fan-out of job status transitions to in-process subscribers (SSE streams
+and long-polls). A single background connection LISTENs on
+JOB_STATUS_CHANNEL, which the image_jobs trigger created by db.init_db
+notifies on every status change, so waiting clients cost no queries.
+"""
+import json
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+
+from db import JOB_STATUS_CHANNEL, get_connection
+
+
+# Events queued per subscriber before further ones are dropped; a client
+# that far behind reconnects and re-reads the job anyway.
+SUBSCRIBER_QUEUE_SIZE = 100
+LISTEN_POLL_SECONDS = 5
+RECONNECT_MAX_BACKOFF = 30
+
+
+class Subscription:
+    """Queue of events for one client; use as a context manager."""
+
+    def __init__(self, hub, job_ids):
+        self.hub = hub
+        self.job_ids = frozenset(job_ids) if job_ids else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout: float | None = None) -> dict | None:
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class JobEventHub:
+    """
+    Routes each notification to the subscribers of that job id and to
+    subscribers of all jobs. The listener thread starts on the first
+    subscription and reconnects with exponential backoff; transitions that
+    happen while it is disconnected are not replayed.
+    """
+
+    def __init__(self, connect=get_connection, channel: str = JOB_STATUS_CHANNEL, listen: bool = True):
+        self._connect = connect
+        self._channel = channel
+        self._listen = listen
+        self._lock = threading.Lock()
+        self._by_job: dict[str, set[Subscription]] = defaultdict(set)
+        self._all: set[Subscription] = set()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, job_ids=None) -> Subscription:
+        """Subscribe to the given job ids, or to every job when None."""
+        subscription = Subscription(self, job_ids)
+        with self._lock:
+            if subscription.job_ids is None:
+                self._all.add(subscription)
+            else:
+                for job_id in subscription.job_ids:
+                    self._by_job[job_id].add(subscription)
+            if self._listen and self._thread is None:
+                self._thread = threading.Thread(target=self._listen_forever, name='job-events', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._all.discard(subscription)
+            for job_id in subscription.job_ids or ():
+                subscribers = self._by_job.get(job_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_job[job_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._all) + len({s for subs in self._by_job.values() for s in subs})
+
+    def publish(self, event: dict):
+        with self._lock:
+            targets = self._all | self._by_job.get(str(event.get('id')), set())
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def _listen_forever(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self._channel};")
+                print(f"Listening for job status notifications on '{self._channel}'")
+                backoff = 1
+                while True:
+                    if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[WARN] Job event listener failed: {e}, reconnecting in {backoff}s...")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX_BACKOFF)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _dispatch(self, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            print(f"[WARN] Ignoring malformed job notification: {payload!r}")
+            return
+        self.publish(event)
+
+
+hub = JobEventHub()
@@ -0,0 +1,163 @@
+"""
+Rendition specs shared by the API server and the image-processor.
+
+A rendition is a dict such as::
+
+    {'name': 'thumb', 'width': 150, 'height': 150, 'fit': 'cover',
+     'format': 'WEBP', 'quality': 80}
+
+`format` and `quality` are optional; without a format the rendition is
+encoded in the source format. Jobs either name a server-side profile or
+carry an explicit list of renditions.
+"""
+import os
+import re
+
+
+DEFAULT_PROFILE = 'default'
+# The rendition stored under the plain object name, as listed by the feed.
+DEFAULT_RENDITION = 'default'
+
+FITS = ('stretch', 'contain', 'cover')
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+MAX_RENDITIONS = 8
+MAX_DIMENSION = 4096
+NAME_RE = re.compile(r'^[a-z0-9_-]{1,32}$')
+# '<w>x<h>-<fit>-<format>' names belong to on-demand renditions; clients
+# may not use the pattern, so their renditions never share a key with one.
+ON_DEMAND_NAME_RE = re.compile(r'^\d+x\d+-')
+EXTENSION_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+# Edge lengths allowed for on-demand renditions (/api/resized/<name>?w=&h=).
+# Every accepted request can create an object, so the choice is kept small.
+ON_DEMAND_SIZES = tuple(sorted(
+    int(v) for v in os.environ.get('ON_DEMAND_SIZES', '64,128,256,320,480,640,800,1024,1280,1600,2048').split(',')
+))
+
+RENDITION_PROFILES = {
+    'default': [
+        {'name': DEFAULT_RENDITION, 'width': 256, 'height': 256, 'fit': 'stretch'},
+    ],
+    'web': [
+        {'name': DEFAULT_RENDITION, 'width': 256, 'height': 256, 'fit': 'stretch'},
+        {'name': 'thumb', 'width': 150, 'height': 150, 'fit': 'cover', 'format': 'WEBP', 'quality': 80},
+        {'name': 'medium', 'width': 1024, 'height': 1024, 'fit': 'contain', 'format': 'JPEG', 'quality': 85},
+        {'name': 'webp', 'width': 1024, 'height': 1024, 'fit': 'contain', 'format': 'WEBP', 'quality': 80},
+    ],
+}
+
+
+def normalise_renditions(renditions) -> list[dict]:
+    """Validate a client-supplied rendition list, raising ValueError."""
+    if not isinstance(renditions, list) or not renditions:
+        raise ValueError('renditions must be a non-empty list')
+    if len(renditions) > MAX_RENDITIONS:
+        raise ValueError(f'at most {MAX_RENDITIONS} renditions are allowed')
+
+    normalised = []
+    seen = set()
+    for spec in renditions:
+        if not isinstance(spec, dict):
+            raise ValueError('each rendition must be an object')
+        name = spec.get('name')
+        if not isinstance(name, str) or not NAME_RE.match(name):
+            raise ValueError(f'invalid rendition name: {name!r}')
+        if ON_DEMAND_NAME_RE.match(name):
+            raise ValueError(f'rendition name {name!r} is reserved: <w>x<h>-... names are used by on-demand sizes')
+        if name in seen:
+            raise ValueError(f'duplicate rendition name: {name}')
+        seen.add(name)
+
+        rendition = {'name': name}
+        for dimension in ('width', 'height'):
+            value = spec.get(dimension)
+            if not isinstance(value, int) or not 1 <= value <= MAX_DIMENSION:
+                raise ValueError(f'{name}: {dimension} must be an integer in 1..{MAX_DIMENSION}')
+            rendition[dimension] = value
+
+        fit = spec.get('fit', 'contain')
+        if fit not in FITS:
+            raise ValueError(f'{name}: fit must be one of {", ".join(FITS)}')
+        rendition['fit'] = fit
+
+        fmt = spec.get('format')
+        if fmt is not None:
+            fmt = str(fmt).upper()
+            if fmt == 'JPG':
+                fmt = 'JPEG'
+            if fmt not in FORMAT_EXTENSIONS:
+                raise ValueError(f'{name}: format must be one of {", ".join(FORMAT_EXTENSIONS)}')
+            rendition['format'] = fmt
+
+        quality = spec.get('quality')
+        if quality is not None:
+            if not isinstance(quality, int) or not 1 <= quality <= 100:
+                raise ValueError(f'{name}: quality must be an integer in 1..100')
+            rendition['quality'] = quality
+
+        normalised.append(rendition)
+    return normalised
+
+
+def resolve_renditions(profile: str | None = None, renditions=None) -> list[dict]:
+    """Return the rendition list for an explicit spec or a named profile."""
+    if renditions is not None:
+        return normalise_renditions(renditions)
+    profile = profile or DEFAULT_PROFILE
+    if profile not in RENDITION_PROFILES:
+        raise ValueError(f'unknown rendition profile: {profile}')
+    return [dict(r) for r in RENDITION_PROFILES[profile]]
+
+
+def on_demand_rendition(width=None, height=None, fit=None, fmt=None, default_format: str = 'PNG') -> dict:
+    """
+    Rendition for on-demand query parameters (strings or None), raising
+    ValueError. A missing width or height takes the other's value, and a
+    missing format is `default_format` (the upload's, see
+    extension_format), never whatever the render happens to start from.
+    The name encodes every parameter, so it doubles as the cache key.
+    """
+    try:
+        width = int(width) if width is not None else None
+        height = int(height) if height is not None else None
+    except ValueError:
+        raise ValueError('w and h must be integers') from None
+    width = width or height
+    height = height or width
+    sizes = ', '.join(str(size) for size in ON_DEMAND_SIZES)
+    if width not in ON_DEMAND_SIZES or height not in ON_DEMAND_SIZES:
+        raise ValueError(f'w and h must be one of {sizes}')
+    fit = fit or 'contain'
+    if fit not in FITS:
+        raise ValueError(f'fit must be one of {", ".join(FITS)}')
+    fmt = (fmt or default_format).upper()
+    if fmt == 'JPG':
+        fmt = 'JPEG'
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f'fmt must be one of {", ".join(FORMAT_EXTENSIONS).lower()}')
+    return {
+        'name': f'{width}x{height}-{fit}-{fmt.lower()}',
+        'width': width,
+        'height': height,
+        'fit': fit,
+        'format': fmt,
+    }
+
+
+def extension_format(object_name: str) -> str | None:
+    """The encodable format an object name's extension stands for, if any."""
+    return EXTENSION_FORMATS.get(os.path.splitext(object_name)[1].lower())
+
+
+def rendition_key(object_name: str, rendition: dict) -> str:
+    """
+    Object key of a rendition in the resized bucket. The default rendition
+    keeps the source object's name; the others live under '<name>/', with
+    the extension swapped when the rendition forces a format.
+    """
+    base = os.path.basename(object_name)
+    fmt = rendition.get('format')
+    if fmt is not None:
+        base = os.path.splitext(base)[0] + FORMAT_EXTENSIONS[fmt]
+    if rendition['name'] == DEFAULT_RENDITION:
+        return base
+    return f"{rendition['name']}/{base}"
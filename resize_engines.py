@@ -0,0 +1,487 @@
+"""
+Resize engines behind image_processor.render_renditions.
+
+Every engine decodes a source once and returns the encoded bytes and
+format of each rendition, with the same semantics:
+- geometry comes from target_size, so `stretch`, `contain` and `cover`
+  produce identical dimensions on every engine, and `cover` is cropped
+  around the centre;
+- the EXIF orientation tag is applied before resizing;
+- the filter follows RESIZE_MODES, and speed modes may decode JPEGs at a
+  reduced scale no smaller than `reducing_gap` times the largest target;
+- renditions without a format keep the source format, and JPEG and WebP
+  qualities default to Pillow's defaults;
+- `reduced=True` decodes JPEGs at the smallest scale that still covers
+  every target, whatever the mode, for images too large to decode fully;
+- Pillow's decompression-bomb pixel limit applies unless `admitted=True`
+  says the caller has already checked the decode with decode_estimate.
+
+`pillow` is always available. `vips` (pyvips) and `opencv` (cv2 and
+numpy) are optional; when the configured one is not installed, or it
+cannot handle a given image, Pillow renders instead.
+"""
+from collections import deque
+import io
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+# Quality-vs-speed trade-off for resize_image:
+#   quality  - full-resolution decode, single bicubic resample
+#   balanced - JPEG DCT-domain scaling via Image.draft and reduce() down to
+#              3x the target before the final bicubic resample
+#   fast     - as balanced, but only 2x the target and a bilinear resample
+RESIZE_MODES = {
+    'quality': {'reducing_gap': None, 'resample': Image.Resampling.BICUBIC},
+    'balanced': {'reducing_gap': 3.0, 'resample': Image.Resampling.BICUBIC},
+    'fast': {'reducing_gap': 2.0, 'resample': Image.Resampling.BILINEAR},
+}
+RESIZE_MODE = os.environ.get('PROCESSOR_RESIZE_MODE', 'balanced')
+RESIZE_ENGINE = os.environ.get('PROCESSOR_RESIZE_ENGINE', 'pillow')
+
+# What Pillow uses when no quality is given, so every engine encodes alike.
+DEFAULT_QUALITY = {'JPEG': 75, 'WEBP': 80}
+# Formats the optional engines decode and encode themselves. Anything else
+# (GIF, TIFF, CMYK JPEGs, ...) is rendered by Pillow.
+NATIVE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+NATIVE_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I;16')
+EXIF_ORIENTATION = 0x0112
+
+# Decoded size of a pixel in Pillow, by mode; RGB is padded to four bytes.
+# Other engines use no more, so estimates hold for all of them.
+DECODED_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'PA': 2, 'I;16': 2}
+# Reducing gap of the reduced-resolution decode: just enough to cover the targets.
+REDUCED_DRAFT_GAP = 1.0
+
+# Image.open checks Image.MAX_IMAGE_PIXELS, a process-wide setting. Opens are
+# serialised so an admitted decode can lift it without exposing others.
+_open_lock = threading.Lock()
+
+
+def target_size(source_size: tuple[int, int], rendition: dict) -> tuple[int, int]:
+    """
+    Size the source is scaled to for a rendition, before any crop. Only
+    'stretch' changes the aspect ratio; 'cover' is cropped to the box later.
+    """
+    width, height = rendition['width'], rendition['height']
+    if rendition['fit'] == 'stretch':
+        return width, height
+    src_w, src_h = source_size
+    pick = max if rendition['fit'] == 'cover' else min
+    scale = pick(width / src_w, height / src_h)
+    return max(1, round(src_w * scale)), max(1, round(src_h * scale))
+
+
+def crop_box(size: tuple[int, int], rendition: dict) -> tuple[int, int, int, int] | None:
+    """(left, top, width, height) of a `cover` crop from a resized `size`."""
+    if rendition['fit'] != 'cover':
+        return None
+    left = (size[0] - rendition['width']) // 2
+    top = (size[1] - rendition['height']) // 2
+    return left, top, rendition['width'], rendition['height']
+
+
+def encode_image(img, fmt: str, quality: int | None = None) -> bytes:
+    if fmt == 'JPEG' and img.mode not in ('RGB', 'L', 'CMYK'):
+        img = img.convert('RGB')
+    params = {} if quality is None else {'quality': quality}
+    output = io.BytesIO()
+    img.save(output, format=fmt, **params)
+    return output.getvalue()
+
+
+def read_source(source) -> bytes:
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as fh:
+        return fh.read()
+
+
+def draft_scale(size: tuple[int, int], targets: list[tuple[int, int]], reducing_gap: float | None) -> int:
+    """Largest JPEG decode denominator (1, 2, 4 or 8) that keeps every target reducing_gap times smaller."""
+    if reducing_gap is None:
+        return 1
+    largest = (max(w for w, _ in targets) * reducing_gap, max(h for _, h in targets) * reducing_gap)
+    scale = 1
+    while scale < 8 and size[0] // (scale * 2) >= largest[0] and size[1] // (scale * 2) >= largest[1]:
+        scale *= 2
+    return scale
+
+
+def open_image(source, admitted: bool = False):
+    """
+    Image.open (reading only the header); with `admitted`, Pillow's
+    decompression-bomb limit is lifted for this one image.
+    """
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        if admitted:
+            Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(source)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def header_orientation(header) -> int | None:
+    """
+    EXIF orientation of an opened, not yet loaded image. None for a PNG
+    without an eXIf chunk before its pixels: Pillow would decode the whole
+    image to look for one after them.
+    """
+    if header.format == 'PNG' and 'exif' not in header.info:
+        return None
+    return header.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def decode_estimate(source, renditions: list[dict], mode: str | None = None) -> tuple[tuple[int, int], int, int]:
+    """
+    Read only the header of `source` and return its (width, height) and
+    the peak bytes a render is expected to allocate, normally and with
+    `reduced=True`: the decoded pixels at the JPEG draft scale, a second
+    copy when the EXIF orientation has to be applied, and one buffer per
+    rendition. A file object is left where it was. Images of any size are
+    measured; deciding whether to decode them is up to the caller.
+    """
+    position = source.tell() if hasattr(source, 'tell') else None
+    try:
+        with open_image(source, admitted=True) as header:
+            fmt, image_mode, size = header.format, header.mode, header.size
+            # Unknown for such PNGs, so assume the orientation copy is needed.
+            orientation = header_orientation(header)
+    finally:
+        if position is not None:
+            source.seek(position)
+    oriented = size[::-1] if orientation in (5, 6, 7, 8) else size
+    targets = [target_size(oriented, r) for r in renditions]
+    pixel_bytes = DECODED_BYTES_PER_PIXEL.get(image_mode, 4)
+    outputs = sum(width * height * 4 for width, height in targets)
+    copies = 1 if orientation == 1 else 2
+
+    def peak(reducing_gap):
+        scale = draft_scale(oriented, targets, reducing_gap) if fmt == 'JPEG' else 1
+        decoded = -(-size[0] // scale) * -(-size[1] // scale) * pixel_bytes
+        return decoded * copies + outputs
+
+    return size, peak(RESIZE_MODES[mode or RESIZE_MODE]['reducing_gap']), peak(REDUCED_DRAFT_GAP)
+
+
+def plan_decode(source, renditions: list[dict], max_bytes: int, reduce_bytes: int,
+                mode: str | None = None) -> tuple[tuple[int, int], int, bool]:
+    """
+    Return the (width, height) of `source`, the bytes to reserve for
+    rendering it and whether to decode it with `reduced=True`, which is
+    chosen once a full decode would need more than `reduce_bytes` and a
+    reduced one needs less. Raises ImageTooLarge when the decode would
+    still need more than `max_bytes`.
+    """
+    size, estimate, reduced_estimate = decode_estimate(source, renditions, mode)
+    reduced = estimate > reduce_bytes and reduced_estimate < estimate
+    if reduced:
+        estimate = reduced_estimate
+    if estimate > max_bytes:
+        mib = 1024 * 1024
+        raise ImageTooLarge(
+            f"Image of {size[0]}x{size[1]} pixels needs about {estimate // mib} MiB to decode; "
+            f"the limit is {max_bytes // mib} MiB"
+        )
+    return size, estimate, reduced
+
+
+class ImageTooLarge(ValueError):
+    """Decoding the image would need more memory than the caller allows."""
+
+
+class MemoryBudget:
+    """
+    Decode memory shared by the renders of one process. acquire() blocks
+    until the request fits next to what is already reserved, serving
+    waiters in arrival order so a large image is not starved by a stream of
+    small ones. A request larger than the whole budget runs once nothing
+    else is reserved. `gauge`, if given, tracks the reserved bytes.
+    """
+
+    def __init__(self, limit: int, gauge=None):
+        self.limit = limit
+        self.reserved = 0
+        self.gauge = gauge
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int):
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            while self._waiting[0] is not ticket or (self.reserved and self.reserved + nbytes > self.limit):
+                self._cond.wait()
+            self._waiting.popleft()
+            self.reserved += nbytes
+            self._track()
+            self._cond.notify_all()
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.reserved -= nbytes
+            self._track()
+            self._cond.notify_all()
+
+    def _track(self):
+        if self.gauge is not None:
+            self.gauge.set(self.reserved)
+
+
+def add_timings(timings: dict | None, spent: dict):
+    if timings is not None:
+        for stage, seconds in spent.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class PillowEngine:
+    name = 'pillow'
+
+    def render(self, source, renditions: list[dict], mode: str | None = None,
+               timings: dict | None = None, reduced: bool = False,
+               admitted: bool = False) -> list[tuple[bytes, str]]:
+        """
+        Decode `source` (a path or binary file object) once and return the
+        encoded bytes and format of every rendition, in input order. Larger
+        renditions are built first and each one is resized from the smallest
+        intermediate that is still at least as large as its target. Seconds
+        spent decoding, resizing and encoding are added to `timings`.
+        """
+        settings = RESIZE_MODES[mode or RESIZE_MODE]
+        reducing_gap = settings['reducing_gap']
+        resample = settings['resample']
+        draft_gap = REDUCED_DRAFT_GAP if reduced else reducing_gap
+        spent = {'decode': 0.0, 'resize': 0.0, 'encode': 0.0}
+        started = time.perf_counter()
+        with open_image(source, admitted) as img:
+            source_fmt = img.format
+            orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+            swap = orientation in (5, 6, 7, 8)
+            oriented = img.size[::-1] if swap else img.size
+            targets = [target_size(oriented, r) for r in renditions]
+            if draft_gap is not None:
+                # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale while
+                # staying at least draft_gap times larger than every target.
+                largest = (max(w for w, _ in targets), max(h for _, h in targets))
+                if swap:
+                    largest = largest[::-1]
+                img.draft(None, (int(largest[0] * draft_gap), int(largest[1] * draft_gap)))
+            img.load()
+            if orientation != 1:
+                img = ImageOps.exif_transpose(img)
+            spent['decode'] += time.perf_counter() - started
+
+            # Uniformly scaled copies of the source, largest first.
+            intermediates = [img]
+            results = [None] * len(renditions)
+            order = sorted(range(len(renditions)), key=lambda i: targets[i][0] * targets[i][1], reverse=True)
+            for i in order:
+                started = time.perf_counter()
+                rendition, (width, height) = renditions[i], targets[i]
+                base = min(
+                    (im for im in intermediates if im.width >= width and im.height >= height),
+                    key=lambda im: im.width * im.height,
+                    default=img,
+                )
+                resized = base.resize((width, height), resample, reducing_gap=reducing_gap)
+                if rendition['fit'] != 'stretch':
+                    intermediates.append(resized)
+                box = crop_box((width, height), rendition)
+                if box is not None:
+                    left, top, w, h = box
+                    resized = resized.crop((left, top, left + w, top + h))
+                fmt = rendition.get('format') or source_fmt
+                encode_started = time.perf_counter()
+                spent['resize'] += encode_started - started
+                results[i] = (encode_image(resized, fmt, rendition.get('quality')), fmt)
+                spent['encode'] += time.perf_counter() - encode_started
+        add_timings(timings, spent)
+        return results
+
+
+class NativeEngine:
+    """
+    Shared flow of the optional engines: Pillow reads the header (format,
+    mode, size, orientation) without decoding, then the engine decodes,
+    orients, resizes, crops and encodes with its own library. Images it
+    cannot handle natively are passed to `fallback`.
+    """
+    name = 'native'
+
+    def __init__(self, fallback: PillowEngine):
+        self.fallback = fallback
+
+    def render(self, source, renditions: list[dict], mode: str | None = None,
+               timings: dict | None = None, reduced: bool = False,
+               admitted: bool = False) -> list[tuple[bytes, str]]:
+        data = read_source(source)
+        with open_image(io.BytesIO(data), admitted) as header:
+            source_fmt, image_mode, size = header.format, header.mode, header.size
+            orientation = header_orientation(header) or 1
+        formats = {r.get('format') or source_fmt for r in renditions}
+        if source_fmt not in NATIVE_FORMATS or image_mode not in NATIVE_MODES or not formats <= set(NATIVE_FORMATS):
+            return self.fallback.render(io.BytesIO(data), renditions, mode, timings, reduced, admitted)
+
+        settings = RESIZE_MODES[mode or RESIZE_MODE]
+        oriented = size[::-1] if orientation in (5, 6, 7, 8) else size
+        targets = [target_size(oriented, r) for r in renditions]
+        spent = {'decode': 0.0, 'resize': 0.0, 'encode': 0.0}
+        started = time.perf_counter()
+        draft_gap = REDUCED_DRAFT_GAP if reduced else settings['reducing_gap']
+        shrink = draft_scale(oriented, targets, draft_gap) if source_fmt == 'JPEG' else 1
+        try:
+            img = self.decode(data, shrink, orientation, sequential=len(renditions) == 1 and orientation == 1)
+        except Exception as e:
+            # Truncated or unusual files: Pillow decodes them or raises the
+            # errors the processor already classifies.
+            print(f"[WARN] {self.name} could not decode the image ({e}); using Pillow")
+            return self.fallback.render(io.BytesIO(data), renditions, mode, timings, reduced, admitted)
+        spent['decode'] += time.perf_counter() - started
+
+        results = []
+        for rendition, (width, height) in zip(renditions, targets):
+            started = time.perf_counter()
+            resized = self.resize(img, (width, height), settings)
+            box = crop_box((width, height), rendition)
+            if box is not None:
+                resized = self.crop(resized, box)
+            fmt = rendition.get('format') or source_fmt
+            encode_started = time.perf_counter()
+            spent['resize'] += encode_started - started
+            quality = rendition.get('quality') or DEFAULT_QUALITY.get(fmt)
+            results.append((self.encode(resized, fmt, quality), fmt))
+            spent['encode'] += time.perf_counter() - encode_started
+        add_timings(timings, spent)
+        return results
+
+
+class VipsEngine(NativeEngine):
+    """libvips: demand-driven, so a single upright rendition streams through in strips."""
+    name = 'vips'
+    KERNELS = {Image.Resampling.BICUBIC: 'cubic', Image.Resampling.BILINEAR: 'linear'}
+    SUFFIXES = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+    def __init__(self, fallback: PillowEngine):
+        super().__init__(fallback)
+        import pyvips
+        self.pyvips = pyvips
+
+    def decode(self, data: bytes, shrink: int, orientation: int, sequential: bool):
+        options = {'access': 'sequential' if sequential else 'random'}
+        if shrink > 1:
+            options['shrink'] = shrink
+        img = self.pyvips.Image.new_from_buffer(data, '', **options)
+        if img.interpretation in ('rgb16', 'grey16'):
+            img = img.colourspace('srgb' if img.interpretation == 'rgb16' else 'b-w')
+        return img.autorot() if orientation != 1 else img
+
+    def resize(self, img, size: tuple[int, int], settings: dict):
+        return img.resize(
+            size[0] / img.width,
+            vscale=size[1] / img.height,
+            kernel=self.KERNELS.get(settings['resample'], 'cubic'),
+        )
+
+    def crop(self, img, box):
+        return img.crop(*box)
+
+    def encode(self, img, fmt: str, quality: int | None) -> bytes:
+        if fmt == 'JPEG' and img.hasalpha():
+            img = img.extract_band(0, n=img.bands - 1)
+        options = {} if quality is None else {'Q': quality}
+        return img.write_to_buffer(self.SUFFIXES[fmt], **options)
+
+
+class OpenCVEngine(NativeEngine):
+    """OpenCV: INTER_AREA for every downscale, the mode's filter for upscales."""
+    name = 'opencv'
+
+    def __init__(self, fallback: PillowEngine):
+        super().__init__(fallback)
+        import cv2
+        import numpy
+        self.cv2 = cv2
+        self.numpy = numpy
+        self.filters = {Image.Resampling.BICUBIC: cv2.INTER_CUBIC, Image.Resampling.BILINEAR: cv2.INTER_LINEAR}
+        self.reduced = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+    def decode(self, data: bytes, shrink: int, orientation: int, sequential: bool):
+        cv2 = self.cv2
+        # Orientation is applied here rather than by imdecode, which would
+        # drop the alpha channel to do it.
+        flags = self.reduced[shrink] if shrink > 1 else cv2.IMREAD_UNCHANGED
+        img = cv2.imdecode(self.numpy.frombuffer(data, self.numpy.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is None:
+            raise ValueError('OpenCV could not decode the image')
+        if img.dtype != self.numpy.uint8:
+            img = (img >> 8).astype(self.numpy.uint8)
+        if orientation in (2, 4):
+            img = cv2.flip(img, 1 if orientation == 2 else 0)
+        elif orientation in (3, 6, 8):
+            rotations = {3: cv2.ROTATE_180, 6: cv2.ROTATE_90_CLOCKWISE, 8: cv2.ROTATE_90_COUNTERCLOCKWISE}
+            img = cv2.rotate(img, rotations[orientation])
+        elif orientation == 5:
+            img = cv2.transpose(img)
+        elif orientation == 7:
+            img = cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)
+        return img
+
+    def resize(self, img, size: tuple[int, int], settings: dict):
+        height, width = img.shape[:2]
+        if size[0] <= width and size[1] <= height:
+            interpolation = self.cv2.INTER_AREA
+        else:
+            interpolation = self.filters.get(settings['resample'], self.cv2.INTER_CUBIC)
+        return self.cv2.resize(img, size, interpolation=interpolation)
+
+    def crop(self, img, box):
+        left, top, width, height = box
+        return img[top:top + height, left:left + width]
+
+    def encode(self, img, fmt: str, quality: int | None) -> bytes:
+        cv2 = self.cv2
+        params = []
+        if fmt == 'JPEG':
+            if img.ndim == 3 and img.shape[2] == 4:
+                img = img[:, :, :3]
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif fmt == 'WEBP':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        ok, encoded = cv2.imencode(VipsEngine.SUFFIXES[fmt], img, params)
+        if not ok:
+            raise ValueError(f'OpenCV could not encode {fmt}')
+        return encoded.tobytes()
+
+
+ENGINES = {'pillow': PillowEngine, 'vips': VipsEngine, 'opencv': OpenCVEngine}
+
+
+def load_engine(name: str):
+    """The named engine, or Pillow when its library is not installed."""
+    pillow = PillowEngine()
+    if name not in ENGINES:
+        raise ValueError(f"unknown resize engine {name!r}; expected one of {', '.join(ENGINES)}")
+    if name == 'pillow':
+        return pillow
+    try:
+        return ENGINES[name](pillow)
+    except ImportError as e:
+        print(f"[WARN] Resize engine '{name}' is not available ({e}); using Pillow")
+        return pillow
+
+
+def available_engines() -> list:
+    """Every engine whose library is installed."""
+    pillow = PillowEngine()
+    engines = [pillow]
+    for name, engine_class in ENGINES.items():
+        if name != 'pillow':
+            try:
+                engines.append(engine_class(pillow))
+            except ImportError:
+                pass
+    return engines
@@ -1,39 +1,150 @@
-from datetime import timedelta
-from io import BytesIO
+import base64
+from datetime import datetime, timedelta, timezone
+import hashlib
+import io
+import json
+import mimetypes
 import os
+import re
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
 import uuid
 
-from flask import Flask, request, jsonify, Response
-from minio import Minio
+from flask import Flask, g, request, jsonify, redirect, Response
 from minio.error import S3Error
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
 
-from db import init_db, create_job, get_job
+import job_events
+import metrics
+import resize_engines
+import storage
+import thumb_cache
+from db import (
+    DEFAULT_TENANT,
+    JOB_PRIORITIES,
+    JOB_STATUSES,
+    init_db,
+    create_job,
+    create_jobs,
+    get_cache_stats,
+    get_job,
+    get_jobs,
+    list_completed_jobs,
+    update_job_status,
+)
+from renditions import (
+    DEFAULT_PROFILE, DEFAULT_RENDITION, extension_format, on_demand_rendition, rendition_key, resolve_renditions,
+)
+from upload_stream import HashingReader, MultipartUpload
 
 
 app = Flask(__name__)
+# Uploaded files may be up to MAX_UPLOAD_BYTES each. /api/upload/batch
+# checks that per file part as it streams, so one batch can carry many
+# files; every other route rejects a larger body with 413 before (or while)
+# reading it.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
-# MinIO config
-MINIO_ENDPOINT = 'minio:9000'
-MINIO_ACCESS_KEY = 'minioadmin'
-MINIO_SECRET_KEY = 'minioadmin'
+# MinIO config. The connection pool matches gunicorn's thread count so each
+# request thread keeps its own keep-alive connection.
+MINIO_POOL_SIZE = int(os.environ.get('MINIO_POOL_SIZE', 32))
 UPLOAD_BUCKET = 'uploads'
 RESIZED_BUCKET = 'resized'
 
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False
-)
+# Batch endpoints accept at most this many files per request. Streamed
+# uploads of unknown length are sent to MinIO in UPLOAD_PART_SIZE parts
+# (MinIO's minimum is 5 MiB), which bounds memory per file.
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 1000))
+UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', 5 * 1024 * 1024))
+
+# Resized images are streamed in DOWNLOAD_CHUNK_SIZE chunks and cached by
+# clients for RESIZED_CACHE_MAX_AGE seconds before revalidating. With
+# RESIZED_REDIRECT=1 clients are redirected to a presigned MinIO URL so the
+# bytes bypass this process entirely.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RESIZED_CACHE_MAX_AGE = int(os.environ.get('RESIZED_CACHE_MAX_AGE', 3600))
+RESIZED_REDIRECT = os.environ.get('RESIZED_REDIRECT') == '1'
+
+# /api/resized/<name>?w=&h=&fit=&fmt= renders a rendition of an upload on
+# first request and stores it in the resized bucket. Identical concurrent
+# requests share one render, and at most ON_DEMAND_MAX_RENDERS run at once
+# per process, on the processor's resize engine settings.
+ON_DEMAND_PARAMS = ('w', 'h', 'fit', 'fmt')
+ON_DEMAND_MAX_RENDERS = int(os.environ.get('ON_DEMAND_MAX_RENDERS', os.cpu_count() or 1))
+# Decode memory on-demand renders may reserve at once per process, checked
+# from the image header as in the processor (see image_processor.py):
+# larger images decode at reduced resolution, and those that would still
+# need more than ON_DEMAND_DECODE_MAX_BYTES are answered with 413.
+ON_DEMAND_MEMORY_BUDGET = int(os.environ.get('ON_DEMAND_MEMORY_BUDGET', 512 * 1024 * 1024))
+ON_DEMAND_DECODE_MAX_BYTES = int(os.environ.get('ON_DEMAND_DECODE_MAX_BYTES', ON_DEMAND_MEMORY_BUDGET))
+ON_DEMAND_DECODE_REDUCE_BYTES = int(os.environ.get('ON_DEMAND_DECODE_REDUCE_BYTES', ON_DEMAND_MEMORY_BUDGET // 4))
+
+# /api/resized listing: page size limits and how long a page is served from
+# the in-process cache before the database is asked again.
+LISTING_DEFAULT_LIMIT = 100
+LISTING_MAX_LIMIT = 500
+LISTING_CACHE_TTL = float(os.environ.get('LISTING_CACHE_TTL', 2))
+LISTING_CACHE_MAX_ENTRIES = 256
+_listing_cache: dict[tuple, tuple[float, dict]] = {}
+_listing_cache_lock = threading.Lock()
+
+# /api/jobs bulk lookup: at most JOB_LOOKUP_MAX_IDS ids per request, all
+# resolved by one query. Without ids, jobs matching the status and time
+# filters are paged newest first, JOB_LOOKUP_DEFAULT_LIMIT at a time.
+JOB_LOOKUP_MAX_IDS = int(os.environ.get('JOB_LOOKUP_MAX_IDS', 2000))
+JOB_LOOKUP_DEFAULT_LIMIT = 100
+JOB_LOOKUP_MAX_LIMIT = 1000
+
+# Jobs are attributed to the tenant named in TENANT_HEADER (set it at the
+# gateway from the caller's identity) and queued in the 'interactive' lane
+# for single uploads or the 'bulk' lane for batches, unless the request
+# names a `priority`. The processor schedules lanes and tenants fairly.
+TENANT_HEADER = 'X-Tenant-Id'
+TENANT_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+# Job event streams: SSE clients get a comment every SSE_HEARTBEAT_SECONDS
+# so proxies keep the connection open; long-polls wait at most
+# LONG_POLL_MAX_SECONDS. Both are fed by job_events, not by polling the DB.
+TERMINAL_STATUSES = ('completed', 'error')
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+LONG_POLL_MAX_SECONDS = 30
+# Each open stream or long-poll holds one of the worker's request threads
+# (gunicorn --threads 32) until it ends. Past JOB_WAIT_MAX_CLIENTS per
+# process, they get 503 with Retry-After, so uploads and lookups always
+# find a free thread.
+JOB_WAIT_MAX_CLIENTS = int(os.environ.get('JOB_WAIT_MAX_CLIENTS', 16))
+JOB_WAIT_RETRY_AFTER = 5
+
+# Latency until the response is returned by the view; for streamed bodies
+# that is time to first byte. Scraped from GET /metrics on each worker.
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    'http_request_duration_seconds', 'API request latency by route.', ['method', 'route', 'status'])
+
+ON_DEMAND_RENDERS = metrics.Counter(
+    'resized_on_demand_renders_total', 'On-demand renditions rendered, by what they were rendered from.',
+    ['source'])
+
+minio_client = storage.create_client(pool_size=MINIO_POOL_SIZE)
+# Hot resized images are answered from memory (or the shared disk tier)
+# without a MinIO round-trip; see thumb_cache.py for the settings.
+resized_cache = thumb_cache.ThumbnailCache()
+resize_engine = resize_engines.load_engine(resize_engines.RESIZE_ENGINE)
+_renders = thumb_cache.SingleFlight()
+_render_slots = threading.BoundedSemaphore(ON_DEMAND_MAX_RENDERS)
+_render_budget = resize_engines.MemoryBudget(ON_DEMAND_MEMORY_BUDGET)
+_wait_slots = threading.BoundedSemaphore(JOB_WAIT_MAX_CLIENTS)
 
 # Allow tests (and some environments) to skip external initialisation
 SKIP_EXTERNAL_INIT = os.environ.get("SKIP_EXTERNAL_INIT") == "1"
 
 if not SKIP_EXTERNAL_INIT:
-    # Ensure buckets exist
+    # Ensure buckets exist, once per process; request handlers never check.
     for bucket in [UPLOAD_BUCKET, RESIZED_BUCKET]:
-        if not minio_client.bucket_exists(bucket):
-            minio_client.make_bucket(bucket)
+        storage.ensure_bucket(minio_client, bucket)
 
     # Initialise database schema
     try:
@@ -41,57 +152,419 @@ if not SKIP_EXTERNAL_INIT:
     except Exception as e:
         print(f"[WARN] Failed to initialise database: {e}")
 
+    if resized_cache.enabled:
+        thumb_cache.follow_job_events(resized_cache, job_events.hub)
+
+
+def rendition_summary(object_name, renditions):
+    """The resized-bucket key each rendition of a job will be written to."""
+    return [
+        {'name': rendition['name'], 'key': rendition_key(object_name, rendition)}
+        for rendition in renditions
+    ]
+
+
+def form_renditions(form):
+    """Optional rendition spec from form fields: a profile or a JSON list."""
+    raw_renditions = form.get('renditions')
+    return resolve_renditions(
+        form.get('profile'),
+        json.loads(raw_renditions) if raw_renditions else None,
+    )
+
+
+def job_tags(headers, requested_priority, default_priority, batch=False):
+    """
+    (priority, tenant) for new jobs; raises ValueError for invalid values.
+    Batches always go to the bulk lane: a requested 'interactive' is
+    lowered, so one request cannot fill the interactive lane.
+    """
+    tenant = headers.get(TENANT_HEADER) or DEFAULT_TENANT
+    if not TENANT_PATTERN.fullmatch(tenant):
+        raise ValueError(f'{TENANT_HEADER} must be 1-64 letters, digits, ".", "_" or "-"')
+    priority = requested_priority or default_priority
+    if priority not in JOB_PRIORITIES:
+        raise ValueError(f'priority must be one of {", ".join(JOB_PRIORITIES)}')
+    if batch:
+        priority = 'bulk'
+    return priority, tenant
+
+
+def lane_metadata(priority, tenant):
+    """Object metadata that lets the processor route an upload without a job lookup."""
+    return {'priority': priority, 'tenant': tenant}
+
+
+def external_url(url):
+    """Patch a MinIO URL to use the nginx /minio/ path for external access."""
+    parsed = urlparse(url)
+    # Replace scheme and netloc with nginx endpoint, and prefix path with /minio
+    external_base = os.environ.get('MINIO_EXTERNAL_BASE', 'http://localhost:8080/minio')
+    ext_parsed = urlparse(external_base)
+    # Remove leading slash from parsed.path to avoid double slashes
+    minio_path = parsed.path.lstrip('/')
+    new_path = ext_parsed.path.rstrip('/') + '/' + minio_path
+    return urlunparse((ext_parsed.scheme, ext_parsed.netloc, new_path, parsed.params, parsed.query, parsed.fragment))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The URL rule, not the path, keeps label cardinality bounded.
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route,
+            status=response.status_code,
+        )
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = request.max_content_length
+    return jsonify({'error': f'Upload exceeds the {limit} byte limit'}), 413
+
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
-    if 'image' not in request.files:
+    """
+    Stream the 'image' part of a multipart body straight to MinIO in
+    UPLOAD_PART_SIZE parts, hashing it on the way, so memory per request
+    stays bounded regardless of the file size. Optional 'profile' and
+    'renditions' fields must precede the file part.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'No image part'}), 400
+    upload = MultipartUpload(request.stream, boundary.encode('latin-1'))
+    part = upload.next_file('image')
+    if part is None:
         return jsonify({'error': 'No image part'}), 400
-    file = request.files['image']
-    if file.filename == '':
+    if part.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    original_filename = file.filename
+    original_filename = part.filename
+    try:
+        renditions = form_renditions(upload.form)
+        priority, tenant = job_tags(request.headers, upload.form.get('priority'), 'interactive')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     # Generate a job id and embed it into the object name so the
     # image-processor (driven by MinIO events) can recover it later.
     job_id = str(uuid.uuid4())
     object_name = f"{job_id}_{original_filename}"
-    file_stream = BytesIO(file.read())
-    file_stream.seek(0)
-    minio_client.put_object(
-        UPLOAD_BUCKET,
-        object_name,
-        file_stream,
-        length=file_stream.getbuffer().nbytes,
-        content_type=file.mimetype
+    # Record the job as pending before the object exists: the MinIO event
+    # drives processing, and the processor reads the renditions from the row.
+    create_job(
+        filename=object_name,
+        original_filename=original_filename,
+        job_id=job_id,
+        renditions=renditions,
+        priority=priority,
+        tenant=tenant,
     )
-    # Record the job as pending in the DB. The MinIO event will drive
-    # the actual processing and status transitions.
-    create_job(filename=object_name, original_filename=original_filename, job_id=job_id)
+    body = HashingReader(upload)
+    try:
+        minio_client.put_object(
+            UPLOAD_BUCKET,
+            object_name,
+            body,
+            length=-1,
+            part_size=UPLOAD_PART_SIZE,
+            content_type=part.content_type,
+            metadata=lane_metadata(priority, tenant),
+        )
+    except Exception as e:
+        update_job_status(job_id, 'error', error_message=str(e) or type(e).__name__)
+        raise
+    upload.drain()
     return jsonify(
         {
             'message': 'Image received, job submitted for processing.',
             'job_id': job_id,
             'status': 'pending',
+            'priority': priority,
             'object_name': object_name,
+            'renditions': rendition_summary(object_name, renditions),
+            'size': body.size,
+            'sha256': body.hexdigest(),
         }
     ), 202
 
 
+def not_modified(etag, last_modified):
+    """Whether the request's validators match the current object."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def requested_range(etag, size):
+    """
+    (start, stop) of a satisfiable single-range request, None for a full
+    response, or False when the range cannot be satisfied.
+    """
+    if request.range is None:
+        return None
+    # If-Range: only honour the range while the client's copy is current.
+    if request.if_range.etag is not None and request.if_range.etag != etag:
+        return None
+    if request.if_range.date is not None:
+        return None
+    byte_range = request.range.range_for_length(size)
+    return byte_range if byte_range is not None else False
+
+
+def stream_object(data):
+    try:
+        yield from data.stream(DOWNLOAD_CHUNK_SIZE)
+    finally:
+        data.close()
+        data.release_conn()
+
+
+def fetch_object(filename, size):
+    """The whole object as bytes."""
+    return b''.join(stream_object(minio_client.get_object(RESIZED_BUCKET, filename, offset=0, length=size)))
+
+
+def requested_rendition(filename, args):
+    """
+    (object key, rendition) for a request's on-demand parameters, or
+    (filename, None) without any. Raises ValueError for invalid ones.
+    """
+    if not any(param in args for param in ON_DEMAND_PARAMS):
+        return filename, None
+    if '/' in filename:
+        raise ValueError('w, h, fit and fmt apply to uploaded images only')
+    # Without fmt the upload's format is kept (PNG for ones we do not
+    # encode), whichever stored image the render starts from.
+    rendition = on_demand_rendition(
+        *(args.get(param) for param in ON_DEMAND_PARAMS), default_format=extension_format(filename) or 'PNG')
+    return rendition_key(filename, rendition), rendition
+
+
+def on_demand_source(filename, rendition):
+    """
+    Bytes to render `rendition` of upload `filename` from: the smallest
+    stored 'contain' rendition that is at least as large, else the upload.
+    """
+    job_id = filename.split('_', 1)[0]
+    try:
+        job = get_job(job_id) if len(job_id) == 36 else None
+    except Exception as e:
+        print(f"[WARN] Could not look up job {job_id}: {e}")
+        job = None
+    if job is not None and job['status'] == 'completed' and job['renditions']:
+        candidates = sorted(
+            (r for r in job['renditions']
+             if r['fit'] == 'contain' and r['width'] >= rendition['width'] and r['height'] >= rendition['height']),
+            key=lambda r: r['width'] * r['height'],
+        )
+        for candidate in candidates:
+            try:
+                data = b''.join(stream_object(minio_client.get_object(RESIZED_BUCKET, rendition_key(filename, candidate))))
+            except S3Error:
+                continue
+            # A 'contain' rendition keeps the source's aspect ratio, but
+            # 'cover' may still need more pixels than it has.
+            with resize_engines.open_image(io.BytesIO(data)) as img:
+                needed = resize_engines.target_size(img.size, rendition)
+                if needed[0] <= img.width and needed[1] <= img.height:
+                    ON_DEMAND_RENDERS.inc(source='rendition')
+                    return data
+    data = b''.join(stream_object(minio_client.get_object(UPLOAD_BUCKET, filename)))
+    ON_DEMAND_RENDERS.inc(source='upload')
+    return data
+
+
+def render_on_demand(filename, rendition, key):
+    """
+    Render `rendition` of upload `filename`, store it under `key` in the
+    resized bucket and return it as a CachedObject. Concurrent calls for
+    the same key share one render. Raises S3Error when the upload does not
+    exist and resize_engines.ImageTooLarge when it is too large to decode.
+    """
+    def render():
+        with _render_slots:
+            source = on_demand_source(filename, rendition)
+            _, estimate, reduced = resize_engines.plan_decode(
+                io.BytesIO(source), [rendition], ON_DEMAND_DECODE_MAX_BYTES, ON_DEMAND_DECODE_REDUCE_BYTES)
+            _render_budget.acquire(estimate)
+            try:
+                [(data, fmt)] = resize_engine.render(
+                    io.BytesIO(source), [rendition], reduced=reduced, admitted=True)
+            finally:
+                _render_budget.release(estimate)
+        content_type = Image.MIME.get(fmt, 'application/octet-stream')
+        result = minio_client.put_object(
+            RESIZED_BUCKET, key, io.BytesIO(data), length=len(data), content_type=content_type)
+        entry = thumb_cache.CachedObject(
+            data, result.etag, content_type, datetime.now(timezone.utc).replace(microsecond=0), time.time())
+        resized_cache.put(key, data, entry.etag, content_type, entry.last_modified)
+        return entry
+
+    return _renders.do(key, render)
+
+
 # Serve resized images from MinIO
-@app.route('/api/resized/<filename>')
+@app.route('/api/resized/<path:filename>')
 def resized_file(filename):
+    source = filename
     try:
-        data = minio_client.get_object(RESIZED_BUCKET, filename)
-        return Response(data.read(), mimetype="image/jpeg")
-    except S3Error:
-        return jsonify({'error': 'Image not found'}), 404
+        filename, rendition = requested_rendition(source, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    entry = None if RESIZED_REDIRECT else resized_cache.get(filename)
+    if entry is None:
+        try:
+            stat = minio_client.stat_object(RESIZED_BUCKET, filename)
+        except S3Error:
+            if rendition is None:
+                return jsonify({'error': 'Image not found'}), 404
+            try:
+                entry = render_on_demand(source, rendition, filename)
+            except S3Error:
+                return jsonify({'error': 'Image not found'}), 404
+            except (resize_engines.ImageTooLarge, Image.DecompressionBombError) as e:
+                return jsonify({'error': str(e)}), 413
+            except OSError:
+                return jsonify({'error': 'Image cannot be resized'}), 422
+    if entry is not None:
+        etag, last_modified, size, content_type = entry.etag, entry.last_modified, entry.size, entry.content_type
+    else:
+        if RESIZED_REDIRECT:
+            url = minio_client.presigned_get_object(RESIZED_BUCKET, filename, expires=timedelta(minutes=10))
+            return redirect(external_url(url), code=302)
+
+        etag, last_modified, size = stat.etag, stat.last_modified, stat.size
+        content_type = stat.content_type
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={RESIZED_CACHE_MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    if not_modified(etag, last_modified):
+        return Response(status=304, headers=headers)
+
+    byte_range = requested_range(etag, size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+    if byte_range is None:
+        status, offset, length = 200, 0, size
+    else:
+        start, stop = byte_range
+        status, offset, length = 206, start, stop - start
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(length)
+
+    if entry is not None:
+        data = entry.data
+    elif resized_cache.cacheable(size):
+        # Fill the cache with the whole object, even for a range request.
+        try:
+            data = fetch_object(filename, size)
+        except S3Error:
+            return jsonify({'error': 'Image not found'}), 404
+        resized_cache.put(filename, data, etag, content_type, last_modified)
+    else:
+        try:
+            data = minio_client.get_object(RESIZED_BUCKET, filename, offset=offset, length=length)
+        except S3Error:
+            return jsonify({'error': 'Image not found'}), 404
+        return Response(
+            stream_object(data),
+            status=status,
+            headers=headers,
+            mimetype=content_type,
+            direct_passthrough=True,
+        )
+    return Response(data[offset:offset + length], status=status, headers=headers, mimetype=content_type)
+
+
+def encode_cursor(updated_at, job_id):
+    raw = f"{updated_at.isoformat()}|{job_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    updated_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    return datetime.fromisoformat(updated_at), str(uuid.UUID(job_id))
+
+
+def feed_key(job):
+    """Key of the rendition a job contributes to the feed."""
+    renditions = job.get('renditions') or resolve_renditions(DEFAULT_PROFILE)
+    shown = next((r for r in renditions if r['name'] == DEFAULT_RENDITION), renditions[0])
+    return rendition_key(job['filename'], shown)
+
+
+def cached_listing(key, build):
+    """Serve `build()` from a short-TTL in-process cache keyed on `key`."""
+    now = time.monotonic()
+    with _listing_cache_lock:
+        hit = _listing_cache.get(key)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+    payload = build()
+    with _listing_cache_lock:
+        if len(_listing_cache) >= LISTING_CACHE_MAX_ENTRIES:
+            expired = [k for k, (expires, _) in _listing_cache.items() if expires <= now]
+            for stale in expired or list(_listing_cache):
+                del _listing_cache[stale]
+        _listing_cache[key] = (now + LISTING_CACHE_TTL, payload)
+    return payload
 
 
-# List resized images from MinIO
+# List resized images, newest first, from the job table
 @app.route('/api/resized', methods=['GET'])
 def list_resized_images():
-    objects = minio_client.list_objects(RESIZED_BUCKET)
-    images = [obj.object_name for obj in objects if obj.object_name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))]
-    return jsonify({'images': images})
+    """
+    Keyset-paginated feed of completed jobs. Pass `cursor` (from
+    `next_cursor`) for the next page and `since` (an ISO timestamp, e.g. a
+    previous response's `latest`) to get only newer images.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', LISTING_DEFAULT_LIMIT)), 1), LISTING_MAX_LIMIT)
+        cursor = request.args.get('cursor')
+        since = request.args.get('since')
+        cursor_key = decode_cursor(cursor) if cursor else None
+        # A '+' in an unencoded UTC offset arrives as a space.
+        since_time = datetime.fromisoformat(since.replace(' ', '+')) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, cursor or since'}), 400
+
+    def build():
+        jobs = list_completed_jobs(limit, cursor=cursor_key, since=since_time)
+        last = jobs[-1] if len(jobs) == limit else None
+        latest = jobs[0]['updated_at'] if jobs else since_time
+        return {
+            'images': [feed_key(job) for job in jobs],
+            'next_cursor': encode_cursor(last['updated_at'], last['id']) if last else None,
+            'latest': latest.isoformat() if latest else None,
+        }
+
+    return jsonify(cached_listing((limit, cursor, since), build))
 
 # Generate a presigned URL for uploading to MinIO
 @app.route('/api/presigned-upload', methods=['POST'])
@@ -101,6 +574,11 @@ def presigned_upload():
         return jsonify({'error': 'Missing filename'}), 400
     original_filename = data['filename']
     content_type = data.get('content_type', 'application/octet-stream')
+    try:
+        renditions = resolve_renditions(data.get('profile'), data.get('renditions'))
+        priority, tenant = job_tags(request.headers, data.get('priority'), 'interactive')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # First, generate the presigned URL. If this fails, the client truly
     # cannot upload, so we return an error.
@@ -115,22 +593,20 @@ def presigned_upload():
             object_name,
             expires=timedelta(minutes=10)
         )
-        # Patch the URL to use nginx /minio/ path for external access
-        from urllib.parse import urlparse, urlunparse
-        parsed = urlparse(url)
-        # Replace scheme and netloc with nginx endpoint, and prefix path with /minio
-        external_base = os.environ.get('MINIO_EXTERNAL_BASE', 'http://localhost:8080/minio')
-        ext_parsed = urlparse(external_base)
-        # Remove leading slash from parsed.path to avoid double slashes
-        minio_path = parsed.path.lstrip('/')
-        new_path = ext_parsed.path.rstrip('/') + '/' + minio_path
-        new_url = urlunparse((ext_parsed.scheme, ext_parsed.netloc, new_path, parsed.params, parsed.query, parsed.fragment))
+        new_url = external_url(url)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
     # Record the pending job linked to this object. The MinIO event
     # (consumed by the image-processor) will drive status updates.
-    create_job(filename=object_name, original_filename=original_filename, job_id=job_id)
+    create_job(
+        filename=object_name,
+        original_filename=original_filename,
+        job_id=job_id,
+        renditions=renditions,
+        priority=priority,
+        tenant=tenant,
+    )
 
     return jsonify(
         {
@@ -139,11 +615,297 @@ def presigned_upload():
             'headers': {'Content-Type': content_type},
             'job_id': job_id,
             'status': 'pending',
+            'priority': priority,
             'object_name': object_name,
+            'renditions': rendition_summary(object_name, renditions),
         }
     )
 
 
+@app.route('/api/presigned-upload/batch', methods=['POST'])
+def presigned_upload_batch():
+    """
+    Presigned PUT URLs and job ids for many files at once. Expects
+    {"files": [{"filename": ..., "content_type": ...}, ...]} plus an optional
+    profile/renditions spec applied to every file. All job rows are
+    inserted with a single statement.
+    """
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    if not isinstance(files, list) or not files:
+        return jsonify({'error': 'Missing files'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per batch'}), 400
+    if not all(isinstance(f, dict) and f.get('filename') for f in files):
+        return jsonify({'error': 'Every file needs a filename'}), 400
+    try:
+        renditions = resolve_renditions(data.get('profile'), data.get('renditions'))
+        priority, tenant = job_tags(request.headers, data.get('priority'), 'bulk', batch=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    uploads = []
+    jobs = []
+    try:
+        for f in files:
+            job_id = str(uuid.uuid4())
+            object_name = f"{job_id}_{f['filename']}"
+            url = minio_client.presigned_put_object(
+                UPLOAD_BUCKET,
+                object_name,
+                expires=timedelta(minutes=10)
+            )
+            jobs.append((job_id, object_name, f['filename'], renditions))
+            uploads.append(
+                {
+                    'filename': f['filename'],
+                    'url': external_url(url),
+                    'method': 'PUT',
+                    'headers': {'Content-Type': f.get('content_type', 'application/octet-stream')},
+                    'job_id': job_id,
+                    'status': 'pending',
+                    'object_name': object_name,
+                    'renditions': rendition_summary(object_name, renditions),
+                }
+            )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    create_jobs(jobs, priority=priority, tenant=tenant)
+    return jsonify({'uploads': uploads})
+
+
+def store_batch_file(upload, part, renditions, priority, tenant):
+    """
+    Insert the job row for one batch file, then stream the file to MinIO.
+    Returns the file's entry in the response; a failure at either step is
+    reported in it rather than raised, so the files stored before it stay
+    trackable.
+    """
+    job_id = str(uuid.uuid4())
+    object_name = f"{job_id}_{part.filename}"
+    # The row exists before the object, so the processor always finds
+    # the requested renditions when the MinIO event arrives.
+    try:
+        create_job(
+            filename=object_name,
+            original_filename=part.filename,
+            job_id=job_id,
+            renditions=renditions,
+            priority=priority,
+            tenant=tenant,
+        )
+    except Exception as e:
+        print(f"[WARN] Could not create a job for batch file {part.filename}: {e}")
+        return {'filename': part.filename, 'status': 'error', 'error': 'Could not create the job'}
+    result = {'filename': part.filename, 'job_id': job_id, 'object_name': object_name}
+    body = HashingReader(upload)
+    try:
+        minio_client.put_object(
+            UPLOAD_BUCKET,
+            object_name,
+            body,
+            length=-1,
+            part_size=UPLOAD_PART_SIZE,
+            content_type=part.content_type,
+            metadata=lane_metadata(priority, tenant),
+        )
+    except Exception as e:
+        message = e.description if isinstance(e, RequestEntityTooLarge) else str(e) or type(e).__name__
+        try:
+            update_job_status(job_id, 'error', error_message=message)
+        except Exception as inner:
+            print(f"[WARN] Could not mark job {job_id} as failed: {inner}")
+        return {**result, 'status': 'error', 'error': message}
+    return {
+        **result,
+        'status': 'pending',
+        'renditions': rendition_summary(object_name, renditions),
+        'size': body.size,
+        'sha256': body.hexdigest(),
+    }
+
+
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_image_batch():
+    """
+    Multipart upload of many files under the 'images' field. Each file is
+    streamed to MinIO as its part arrives, like /api/upload, after its job
+    row is inserted. Failures are reported per file; if the body itself
+    breaks off, the files stored so far are returned with a final error
+    entry. Optional 'profile', 'renditions' and 'priority' fields must
+    precede the first file part. Files past BATCH_MAX_FILES, and files
+    larger than MAX_UPLOAD_BYTES, are skipped and reported.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'No image part'}), 400
+    # MAX_CONTENT_LENGTH would cap the whole body; the batch limits each file.
+    stream = get_input_stream(request.environ)
+    upload = MultipartUpload(stream, boundary.encode('latin-1'), max_file_size=MAX_UPLOAD_BYTES)
+
+    results = []
+    renditions = priority = tenant = None
+    while True:
+        try:
+            part = upload.next_file('images')
+        except Exception as e:
+            if not results:
+                raise
+            # Truncated or malformed body: keep what was stored trackable.
+            print(f"[WARN] Batch upload body broke off after {len(results)} files: {e}")
+            results.append({'status': 'error', 'error': f'Upload body ended early: {e}'})
+            break
+        if part is None:
+            break
+        if not part.filename:
+            continue
+        if renditions is None:
+            try:
+                renditions = form_renditions(upload.form)
+                priority, tenant = job_tags(request.headers, upload.form.get('priority'), 'bulk', batch=True)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        if len(results) >= BATCH_MAX_FILES:
+            results.append({
+                'filename': part.filename,
+                'status': 'error',
+                'error': f'At most {BATCH_MAX_FILES} files per batch',
+            })
+            continue
+        results.append(store_batch_file(upload, part, renditions, priority, tenant))
+    if not results:
+        return jsonify({'error': 'No image part'}), 400
+    return jsonify({'uploads': results}), 202
+
+
+def listed(value):
+    """Strings from a list and/or comma-separated values, blanks dropped."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('expected a string or a list of strings')
+    return [part.strip() for item in value for part in item.split(',') if part.strip()]
+
+
+def job_lookup_params(args, body=None):
+    """Raw /api/jobs parameters from the query string, overridden by a JSON body."""
+    params = {name: args.getlist(name) for name in ('ids', 'status') if name in args}
+    params.update({name: args.get(name) for name in ('since', 'until', 'limit', 'cursor') if name in args})
+    if body is not None:
+        if not isinstance(body, dict):
+            raise ValueError('Body must be a JSON object')
+        params.update(body)
+    return params
+
+
+def job_lookup(params):
+    """
+    (get_jobs keyword arguments, requested ids) for a bulk lookup; the ids
+    are None when the lookup is by filters only. Raises ValueError.
+    """
+    query = {}
+    requested = None
+    if 'ids' in params:
+        requested = list(dict.fromkeys(listed(params['ids'])))
+        if len(requested) > JOB_LOOKUP_MAX_IDS:
+            raise ValueError(f'At most {JOB_LOOKUP_MAX_IDS} ids per request')
+        valid = []
+        for job_id in requested:
+            try:
+                valid.append(str(uuid.UUID(job_id)))
+            except ValueError:
+                pass  # Cannot exist; reported as missing.
+        query['job_ids'] = valid
+    statuses = listed(params.get('status'))
+    unknown = set(statuses) - set(JOB_STATUSES)
+    if unknown:
+        raise ValueError(f'status must be one of {", ".join(JOB_STATUSES)}')
+    query['statuses'] = statuses or None
+    for name in ('since', 'until'):
+        value = params.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{name} must be an ISO timestamp')
+        # A '+' in an unencoded UTC offset arrives as a space.
+        query[name] = datetime.fromisoformat(value.replace(' ', '+')) if value else None
+    if requested is None:
+        try:
+            limit = int(params.get('limit') or JOB_LOOKUP_DEFAULT_LIMIT)
+        except TypeError:
+            raise ValueError('limit must be an integer') from None
+        query['limit'] = min(max(limit, 1), JOB_LOOKUP_MAX_LIMIT)
+        cursor = params.get('cursor')
+        query['cursor'] = decode_cursor(cursor) if cursor else None
+    return query, requested
+
+
+def compact_job(row):
+    """A job as listed by /api/jobs: id, status and updated_at, plus set fields."""
+    job = {'id': str(row['id']), 'status': row['status'], 'updated_at': row['updated_at'].isoformat()}
+    for name in ('error_message', 'cache_hit'):
+        if row.get(name) is not None:
+            job[name] = row[name]
+    return job
+
+
+def job_lookup_payload(rows, requested, limit=None):
+    """
+    Response body of a bulk lookup: jobs in request order plus the ids not
+    found (or filtered out), or for a filter lookup a page with next_cursor.
+    """
+    if requested is None:
+        last = rows[-1] if limit is not None and len(rows) == limit else None
+        return {
+            'jobs': [compact_job(row) for row in rows],
+            'next_cursor': encode_cursor(last['updated_at'], last['id']) if last else None,
+        }
+    found = {str(row['id']): row for row in rows}
+    jobs, missing = [], []
+    for job_id in requested:
+        try:
+            row = found.get(str(uuid.UUID(job_id)))
+        except ValueError:
+            row = None
+        if row is None:
+            missing.append(job_id)
+        else:
+            jobs.append(compact_job(row))
+    return {'jobs': jobs, 'missing': missing}
+
+
+def payload_etag(payload):
+    """Strong ETag of a JSON payload, so an unchanged result set answers 304."""
+    return hashlib.blake2b(app.json.dumps(payload).encode(), digest_size=16).hexdigest()
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def job_statuses():
+    """
+    Status of many jobs at once. Pass `ids` (repeated or comma-separated,
+    or a JSON list in a POST body) and/or filter by `status`, `since` and
+    `until`. Send the returned ETag as If-None-Match to get a 304 while
+    nothing changed.
+    """
+    try:
+        body = None
+        if request.method == 'POST' and request.get_data():
+            body = request.get_json(silent=True, force=True)
+            if body is None:
+                raise ValueError('Body must be a JSON object')
+        query, requested = job_lookup(job_lookup_params(request.args, body))
+    except ValueError as e:
+        return jsonify({'error': str(e) or 'Invalid job lookup'}), 400
+    rows = get_jobs(**query) if requested is None or query['job_ids'] else []
+    payload = job_lookup_payload(rows, requested, query.get('limit'))
+    etag = payload_etag(payload)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if not_modified(etag, None):
+        return Response(status=304, headers=headers)
+    return jsonify(payload), 200, headers
+
+
 @app.route('/api/jobs/<job_id>', methods=['GET'])
 def job_status(job_id):
     """Return the current status and metadata for an image job."""
@@ -153,5 +915,117 @@ def job_status(job_id):
     return jsonify(job)
 
 
+def sse_message(data, event='status'):
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+
+def canonical_job_id(job_id):
+    """The lowercase, hyphenated form job ids have in NOTIFY payloads, or None."""
+    try:
+        return str(uuid.UUID(job_id))
+    except ValueError:
+        return None
+
+
+def too_many_waiting():
+    response = jsonify({'error': 'Too many clients waiting for jobs, retry later'})
+    response.headers['Retry-After'] = str(JOB_WAIT_RETRY_AFTER)
+    return response, 503
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events_stream(job_id):
+    """
+    Server-sent events for one job: its current state, then every status
+    transition until it completes or fails. The job is read once; later
+    events come from the shared LISTEN connection.
+    """
+    job_id = canonical_job_id(job_id)
+    if job_id is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not _wait_slots.acquire(blocking=False):
+        return too_many_waiting()
+    # Subscribe before reading so a transition between the two is not lost.
+    subscription = job_events.hub.subscribe([job_id])
+    try:
+        job = get_job(job_id)
+    except Exception:
+        subscription.close()
+        _wait_slots.release()
+        raise
+    if not job:
+        subscription.close()
+        _wait_slots.release()
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        with subscription:
+            yield sse_message(job)
+            if job['status'] in TERMINAL_STATUSES:
+                return
+            while True:
+                event = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield sse_message(event)
+                if event.get('status') in TERMINAL_STATUSES:
+                    return
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # Runs however the stream ends, even if it never started.
+    response.call_on_close(subscription.close)
+    response.call_on_close(_wait_slots.release)
+    return response
+
+
+@app.route('/api/jobs/<job_id>/wait', methods=['GET'])
+def job_wait(job_id):
+    """
+    Long-poll fallback for clients without EventSource. Returns the job as
+    soon as its status differs from `status` (the state the client already
+    has), or unchanged after `timeout` seconds.
+    """
+    try:
+        timeout = min(float(request.args.get('timeout', 25)), LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'timeout must be a number'}), 400
+    known_status = request.args.get('status')
+    job_id = canonical_job_id(job_id)
+    if job_id is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not _wait_slots.acquire(blocking=False):
+        return too_many_waiting()
+
+    try:
+        with job_events.hub.subscribe([job_id]) as subscription:
+            job = get_job(job_id)
+            if not job:
+                return jsonify({'error': 'Job not found'}), 404
+            if job['status'] != known_status or job['status'] in TERMINAL_STATUSES:
+                return jsonify(job)
+            event = subscription.get(timeout=max(timeout, 0))
+    finally:
+        _wait_slots.release()
+    if event is not None:
+        job.update(event)
+    return jsonify(job)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit rate and bytes saved by the processor's content-hash dedup cache."""
+    return jsonify(get_cache_stats())
+
+
+@app.route('/api/cache/resized', methods=['GET'])
+def resized_cache_stats():
+    """Hit ratio, resident bytes and evictions of this worker's resized-image cache."""
+    return jsonify(resized_cache.stats())
+
+
 if __name__ == '__main__':
     app.run(debug=True)
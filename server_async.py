@@ -0,0 +1,513 @@
+"""
+ASGI variant of the API server for high-concurrency status and image
+traffic. It serves the same routes and JSON as server.py for uploads, the
+resized-image feed and files, and job status, but on one event loop:
+Postgres goes through an asyncpg pool, and the blocking MinIO client runs
+on a bounded thread pool, so a slow object store ties up a thread rather
+than the loop. Run it next to the Flask app with:
+
+    uvicorn server_async:app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import mimetypes
+import time
+import uuid
+
+from minio.error import S3Error
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_date, parse_etags, parse_if_range_header, parse_options_header, parse_range_header
+
+import db_async
+import metrics
+import resize_engines
+import server
+from db_async import create_job, get_job, get_jobs, list_completed_jobs, update_job_status
+from renditions import resolve_renditions
+from server import (
+    DOWNLOAD_CHUNK_SIZE,
+    LISTING_CACHE_MAX_ENTRIES,
+    LISTING_CACHE_TTL,
+    LISTING_DEFAULT_LIMIT,
+    LISTING_MAX_LIMIT,
+    MINIO_POOL_SIZE,
+    RESIZED_BUCKET,
+    RESIZED_CACHE_MAX_AGE,
+    RESIZED_REDIRECT,
+    UPLOAD_BUCKET,
+    UPLOAD_PART_SIZE,
+    decode_cursor,
+    encode_cursor,
+    external_url,
+    feed_key,
+    form_renditions,
+    job_lookup,
+    job_lookup_params,
+    job_lookup_payload,
+    job_tags,
+    lane_metadata,
+    minio_client,
+    payload_etag,
+    rendition_summary,
+    requested_rendition,
+)
+from upload_stream import HashingReader, MultipartUpload
+
+
+MAX_UPLOAD_BYTES = server.MAX_UPLOAD_BYTES
+# Threads for blocking MinIO calls; matches the client's connection pool.
+_minio_executor = ThreadPoolExecutor(max_workers=MINIO_POOL_SIZE, thread_name_prefix='minio')
+
+_listing_cache: dict[tuple, tuple[float, dict]] = {}
+
+# Registered under a name of its own so one process may import both servers.
+ASYNC_REQUEST_SECONDS = metrics.Histogram(
+    'http_async_request_duration_seconds', 'ASGI API request latency by route.', ['method', 'route', 'status'])
+
+
+class FlaskJSONResponse(JSONResponse):
+    """Serialise exactly like Flask's jsonify (sorted keys, HTTP dates, UUIDs)."""
+
+    def render(self, content) -> bytes:
+        return (server.app.json.dumps(content, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def error(message, status_code):
+    return FlaskJSONResponse({'error': message}, status_code=status_code)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking MinIO call on the MinIO thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_minio_executor, lambda: func(*args, **kwargs))
+
+
+class BodyReader:
+    """
+    Blocking, file-like view of an ASGI request body for code running on a
+    worker thread: each read() asks the event loop for the next chunk, so the
+    synchronous multipart parser and put_object stream the body as it
+    arrives. Raises RequestEntityTooLarge past `limit` bytes.
+    """
+
+    def __init__(self, chunks, loop, limit=None):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._limit = limit
+        self._buffer = bytearray()
+        self._received = 0
+        self._done = False
+
+    async def _next_chunk(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            chunk = asyncio.run_coroutine_threadsafe(self._next_chunk(), self._loop).result()
+            if not chunk:
+                self._done = chunk is None
+                continue
+            self._received += len(chunk)
+            if self._limit is not None and self._received > self._limit:
+                raise RequestEntityTooLarge()
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def store_upload(stream, boundary, headers, create, fail):
+    """
+    Parse the multipart body and stream its 'image' part to MinIO, as
+    server.upload_image does: the job row is inserted with `create(**job)`
+    first, and `fail(job_id, message)` marks it if the upload breaks off.
+    Returns ((message, status), None) for a bad request, else (None,
+    details of the stored upload).
+    """
+    upload = MultipartUpload(stream, boundary)
+    part = upload.next_file('image')
+    if part is None:
+        return ('No image part', 400), None
+    if part.filename == '':
+        return ('No selected file', 400), None
+    try:
+        renditions = form_renditions(upload.form)
+        priority, tenant = job_tags(headers, upload.form.get('priority'), 'interactive')
+    except ValueError as e:
+        return (str(e), 400), None
+    job_id = str(uuid.uuid4())
+    object_name = f"{job_id}_{part.filename}"
+    create(
+        filename=object_name,
+        original_filename=part.filename,
+        job_id=job_id,
+        renditions=renditions,
+        priority=priority,
+        tenant=tenant,
+    )
+    body = HashingReader(upload)
+    try:
+        minio_client.put_object(
+            UPLOAD_BUCKET,
+            object_name,
+            body,
+            length=-1,
+            part_size=UPLOAD_PART_SIZE,
+            content_type=part.content_type,
+            metadata=lane_metadata(priority, tenant),
+        )
+    except Exception as e:
+        fail(job_id, str(e) or type(e).__name__)
+        raise
+    upload.drain()
+    return None, {
+        'job_id': job_id,
+        'object_name': object_name,
+        'original_filename': part.filename,
+        'renditions': renditions,
+        'priority': priority,
+        'tenant': tenant,
+        'size': body.size,
+        'sha256': body.hexdigest(),
+    }
+
+
+async def upload_image(request):
+    mimetype, params = parse_options_header(request.headers.get('content-type', ''))
+    boundary = params.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        return error('No image part', 400)
+    too_large = f'Upload exceeds the {MAX_UPLOAD_BYTES} byte limit'
+    try:
+        if int(request.headers.get('content-length', 0)) > MAX_UPLOAD_BYTES:
+            return error(too_large, 413)
+    except ValueError:
+        return error('Invalid Content-Length', 400)
+
+    loop = asyncio.get_running_loop()
+    stream = BodyReader(request.stream(), loop, MAX_UPLOAD_BYTES)
+
+    # The upload runs on a MinIO thread; its database writes go back to the loop.
+    def create(**job):
+        asyncio.run_coroutine_threadsafe(create_job(**job), loop).result()
+
+    def fail(job_id, message):
+        asyncio.run_coroutine_threadsafe(update_job_status(job_id, 'error', error_message=message), loop).result()
+
+    try:
+        failure, upload = await run_blocking(
+            store_upload, stream, boundary.encode('latin-1'), request.headers, create, fail)
+    except RequestEntityTooLarge:
+        return error(too_large, 413)
+    if failure is not None:
+        return error(*failure)
+    return FlaskJSONResponse(
+        {
+            'message': 'Image received, job submitted for processing.',
+            'job_id': upload['job_id'],
+            'status': 'pending',
+            'priority': upload['priority'],
+            'object_name': upload['object_name'],
+            'renditions': rendition_summary(upload['object_name'], upload['renditions']),
+            'size': upload['size'],
+            'sha256': upload['sha256'],
+        },
+        status_code=202,
+    )
+
+
+async def presigned_upload(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'filename' not in data:
+        return error('Missing filename', 400)
+    original_filename = data['filename']
+    content_type = data.get('content_type', 'application/octet-stream')
+    try:
+        renditions = resolve_renditions(data.get('profile'), data.get('renditions'))
+        priority, tenant = job_tags(request.headers, data.get('priority'), 'interactive')
+    except ValueError as e:
+        return error(str(e), 400)
+
+    try:
+        job_id = str(uuid.uuid4())
+        object_name = f"{job_id}_{original_filename}"
+        # Signing is local once the bucket region is known, but the first
+        # call may ask MinIO for it.
+        url = await run_blocking(
+            minio_client.presigned_put_object, UPLOAD_BUCKET, object_name, expires=timedelta(minutes=10))
+        new_url = external_url(url)
+    except Exception as e:
+        return error(str(e), 500)
+
+    await create_job(
+        filename=object_name,
+        original_filename=original_filename,
+        job_id=job_id,
+        renditions=renditions,
+        priority=priority,
+        tenant=tenant,
+    )
+    return FlaskJSONResponse(
+        {
+            'url': new_url,
+            'method': 'PUT',
+            'headers': {'Content-Type': content_type},
+            'job_id': job_id,
+            'status': 'pending',
+            'priority': priority,
+            'object_name': object_name,
+            'renditions': rendition_summary(object_name, renditions),
+        }
+    )
+
+
+def not_modified(headers, etag, last_modified):
+    """Whether the request's validators match the current object."""
+    if_none_match = parse_etags(headers.get('if-none-match'))
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    if_modified_since = parse_date(headers.get('if-modified-since'))
+    if if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def requested_range(headers, etag, size):
+    """Same contract as server.requested_range, from raw request headers."""
+    byte_range = parse_range_header(headers.get('range'))
+    if byte_range is None:
+        return None
+    if_range = parse_if_range_header(headers.get('if-range'))
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None:
+        return None
+    span = byte_range.range_for_length(size)
+    return span if span is not None else False
+
+
+async def stream_object(data):
+    chunks = data.stream(DOWNLOAD_CHUNK_SIZE)
+    try:
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        data.close()
+        data.release_conn()
+
+
+async def resized_file(request):
+    source = request.path_params['filename']
+    try:
+        filename, rendition = requested_rendition(source, request.query_params)
+    except ValueError as e:
+        return error(str(e), 400)
+    # The cache is shared with server.py's routes in the same process.
+    resized_cache = server.resized_cache
+    entry = None if RESIZED_REDIRECT else resized_cache.get(filename)
+    if entry is None:
+        try:
+            stat = await run_blocking(minio_client.stat_object, RESIZED_BUCKET, filename)
+        except S3Error:
+            if rendition is None:
+                return error('Image not found', 404)
+            try:
+                entry = await run_blocking(server.render_on_demand, source, rendition, filename)
+            except S3Error:
+                return error('Image not found', 404)
+            except (resize_engines.ImageTooLarge, Image.DecompressionBombError) as e:
+                return error(str(e), 413)
+            except OSError:
+                return error('Image cannot be resized', 422)
+    if entry is not None:
+        etag, last_modified, size, content_type = entry.etag, entry.last_modified, entry.size, entry.content_type
+    else:
+        if RESIZED_REDIRECT:
+            url = await run_blocking(
+                minio_client.presigned_get_object, RESIZED_BUCKET, filename, expires=timedelta(minutes=10))
+            return RedirectResponse(external_url(url), status_code=302)
+
+        etag, last_modified, size = stat.etag, stat.last_modified, stat.size
+        content_type = stat.content_type
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={RESIZED_CACHE_MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = requested_range(request.headers, etag, size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        status, offset, length = 200, 0, size
+    else:
+        start, stop = byte_range
+        status, offset, length = 206, start, stop - start
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(length)
+
+    if entry is not None:
+        data = entry.data
+    elif resized_cache.cacheable(size):
+        try:
+            data = await run_blocking(server.fetch_object, filename, size)
+        except S3Error:
+            return error('Image not found', 404)
+        resized_cache.put(filename, data, etag, content_type, last_modified)
+    else:
+        try:
+            data = await run_blocking(minio_client.get_object, RESIZED_BUCKET, filename, offset=offset, length=length)
+        except S3Error:
+            return error('Image not found', 404)
+        return StreamingResponse(stream_object(data), status_code=status, headers=headers, media_type=content_type)
+    return Response(data[offset:offset + length], status_code=status, headers=headers, media_type=content_type)
+
+
+async def cached_listing(key, build):
+    """Serve `await build()` from a short-TTL cache keyed on `key`."""
+    now = time.monotonic()
+    hit = _listing_cache.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    payload = await build()
+    if len(_listing_cache) >= LISTING_CACHE_MAX_ENTRIES:
+        expired = [k for k, (expires, _) in _listing_cache.items() if expires <= now]
+        for stale in expired or list(_listing_cache):
+            del _listing_cache[stale]
+    _listing_cache[key] = (now + LISTING_CACHE_TTL, payload)
+    return payload
+
+
+async def list_resized_images(request):
+    """Keyset-paginated feed of completed jobs; see server.list_resized_images."""
+    args = request.query_params
+    try:
+        limit = min(max(int(args.get('limit', LISTING_DEFAULT_LIMIT)), 1), LISTING_MAX_LIMIT)
+        cursor = args.get('cursor')
+        since = args.get('since')
+        cursor_key = decode_cursor(cursor) if cursor else None
+        since_time = datetime.fromisoformat(since.replace(' ', '+')) if since else None
+    except ValueError:
+        return error('Invalid limit, cursor or since', 400)
+
+    async def build():
+        jobs = await list_completed_jobs(limit, cursor=cursor_key, since=since_time)
+        last = jobs[-1] if len(jobs) == limit else None
+        latest = jobs[0]['updated_at'] if jobs else since_time
+        return {
+            'images': [feed_key(job) for job in jobs],
+            'next_cursor': encode_cursor(last['updated_at'], last['id']) if last else None,
+            'latest': latest.isoformat() if latest else None,
+        }
+
+    return FlaskJSONResponse(await cached_listing((limit, cursor, since), build))
+
+
+async def job_statuses(request):
+    """Status of many jobs in one query; see server.job_statuses."""
+    try:
+        body = None
+        if request.method == 'POST' and await request.body():
+            try:
+                body = await request.json()
+            except ValueError:
+                raise ValueError('Body must be a JSON object') from None
+        query, requested = job_lookup(job_lookup_params(request.query_params, body))
+    except ValueError as e:
+        return error(str(e) or 'Invalid job lookup', 400)
+    rows = await get_jobs(**query) if requested is None or query['job_ids'] else []
+    payload = job_lookup_payload(rows, requested, query.get('limit'))
+    etag = payload_etag(payload)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if not_modified(request.headers, etag, None):
+        return Response(status_code=304, headers=headers)
+    return FlaskJSONResponse(payload, headers=headers)
+
+
+async def job_status(request):
+    """Return the current status and metadata for an image job."""
+    job = await get_job(request.path_params['job_id'])
+    if not job:
+        return error('Job not found', 404)
+    return FlaskJSONResponse(job)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.REGISTRY.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Buckets and schema were set up when server.py was imported.
+    if not server.SKIP_EXTERNAL_INIT:
+        await db_async.open_pool()
+    try:
+        yield
+    finally:
+        await db_async.close_pool()
+
+
+class RequestTimer:
+    """ASGI middleware feeding ASYNC_REQUEST_SECONDS, like server.py's hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {}
+
+        async def send_and_time(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                route = scope.get('route')
+                ASYNC_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started,
+                    method=scope['method'],
+                    route=route.path if route is not None else 'unmatched',
+                    status=message['status'],
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_and_time)
+
+
+routes = [
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/api/upload', upload_image, methods=['POST']),
+    Route('/api/presigned-upload', presigned_upload, methods=['POST']),
+    Route('/api/resized', list_resized_images, methods=['GET']),
+    Route('/api/resized/{filename:path}', resized_file, methods=['GET']),
+    Route('/api/jobs', job_statuses, methods=['GET', 'POST']),
+    Route('/api/jobs/{job_id}', job_status, methods=['GET']),
+]
+
+app = RequestTimer(Starlette(routes=routes, lifespan=lifespan))
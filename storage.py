@@ -0,0 +1,118 @@
+"""
+MinIO client construction shared by the API server and the image-processor.
+
+Each process builds its client once with create_client(), sized to how
+many threads talk to MinIO at the same time, so connections are kept alive
+and reused instead of being re-established or queued. Bucket existence is
+memoized per client: ensure_bucket() costs a round-trip the first time a
+bucket is seen and nothing afterwards.
+
+minio (with urllib3) is the slowest import of the image-processor, so it
+is only imported when a client is first built; LazyClient defers that
+until the client is first used.
+"""
+import os
+import threading
+import weakref
+
+
+MINIO_ENDPOINT = os.environ.get('MINIO_ENDPOINT', 'minio:9000')
+MINIO_ACCESS_KEY = os.environ.get('MINIO_ROOT_USER', 'minioadmin')
+MINIO_SECRET_KEY = os.environ.get('MINIO_ROOT_PASSWORD', 'minioadmin')
+MINIO_SECURE = os.environ.get('MINIO_SECURE') == '1'
+# Connect timeout is short so an unreachable MinIO fails fast; the read
+# timeout bounds a stalled transfer, not a whole large one.
+MINIO_CONNECT_TIMEOUT = float(os.environ.get('MINIO_CONNECT_TIMEOUT', 3))
+MINIO_READ_TIMEOUT = float(os.environ.get('MINIO_READ_TIMEOUT', 60))
+MINIO_RETRIES = int(os.environ.get('MINIO_RETRIES', 3))
+
+_known_buckets: 'weakref.WeakKeyDictionary[Minio, set[str]]' = weakref.WeakKeyDictionary()
+_known_buckets_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # storage.S3Error, imported on first use.
+    if name == 'S3Error':
+        from minio.error import S3Error
+        return S3Error
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def create_http_client(pool_size: int) -> 'urllib3.PoolManager':
+    """
+    Keep-alive connection pool with up to `pool_size` connections to MinIO.
+    Extra concurrent requests still go through on a throwaway connection
+    rather than blocking.
+    """
+    import urllib3
+
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=max(1, pool_size),
+        block=False,
+        timeout=urllib3.Timeout(connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT),
+        retries=urllib3.Retry(
+            total=MINIO_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
+
+
+def create_client(pool_size: int) -> 'Minio':
+    """Minio client for MINIO_ENDPOINT over a pool of `pool_size` connections."""
+    from minio import Minio
+
+    return Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        secure=MINIO_SECURE,
+        http_client=create_http_client(pool_size),
+    )
+
+
+class LazyClient:
+    """
+    Stands in for create_client(pool_size), building it on first attribute
+    access, so a process can start (and start consuming) before minio has
+    been imported.
+    """
+
+    def __init__(self, pool_size: int):
+        self._pool_size = pool_size
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = create_client(self._pool_size)
+                client = self._client
+        return getattr(client, name)
+
+
+def ensure_bucket(client, bucket: str):
+    """Create `bucket` unless this client has already seen it exist."""
+    from minio.error import S3Error
+
+    with _known_buckets_lock:
+        if bucket in _known_buckets.get(client, ()):
+            return
+    if not client.bucket_exists(bucket):
+        try:
+            client.make_bucket(bucket)
+        except S3Error as e:
+            # Another process created it between the two calls.
+            if e.code not in ('BucketAlreadyOwnedByYou', 'BucketAlreadyExists'):
+                raise
+    with _known_buckets_lock:
+        _known_buckets.setdefault(client, set()).add(bucket)
+
+
+def forget_bucket(client, bucket: str):
+    """Drop a memoized bucket, e.g. after MinIO reported NoSuchBucket."""
+    with _known_buckets_lock:
+        _known_buckets.get(client, set()).discard(bucket)
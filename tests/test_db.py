@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+from psycopg2 import extensions
+
+import db
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.connection.broken:
+            raise db.psycopg2.OperationalError("server closed the connection")
+        self.connection.executed.append((sql, params))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.executed = []
+        self.prepared = set()
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        created.append(FakeConnection())
+        return created[-1]
+
+    options = {"minconn": 0, "maxconn": 2, "timeout": 0.05, "healthcheck_seconds": 30}
+    options.update(kwargs)
+    return db.ConnectionPool("postgresql://test", connect=connect, **options), created
+
+
+def test_pool_reuses_returned_connections():
+    pool, created = make_pool()
+    for _ in range(3):
+        conn = pool.getconn()
+        pool.putconn(conn)
+    assert len(created) == 1
+
+
+def test_pool_replaces_closed_and_unhealthy_connections():
+    pool, created = make_pool(healthcheck_seconds=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    # The server went away while the connection sat idle.
+    conn.broken = True
+
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert conn.closed
+    assert len(created) == 2
+    pool.putconn(fresh)
+
+
+def test_pool_times_out_when_exhausted():
+    pool, _created = make_pool(maxconn=1)
+    conn = pool.getconn()
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_execute_prepared_prepares_once_per_connection(monkeypatch):
+    monkeypatch.setattr(db, "DB_PREPARED_STATEMENTS", True)
+    conn = FakeConnection()
+    cur = conn.cursor()
+    sql = "UPDATE image_jobs SET status = %s WHERE id = %s;"
+    db.execute_prepared(cur, "set_status", sql, "text, uuid", ("done", "id-1"))
+    db.execute_prepared(cur, "set_status", sql, "text, uuid", ("done", "id-2"))
+
+    assert conn.executed == [
+        ("PREPARE set_status (text, uuid) AS UPDATE image_jobs SET status = $1 WHERE id = $2", None),
+        ("EXECUTE set_status (%s, %s)", ("done", "id-1")),
+        ("EXECUTE set_status (%s, %s)", ("done", "id-2")),
+    ]
+
+
+def test_batched_status_updates_take_updated_at_from_the_database(monkeypatch):
+    from contextlib import contextmanager
+
+    calls = []
+
+    @contextmanager
+    def connection():
+        yield FakeConnection()
+
+    monkeypatch.setattr(db, "connection", connection)
+    monkeypatch.setattr(db, "execute_values", lambda cur, sql, args, **kw: calls.append((sql, args, kw)))
+    updates = [("11111111-1111-1111-1111-111111111111", "completed", None, True)]
+    db.update_job_statuses(updates)
+
+    [(sql, args, kw)] = calls
+    assert "updated_at = NOW()" in sql
+    assert args == updates
+    assert kw["template"].count("%s") == 4
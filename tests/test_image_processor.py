@@ -1,7 +1,33 @@
+import io
 import json
+import os
+import threading
 from types import SimpleNamespace
+from urllib.parse import quote
+
+import psycopg2
+import pytest
+from minio.error import S3Error
+from PIL import Image
 
 import image_processor
+import resize_engines
+
+
+@pytest.fixture(autouse=True)
+def in_memory_rendition_cache(monkeypatch):
+    """Keep the dedup cache off the real database."""
+    cache = {}
+    monkeypatch.setattr(image_processor, "find_cached_renditions", lambda keys: {k: cache[k] for k in keys if k in cache})
+    monkeypatch.setattr(
+        image_processor,
+        "record_cached_renditions",
+        lambda entries: cache.update({k: obj for k, obj, _size in entries}),
+    )
+    monkeypatch.setattr(
+        image_processor, "forget_cached_renditions", lambda keys: [cache.pop(k, None) for k in keys])
+    monkeypatch.setattr(image_processor, "record_cache_hits", lambda keys: None)
+    return cache
 
 
 def test_extract_job_id_from_key_basic():
@@ -53,3 +79,770 @@ def test_process_job_decodes_url_and_updates_status(monkeypatch, tmp_path):
     # Simulate the decoding logic
     from urllib.parse import unquote_plus
     assert unquote_plus(encoded_key) == decoded_key
+
+
+class _FakeResponse(io.BytesIO):
+    def stream(self, amt):
+        while chunk := self.read(amt):
+            yield chunk
+
+    def release_conn(self):
+        pass
+
+
+def _png_bytes(size=(64, 48)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "red").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_process_job_streaming_avoids_local_files(monkeypatch, tmp_path):
+    job_id = "52c35d1a-da6c-4bc6-b257-665a9664ad64"
+    key = f"{job_id}_photo one.png"
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": quote(key)}}}]}
+    ).encode("utf-8")
+
+    uploaded = {}
+
+    def fake_put_object(bucket, name, data, length, content_type):
+        uploaded.update(bucket=bucket, name=name, data=data.read(length), content_type=content_type)
+
+    monkeypatch.setattr(image_processor, "STREAMING_MODE", True)
+    monkeypatch.setattr(image_processor, "UPLOADS_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(image_processor, "RESIZED_DIR", str(tmp_path / "resized"))
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(_png_bytes()))
+    monkeypatch.setattr(image_processor.minio_client, "put_object", fake_put_object)
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda job_id: None)
+    statuses = []
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda j, s, **kw: statuses.append((j, s)))
+
+    ch = SimpleNamespace(acked=[], basic_ack=lambda delivery_tag: ch.acked.append(delivery_tag))
+    image_processor.process_job(ch, SimpleNamespace(delivery_tag=7), None, body)
+
+    assert ch.acked == [7]
+    assert statuses == [(job_id, "in_progress"), (job_id, "completed")]
+    assert uploaded["bucket"] == image_processor.BUCKET_NAME
+    assert uploaded["name"] == key
+    assert uploaded["content_type"] == "image/png"
+    with Image.open(io.BytesIO(uploaded["data"])) as img:
+        assert img.size == (256, 256)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spooled_buffer_spills_past_threshold(monkeypatch):
+    monkeypatch.setattr(image_processor, "SPOOL_MAX_BYTES", 16)
+    with image_processor.spooled_buffer() as buf:
+        buf.write(b"x" * 8)
+        assert not buf._rolled
+        buf.write(b"x" * 16)
+        assert buf._rolled
+
+
+def test_job_executor_acks_through_connection_thread(monkeypatch):
+    handled = []
+    monkeypatch.setattr(image_processor, "handle_event", lambda body, attempt: handled.append(body) or ("completed", None))
+
+    scheduled = []
+    connection = SimpleNamespace(add_callback_threadsafe=scheduled.append)
+    ch = SimpleNamespace(acked=[], basic_ack=lambda delivery_tag: ch.acked.append(delivery_tag))
+
+    executor = image_processor.JobExecutor(connection, io_threads=2)
+    executor.on_message(ch, SimpleNamespace(delivery_tag=1), None, b"one")
+    executor.on_message(ch, SimpleNamespace(delivery_tag=2), None, b"two")
+    executor.shutdown()
+
+    assert sorted(handled) == [b"one", b"two"]
+    # Nothing is acked from the worker threads themselves...
+    assert ch.acked == []
+    # ...only once the connection thread runs the scheduled callbacks.
+    for callback in scheduled:
+        callback()
+    assert sorted(ch.acked) == [1, 2]
+
+
+def test_render_source_uses_cpu_pool(monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+
+    renditions = image_processor.resolve_renditions("default")
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        monkeypatch.setattr(image_processor, "cpu_pool", pool)
+        [(data, fmt)] = image_processor.render_source(io.BytesIO(_png_bytes()), renditions)
+    assert fmt == "PNG"
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (256, 256)
+
+
+@pytest.mark.parametrize("mode", sorted(image_processor.RESIZE_MODES))
+def test_resize_image_modes_produce_target_size(mode, monkeypatch):
+    from PIL import JpegImagePlugin
+
+    drafts = []
+    original_draft = JpegImagePlugin.JpegImageFile.draft
+
+    def spy_draft(self, *args):
+        drafts.append(args)
+        return original_draft(self, *args)
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", spy_draft)
+
+    source = io.BytesIO()
+    Image.new("RGB", (2048, 1536), "blue").save(source, format="JPEG")
+    source.seek(0)
+    output = io.BytesIO()
+
+    assert image_processor.resize_image(source, output, (128, 128), mode=mode) == "JPEG"
+    with Image.open(output) as img:
+        assert img.size == (128, 128)
+    # Only the speed-oriented modes ask libjpeg for a reduced-scale decode.
+    assert bool(drafts) == (image_processor.RESIZE_MODES[mode]["reducing_gap"] is not None)
+
+
+def test_render_renditions_decodes_once_and_reuses_intermediates(monkeypatch):
+    renditions = [
+        {"name": "thumb", "width": 100, "height": 100, "fit": "cover", "format": "WEBP", "quality": 80},
+        {"name": "medium", "width": 800, "height": 800, "fit": "contain"},
+        {"name": "default", "width": 256, "height": 256, "fit": "stretch"},
+    ]
+    resized_from = []
+    original_resize = Image.Image.resize
+
+    def spy_resize(self, size, *args, **kwargs):
+        resized_from.append((self.size, size))
+        return original_resize(self, size, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "resize", spy_resize)
+    opened = []
+    original_open = Image.open
+    monkeypatch.setattr(image_processor.Image, "open", lambda fp: opened.append(fp) or original_open(fp))
+
+    source = io.BytesIO(_png_bytes((1600, 1200)))
+    outputs = image_processor.render_renditions(source, renditions, mode="quality")
+
+    assert len(opened) == 1
+    # Largest first from the source, then each smaller one from the 800x600 intermediate.
+    assert resized_from == [((1600, 1200), (800, 600)), ((800, 600), (256, 256)), ((800, 600), (133, 100))]
+    sizes = []
+    for data, fmt in outputs:
+        with Image.open(io.BytesIO(data)) as img:
+            sizes.append((img.format, img.size))
+    assert sizes == [("WEBP", (100, 100)), ("PNG", (800, 600)), ("PNG", (256, 256))]
+
+
+def test_process_job_uploads_every_rendition(monkeypatch):
+    job_id = "52c35d1a-da6c-4bc6-b257-665a9664ad64"
+    key = f"{job_id}_photo.png"
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": key}}}]}
+    ).encode("utf-8")
+    renditions = image_processor.resolve_renditions("web")
+
+    uploaded = {}
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(_png_bytes()))
+    monkeypatch.setattr(
+        image_processor.minio_client,
+        "put_object",
+        lambda bucket, name, data, length, content_type: uploaded.update({name: content_type}),
+    )
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda j: {"id": j, "renditions": renditions})
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda *a, **kw: None)
+
+    ch = SimpleNamespace(basic_ack=lambda delivery_tag: None)
+    image_processor.process_job(ch, SimpleNamespace(delivery_tag=1), None, body)
+
+    assert uploaded == {
+        key: "image/png",
+        f"thumb/{job_id}_photo.webp": "image/webp",
+        f"medium/{job_id}_photo.jpg": "image/jpeg",
+        f"webp/{job_id}_photo.webp": "image/webp",
+    }
+
+
+def test_identical_upload_is_served_from_dedup_cache(monkeypatch, in_memory_rendition_cache):
+    source = _png_bytes()
+    uploaded, copied, statuses = {}, [], []
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(source))
+    monkeypatch.setattr(
+        image_processor.minio_client,
+        "put_object",
+        lambda bucket, name, data, length, content_type: uploaded.update({name: data.read()}),
+    )
+    monkeypatch.setattr(
+        image_processor.minio_client,
+        "copy_object",
+        lambda bucket, name, src: copied.append((src.object_name, name)),
+    )
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda job_id: None)
+    monkeypatch.setattr(
+        image_processor, "safe_update_job_status", lambda j, s, **kw: statuses.append((s, kw.get("cache_hit")))
+    )
+    ch = SimpleNamespace(basic_ack=lambda delivery_tag: None)
+
+    first = "11111111-1111-1111-1111-111111111111_a.png"
+    second = "22222222-2222-2222-2222-222222222222_b.png"
+    for tag, key in enumerate([first, second]):
+        body = json.dumps({"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": key}}}]}).encode()
+        image_processor.process_job(ch, SimpleNamespace(delivery_tag=tag), None, body)
+
+    assert list(uploaded) == [first]
+    assert copied == [(first, second)]
+    assert statuses == [("in_progress", None), ("completed", False), ("in_progress", None), ("completed", True)]
+    assert list(in_memory_rendition_cache.values()) == [first]
+
+
+def test_stale_dedup_entry_is_rerendered_and_refreshed(monkeypatch, in_memory_rendition_cache):
+    renditions = [{"name": "thumb", "width": 64, "height": 64, "fit": "contain"}]
+    [cache_key] = [image_processor.rendition_cache_key("abc", r) for r in renditions]
+    in_memory_rendition_cache[cache_key] = "thumb/gone.png"
+    forgotten, stored = [], []
+
+    def forget(keys):
+        forgotten.extend(keys)
+        in_memory_rendition_cache.clear()
+
+    def copy_object(bucket, name, src):
+        raise S3Error(None, "NoSuchKey", "missing", src.object_name, "req", "host")
+
+    monkeypatch.setattr(image_processor, "forget_cached_renditions", forget)
+    monkeypatch.setattr(image_processor.minio_client, "copy_object", copy_object)
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+
+    decoded = image_processor.publish_renditions(
+        "new.png", renditions, "abc",
+        lambda todo: [(b"png", "PNG") for _ in todo],
+        lambda key, data, fmt: stored.append(key),
+    )
+    assert decoded is False
+    assert forgotten == [cache_key]
+    assert stored == [image_processor.rendition_key("new.png", renditions[0])]
+    assert in_memory_rendition_cache == {cache_key: stored[0]}
+
+
+def test_dead_render_process_is_retried_on_a_new_pool(monkeypatch):
+    import signal
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    rendition = {"name": "thumb", "width": 16, "height": 16, "fit": "contain"}
+    pool = ProcessPoolExecutor(max_workers=1)
+    monkeypatch.setattr(image_processor, "CPU_WORKERS", 1)
+    monkeypatch.setattr(image_processor, "cpu_pool", pool)
+    try:
+        image_processor.render_source(io.BytesIO(_png_bytes()), [rendition])
+        # As if the kernel's OOM killer picked the render child.
+        for process in list(pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        with pytest.raises(BrokenProcessPool) as failure:
+            image_processor.render_source(io.BytesIO(_png_bytes()), [rendition])
+        assert image_processor.is_retryable(failure.value)
+        assert image_processor.cpu_pool is not pool
+
+        [(data, fmt)] = image_processor.render_source(io.BytesIO(_png_bytes()), [rendition])
+        assert fmt == "PNG" and Image.open(io.BytesIO(data)).size == (16, 12)
+    finally:
+        image_processor.cpu_pool.shutdown()
+
+
+JOB_A = "11111111-1111-1111-1111-111111111111"
+JOB_B = "22222222-2222-2222-2222-222222222222"
+
+
+def test_status_writer_collapses_transitions_per_job():
+    batches = []
+    writer = image_processor.StatusWriter(write=batches.append, batch_size=100, interval=60)
+    writer.submit(JOB_A, "in_progress")
+    writer.submit(JOB_B, "in_progress")
+    writer.submit(JOB_A, "completed", cache_hit=True)
+    writer.submit("not-a-uuid", "completed")
+    writer.close()
+
+    assert len(batches) == 1
+    assert [(u[0], u[1], u[3]) for u in batches[0]] == [(JOB_A, "completed", True), (JOB_B, "in_progress", None)]
+
+
+def test_status_writer_flushes_on_batch_size():
+    flushed = threading.Event()
+    batches = []
+
+    def write(updates):
+        batches.append(updates)
+        flushed.set()
+
+    writer = image_processor.StatusWriter(write=write, batch_size=2, interval=60)
+    writer.submit(JOB_A, "in_progress")
+    writer.submit(JOB_B, "in_progress")
+    assert flushed.wait(5)
+    writer.close()
+    assert [u[0] for u in batches[0]] == [JOB_A, JOB_B]
+
+
+def test_status_writer_retries_without_overriding_newer_transitions():
+    attempts = []
+
+    def flaky_write(updates):
+        attempts.append([(u[0], u[1]) for u in updates])
+        if len(attempts) == 1:
+            raise psycopg2.OperationalError("database is restarting")
+
+    writer = image_processor.StatusWriter(write=flaky_write, batch_size=100, interval=60)
+    writer.submit(JOB_A, "in_progress")
+    writer.submit(JOB_B, "in_progress")
+    writer.flush()
+    # JOB_A moved on while the first flush was failing.
+    writer.submit(JOB_A, "completed")
+    writer.close()
+
+    assert attempts == [
+        [(JOB_A, "in_progress"), (JOB_B, "in_progress")],
+        [(JOB_A, "completed"), (JOB_B, "in_progress")],
+    ]
+
+
+def test_safe_update_job_status_goes_through_writer(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        image_processor, "status_writer", SimpleNamespace(submit=lambda *a, **kw: submitted.append((a, kw)))
+    )
+    monkeypatch.setattr(image_processor, "update_job_status", lambda *a, **kw: pytest.fail("must not write directly"))
+    image_processor.safe_update_job_status(JOB_A, "error", error_message="boom")
+    assert submitted == [((JOB_A, "error"), {"error_message": "boom", "cache_hit": None})]
+
+
+def test_handle_event_records_stage_metrics_and_outcomes(monkeypatch):
+    source = _png_bytes()
+    body = json.dumps({"Records": [{
+        "eventTime": "2025-01-01T00:00:00.000Z",
+        "s3": {"bucket": {"name": "uploads"}, "object": {"key": f"{JOB_A}_photo.png"}},
+    }]}).encode("utf-8")
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(source))
+    monkeypatch.setattr(image_processor.minio_client, "put_object", lambda *a, **kw: None)
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda j: None)
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda *a, **kw: None)
+
+    stages = ("download", "decode", "resize", "encode", "upload", "ensure_bucket")
+    before = {stage: image_processor.STAGE_SECONDS.count(stage=stage) for stage in stages}
+    completed = image_processor.JOBS_TOTAL.value(outcome="completed")
+    errors = image_processor.JOBS_TOTAL.value(outcome="error")
+    bytes_in = image_processor.BYTES_IN.value()
+    lag = image_processor.QUEUE_LAG_SECONDS.count()
+
+    image_processor.handle_event(body)
+    image_processor.handle_event(b"not json")
+
+    assert all(image_processor.STAGE_SECONDS.count(stage=s) == before[s] + 1 for s in stages)
+    assert image_processor.JOBS_TOTAL.value(outcome="completed") == completed + 1
+    assert image_processor.JOBS_TOTAL.value(outcome="error") == errors + 1
+    assert image_processor.BYTES_IN.value() == bytes_in + len(source)
+    assert image_processor.QUEUE_LAG_SECONDS.count() == lag + 1
+    assert image_processor.JOBS_IN_PROGRESS.value() == 0
+
+
+def test_job_is_retried_while_the_schema_does_not_exist(monkeypatch):
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": f"{JOB_A}_early.png"}}}]}
+    ).encode()
+
+    def get_job(job_id):
+        raise psycopg2.errors.UndefinedTable('relation "image_jobs" does not exist')
+
+    monkeypatch.setattr(image_processor, "get_job", get_job)
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda *a, **kw: None)
+    monkeypatch.setattr(
+        image_processor, "process_object_streaming", lambda *a: pytest.fail("must not render default renditions"))
+
+    outcome, error = image_processor.handle_event(body)
+    assert outcome == "retry"
+    assert "image_jobs" in error
+
+
+class _RecordingChannel:
+    def __init__(self, queued=()):
+        self.log = []
+        self.priorities = []
+        self.queued = list(queued)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.log.append(("publish", routing_key, body, properties.headers))
+        self.priorities.append(properties.priority)
+
+    def basic_ack(self, delivery_tag):
+        self.log.append(("ack", delivery_tag))
+
+    def basic_get(self, queue, auto_ack):
+        if not self.queued:
+            return None, None, None
+        tag, headers, body = self.queued.pop(0)
+        return SimpleNamespace(delivery_tag=tag), SimpleNamespace(headers=headers, content_type=None), body
+
+
+def _missing_object(*args, **kwargs):
+    raise S3Error(None, "NoSuchKey", "missing", "key", "req", "host")
+
+
+def test_missing_object_is_retried_with_delay_then_dead_lettered(monkeypatch):
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": f"{JOB_A}_late.png"}}}]}
+    ).encode("utf-8")
+    monkeypatch.setattr(image_processor, "RETRY_DELAYS", [2, 5])
+    monkeypatch.setattr(image_processor, "MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(image_processor.minio_client, "get_object", _missing_object)
+    monkeypatch.setattr(image_processor, "get_job", lambda j: None)
+    monkeypatch.setattr(image_processor.time, "sleep", lambda s: pytest.fail("the worker must not sleep"))
+    statuses = []
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda j, s, **kw: statuses.append(s))
+
+    ch = _RecordingChannel()
+    properties = None
+    for tag in (1, 2, 3):
+        image_processor.process_job(ch, SimpleNamespace(delivery_tag=tag), properties, body)
+        if ch.log[-2][0] == "publish":
+            properties = SimpleNamespace(headers=ch.log[-2][3], content_type=None)
+
+    published = [(entry[1], entry[3]["x-attempt"]) for entry in ch.log if entry[0] == "publish"]
+    assert published == [
+        ("minio_events_queue_retry_2s", 2),
+        ("minio_events_queue_retry_5s", 3),
+        ("minio_events_dlq", 3),
+    ]
+    # Each copy is published before the original is acked.
+    assert [entry[0] for entry in ch.log] == ["publish", "ack"] * 3
+    assert "NoSuchKey" in ch.log[-2][3]["x-last-error"]
+    assert statuses == ["in_progress", "retrying", "in_progress", "retrying", "in_progress", "error"]
+
+
+def test_undecodable_image_is_dead_lettered_immediately(monkeypatch):
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": f"{JOB_A}_bad.png"}}}]}
+    ).encode("utf-8")
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(b"not an image"))
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda j: None)
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda *a, **kw: None)
+
+    ch = _RecordingChannel()
+    image_processor.process_job(ch, SimpleNamespace(delivery_tag=9), None, body)
+    assert [entry[:2] for entry in ch.log] == [("publish", "minio_events_dlq"), ("ack", 9)]
+
+    ch = _RecordingChannel()
+    image_processor.process_job(ch, SimpleNamespace(delivery_tag=10), None, b"not json")
+    assert [entry[:2] for entry in ch.log] == [("publish", "minio_events_dlq"), ("ack", 10)]
+
+
+def _huge_png(width, height):
+    """A PNG whose header claims width x height pixels but holds almost no data."""
+    import struct
+    import zlib
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+
+def _huge_jpeg(width, height):
+    """A small JPEG with its frame header rewritten to claim width x height."""
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), "green").save(buf, format="JPEG")
+    data = bytearray(buf.getvalue())
+    sof = data.index(b"\xff\xc0")
+    data[sof + 5:sof + 9] = height.to_bytes(2, "big") + width.to_bytes(2, "big")
+    return bytes(data)
+
+
+def test_huge_header_image_is_rejected_without_decoding(monkeypatch):
+    body = json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": {"key": f"{JOB_A}_bomb.png"}}}]}
+    ).encode("utf-8")
+    monkeypatch.setattr(image_processor.minio_client, "get_object", lambda b, k: _FakeResponse(_huge_png(60000, 60000)))
+    monkeypatch.setattr(image_processor, "ensure_bucket", lambda: None)
+    monkeypatch.setattr(image_processor, "get_job", lambda j: None)
+    statuses = []
+    monkeypatch.setattr(image_processor, "safe_update_job_status", lambda j, s, **kw: statuses.append((s, kw)))
+    monkeypatch.setattr(image_processor.resize_engine, "render", lambda *a, **kw: pytest.fail("must not decode"))
+    rejected = image_processor.DECODES_REJECTED.value()
+
+    ch = _RecordingChannel()
+    image_processor.process_job(ch, SimpleNamespace(delivery_tag=3), None, body)
+
+    assert [entry[:2] for entry in ch.log] == [("publish", "minio_events_dlq"), ("ack", 3)]
+    assert statuses[-1][0] == "error"
+    assert "60000x60000" in statuses[-1][1]["error_message"]
+    assert image_processor.DECODES_REJECTED.value() == rejected + 1
+    assert image_processor.memory_budget.reserved == 0
+
+
+def test_pillow_pixel_limit_is_only_lifted_for_admitted_decodes():
+    bomb = _huge_png(60000, 60000)
+    assert Image.MAX_IMAGE_PIXELS is not None
+    with pytest.raises(Image.DecompressionBombError):
+        image_processor.resize_image(io.BytesIO(bomb), io.BytesIO())
+    with resize_engines.open_image(io.BytesIO(bomb), admitted=True) as img:
+        assert img.size == (60000, 60000)
+    assert Image.MAX_IMAGE_PIXELS is not None
+
+
+def test_oversized_jpeg_takes_the_reduced_decode_path(monkeypatch):
+    monkeypatch.setattr(resize_engines, "RESIZE_MODE", "quality")
+    renditions = image_processor.resolve_renditions("default")
+    rendered = []
+
+    # About 14 GB to decode at full size, but little enough at 1/8 scale.
+    def render(todo, reduced):
+        rendered.append(reduced)
+        assert image_processor.memory_budget.reserved > 0
+        return []
+
+    reduced_before = image_processor.DECODES_REDUCED.value()
+    image_processor.admit_render(io.BytesIO(_huge_jpeg(60000, 60000)), renditions, render)
+    assert rendered == [True]
+    assert image_processor.DECODES_REDUCED.value() == reduced_before + 1
+
+    # A real decode under tight limits: the PNG cannot be reduced, the JPEG can.
+    monkeypatch.setattr(image_processor, "DECODE_REDUCE_BYTES", 1024 * 1024)
+    monkeypatch.setattr(image_processor, "DECODE_MAX_BYTES", 4 * 1024 * 1024)
+    with pytest.raises(image_processor.ImageTooLarge):
+        image_processor.admit_render(
+            io.BytesIO(_png_bytes((2048, 1536))), renditions, lambda todo, reduced: pytest.fail("rejected"))
+    source = io.BytesIO()
+    Image.new("RGB", (2048, 1536), "blue").save(source, format="JPEG")
+    source.seek(0)
+    [(data, fmt)] = image_processor.admit_render(
+        source, renditions, lambda todo, reduced: image_processor.render_source(source, todo, reduced))
+    with Image.open(io.BytesIO(data)) as img:
+        assert (fmt, img.size) == ("JPEG", (256, 256))
+
+
+def test_memory_budget_admits_in_arrival_order():
+    budget = image_processor.MemoryBudget(100)
+    order = []
+    budget.acquire(60)
+
+    def job(name, nbytes):
+        budget.acquire(nbytes)
+        order.append(name)
+        budget.release(nbytes)
+
+    large = threading.Thread(target=job, args=("large", 80))
+    large.start()
+    while not budget._waiting:
+        pass
+    small = threading.Thread(target=job, args=("small", 10))
+    small.start()
+    small.join(0.2)
+    # The small job would fit, but waits behind the large one.
+    assert order == []
+    budget.release(60)
+    large.join(2)
+    small.join(2)
+    assert order == ["large", "small"]
+
+    # Larger than the whole budget: runs once nothing else is reserved.
+    budget.acquire(500)
+    budget.release(500)
+    assert budget.reserved == 0
+
+
+def test_replay_dead_letters_resets_attempts():
+    ch = _RecordingChannel(queued=[
+        (1, {"x-attempt": 5, "x-last-error": "boom"}, b"one"),
+        (2, {"x-attempt": 5}, b"two"),
+        (3, {"x-attempt": 5}, b"three"),
+    ])
+
+    assert image_processor.replay_dead_letters(ch, limit=2) == 2
+    assert ch.log == [
+        ("publish", "minio_events_queue", b"one", {"x-attempt": 1, "x-last-error": "boom"}),
+        ("ack", 1),
+        ("publish", "minio_events_queue", b"two", {"x-attempt": 1}),
+        ("ack", 2),
+    ]
+    assert image_processor.replay_dead_letters(ch) == 1
+    assert image_processor.replay_dead_letters(ch) == 0
+
+
+def test_fair_scheduler_reserves_interactive_slots_and_rotates_tenants():
+    scheduler = image_processor.FairScheduler(slots=4, reserved=1, max_per_tenant=2)
+
+    started = []
+    for i in range(6):
+        started += scheduler.add("bulk", "big", f"big-{i}")
+    # A lone tenant may pass its cap, but bulk never takes the reserved slot.
+    assert [job for _, _, job in started] == ["big-0", "big-1", "big-2"]
+
+    started = scheduler.add("bulk", "small", "small-0")
+    started += scheduler.add("interactive", "small", "click")
+    assert started == [("interactive", "small", "click")]
+
+    # A freed bulk slot goes to the waiting tenant under its cap first.
+    assert scheduler.finish("bulk", "big") == [("bulk", "small", "small-0")]
+    assert scheduler.finish("bulk", "big") == [("bulk", "big", "big-3")]
+    assert scheduler.waiting("bulk") == 2
+
+
+def _event(key, metadata=None):
+    s3_object = {"key": key}
+    if metadata is not None:
+        s3_object["userMetadata"] = metadata
+    return json.dumps({"Records": [{"s3": {"bucket": {"name": "uploads"}, "object": s3_object}}]}).encode()
+
+
+def test_events_are_routed_to_their_lane(monkeypatch):
+    lanes = {JOB_A: ("bulk", "acme")}
+    monkeypatch.setattr(image_processor, "get_job_lane", lambda job_id: lanes.get(job_id))
+
+    assert image_processor.event_lane(_event(f"{JOB_A}_a.png")) == ("bulk", "acme")
+    assert image_processor.event_lane(
+        _event(f"{JOB_B}_b.png", {"X-Amz-Meta-Priority": "bulk", "X-Amz-Meta-Tenant": "t1"})
+    ) == ("bulk", "t1")
+    assert image_processor.event_lane(_event(f"{JOB_B}_b.png")) == ("interactive", "default")
+    assert image_processor.event_lane(b"not json") == ("interactive", "default")
+
+    ch = _RecordingChannel()
+    rates = image_processor.TenantRates(clock=lambda: 0.0)
+    for tag in range(1, 41):
+        image_processor.forward_event(ch, tag, None, b"{}", "bulk", "acme", rates)
+    image_processor.forward_event(ch, 41, None, b"{}", "bulk", "small", rates)
+    image_processor.forward_event(ch, 42, None, b"{}", "interactive", "small", rates)
+
+    assert ch.log[0] == ("publish", "minio_events_bulk", b"{}", {"x-tenant": "acme"})
+    assert ch.log[1] == ("ack", 1)
+    # A heavy tenant's bulk work sinks below a newcomer's.
+    assert ch.priorities[0] == image_processor.BULK_MAX_PRIORITY
+    assert ch.priorities[39] < ch.priorities[40] == image_processor.BULK_MAX_PRIORITY
+    assert ch.log[-2][1] == "minio_events_interactive" and ch.priorities[-1] is None
+
+
+def test_bulk_resize_local_directory_checkpoints_and_resumes(tmp_path):
+    source, dest = tmp_path / "src", tmp_path / "out"
+    (source / "nested").mkdir(parents=True)
+    (source / "a.png").write_bytes(_png_bytes())
+    (source / "nested" / "b.png").write_bytes(_png_bytes((32, 32)))
+    (source / "broken.png").write_bytes(b"not an image")
+    (source / "notes.txt").write_text("skipped: not an image extension")
+    checkpoint = tmp_path / "progress.checkpoint"
+    renditions = image_processor.resolve_renditions("web")
+
+    stats = image_processor.bulk_resize(
+        str(source), str(dest), renditions, workers=0, io_threads=2, checkpoint_path=str(checkpoint)
+    )
+
+    assert (stats["processed"], stats["skipped"], stats["failed"]) == (2, 0, 1)
+    assert (dest / "a.png").exists() and (dest / "thumb" / "a.webp").exists()
+    assert (dest / "nested" / "medium" / "b.jpg").exists()
+    with Image.open(dest / "nested" / "b.png") as img:
+        assert img.size == (256, 256)
+    assert set(checkpoint.read_text().split()) == {"a.png", os.path.join("nested", "b.png")}
+
+    # A rerun only retries what failed.
+    (source / "broken.png").write_bytes(_png_bytes())
+    stats = image_processor.bulk_resize(
+        str(source), str(dest), renditions, workers=0, io_threads=2, checkpoint_path=str(checkpoint)
+    )
+    assert (stats["processed"], stats["skipped"], stats["failed"]) == (1, 2, 0)
+
+
+def test_parse_location_treats_prefix_as_directory():
+    assert image_processor.parse_location("s3://uploads") == ("uploads", "")
+    assert image_processor.parse_location("s3://uploads/2024/") == ("uploads", "2024/")
+    assert image_processor.parse_location("s3://uploads/2024") == ("uploads", "2024/")
+    assert image_processor.parse_location("./images") == (None, "./images")
+
+
+def test_backoff_delays_grow_with_full_jitter():
+    delays = image_processor.backoff_delays(base=0.1, cap=1.0, rng=lambda: 1.0)
+    assert [round(next(delays), 2) for _ in range(6)] == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+    jittered = image_processor.backoff_delays(base=0.1, cap=1.0)
+    assert all(0 <= next(jittered) <= 1.0 for _ in range(20))
+
+
+def test_executor_drain_requeues_waiting_and_settles_running(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(image_processor, "handle_event", lambda body, attempt: release.wait(2) and ("completed", None))
+    scheduled, log = [], []
+
+    def process_data_events(time_limit):
+        release.set()
+        while scheduled:
+            scheduled.pop(0)()
+
+    connection = SimpleNamespace(add_callback_threadsafe=scheduled.append, process_data_events=process_data_events)
+    ch = SimpleNamespace(
+        basic_ack=lambda delivery_tag: log.append(("ack", delivery_tag)),
+        basic_nack=lambda delivery_tag, requeue: log.append(("nack", delivery_tag, requeue)),
+    )
+    executor = image_processor.JobExecutor(
+        connection, io_threads=1, scheduler=image_processor.FairScheduler(1, reserved=0))
+    for tag in (1, 2, 3):
+        executor.on_message(ch, SimpleNamespace(delivery_tag=tag), None, b"{}")
+
+    assert executor.drain(timeout=2) == 0
+    executor.shutdown()
+    # The running job is acked once it finishes; the others go back to the broker.
+    assert sorted(log) == [("ack", 1), ("nack", 2, True), ("nack", 3, True)]
+
+
+STARTUP_SCRIPT = """
+import signal, sys, time
+started = time.monotonic()
+import pika
+
+class Channel:
+    is_open = True
+    def __init__(self, connection):
+        self.connection = connection
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+    def start_consuming(self):
+        print(f"consuming after {time.monotonic() - started:.3f}s", flush=True)
+        signal.raise_signal(signal.SIGTERM)
+        while self.connection.callbacks:
+            self.connection.callbacks.pop(0)()
+    def stop_consuming(self):
+        print("stopped consuming", flush=True)
+
+class Connection:
+    is_open = True
+    def __init__(self, parameters):
+        self.callbacks = []
+    def channel(self):
+        return Channel(self)
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+    def process_data_events(self, time_limit=0):
+        pass
+    def close(self):
+        self.is_open = False
+
+pika.BlockingConnection = Connection
+import image_processor
+image_processor.main()
+"""
+
+
+def test_worker_starts_consuming_quickly_and_exits_cleanly_on_sigterm():
+    import subprocess
+    import sys
+
+    env = dict(
+        os.environ,
+        PROCESSOR_WORKERS="0",
+        PROCESSOR_METRICS_PORT="0",
+        DATABASE_URL="postgresql://nobody@127.0.0.1:1/none",
+        MINIO_ENDPOINT="127.0.0.1:1",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT], env=env, capture_output=True, text=True, timeout=30,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert result.returncode == 0, result.stderr
+    consuming = next(line for line in result.stdout.splitlines() if line.startswith("consuming after"))
+    # Imports, config and consumer setup, with no fixed sleep and without
+    # waiting for Postgres or MinIO.
+    assert float(consuming.split()[-1].rstrip("s")) < 1.0, result.stdout
+    assert "stopped consuming" in result.stdout
+    assert "Image processor stopped." in result.stdout
@@ -0,0 +1,88 @@
+import json
+from types import SimpleNamespace
+
+import job_events
+
+
+def test_hub_routes_events_to_job_and_firehose_subscribers():
+    hub = job_events.JobEventHub(listen=False)
+    job_a = hub.subscribe(["a"])
+    job_b = hub.subscribe(["b"])
+    everything = hub.subscribe()
+
+    hub.publish({"id": "a", "status": "processing"})
+
+    assert job_a.get(timeout=0) == {"id": "a", "status": "processing"}
+    assert job_b.get(timeout=0) is None
+    assert everything.get(timeout=0)["id"] == "a"
+
+    with job_b:
+        assert hub.subscriber_count() == 3
+    job_a.close()
+    everything.close()
+    assert hub.subscriber_count() == 0
+    hub.publish({"id": "a", "status": "completed"})
+    assert job_a.get(timeout=0) is None
+
+
+def test_hub_drops_events_for_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(job_events, "SUBSCRIBER_QUEUE_SIZE", 2)
+    hub = job_events.JobEventHub(listen=False)
+    slow = hub.subscribe(["a"])
+
+    for status in ("processing", "completed", "error"):
+        hub.publish({"id": "a", "status": status})
+
+    assert [slow.get(timeout=0)["status"] for _ in range(2)] == ["processing", "completed"]
+    assert slow.get(timeout=0) is None
+
+
+def test_listener_dispatches_notifications_from_one_connection(monkeypatch):
+    executed = []
+    payloads = [json.dumps({"id": "a", "status": "completed"}), "not json"]
+
+    class FakeCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql):
+            executed.append(sql)
+
+    class FakeConnection:
+        autocommit = False
+
+        def __init__(self):
+            self.notifies = []
+
+        def cursor(self):
+            return FakeCursor()
+
+        def poll(self):
+            while payloads:
+                self.notifies.append(SimpleNamespace(payload=payloads.pop(0)))
+
+        def close(self):
+            pass
+
+    conn = FakeConnection()
+    hub = job_events.JobEventHub(connect=lambda: conn, listen=False)
+    subscription = hub.subscribe(["a"])
+
+    def fake_select(rlist, wlist, xlist, timeout):
+        if payloads:
+            return rlist, [], []
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(job_events.select, "select", fake_select)
+    try:
+        hub._listen_forever()
+    except KeyboardInterrupt:
+        pass
+
+    assert executed == ["LISTEN job_status;"]
+    assert conn.autocommit is True
+    assert subscription.get(timeout=0) == {"id": "a", "status": "completed"}
+    assert subscription.get(timeout=0) is None
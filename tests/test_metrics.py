@@ -0,0 +1,53 @@
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+def test_counter_and_histogram_render_exposition_format():
+    registry = metrics.Registry()
+    jobs = metrics.Counter("jobs_total", "Jobs.", ["outcome"], registry=registry)
+    latency = metrics.Histogram("latency_seconds", "Latency.", ["route"], buckets=(0.1, 1), registry=registry)
+
+    jobs.inc(outcome="completed")
+    jobs.inc(2, outcome='err"or')
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, route="/api/x")
+
+    text = registry.render()
+    assert '# TYPE jobs_total counter\n' in text
+    assert 'jobs_total{outcome="completed"} 1\n' in text
+    assert 'jobs_total{outcome="err\\"or"} 2\n' in text
+    assert 'latency_seconds_bucket{route="/api/x",le="0.1"} 2\n' in text
+    assert 'latency_seconds_bucket{route="/api/x",le="1.0"} 3\n' in text
+    assert 'latency_seconds_bucket{route="/api/x",le="+Inf"} 4\n' in text
+    assert 'latency_seconds_count{route="/api/x"} 4\n' in text
+    assert 'latency_seconds_sum{route="/api/x"} 3.65\n' in text
+
+
+def test_labels_are_validated_and_gauges_move_both_ways():
+    registry = metrics.Registry()
+    gauge = metrics.Gauge("in_progress", "In progress.", registry=registry)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.value() == 1
+
+    counter = metrics.Counter("labelled_total", "Labelled.", ["stage"], registry=registry)
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_http_server_serves_metrics():
+    registry = metrics.Registry()
+    metrics.Counter("served_total", "Served.", registry=registry).inc()
+    server = metrics.start_http_server(0, addr="127.0.0.1", registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as resp:
+            assert resp.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert "served_total 1\n" in resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
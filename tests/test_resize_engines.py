@@ -0,0 +1,131 @@
+import io
+import sys
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+import resize_engines
+
+ENGINES = resize_engines.available_engines()
+RENDITIONS = [
+    {"name": "default", "width": 256, "height": 256, "fit": "stretch"},
+    {"name": "thumb", "width": 150, "height": 150, "fit": "cover", "format": "WEBP", "quality": 80},
+    {"name": "medium", "width": 400, "height": 400, "fit": "contain", "format": "JPEG", "quality": 85},
+]
+
+
+def _sample(size, mode, fmt, orientation=1):
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((size[0] // 8, size[1] // 8, size[0] // 3, size[1] // 2), fill=(200, 30, 30))
+    draw.ellipse((size[0] // 2, size[1] // 4, size[0] - 10, size[1] - 10), fill=(20, 160, 220))
+    if mode == "RGBA":
+        img.putalpha(Image.radial_gradient("L").resize(size))
+    elif mode != "RGB":
+        img = img.convert(mode)
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[resize_engines.EXIF_ORIENTATION] = orientation
+    output = io.BytesIO()
+    img.save(output, format=fmt, exif=exif)
+    return output.getvalue()
+
+
+CORPUS = {
+    "rgb.jpg": _sample((1600, 1200), "RGB", "JPEG"),
+    "gray.jpg": _sample((900, 1200), "L", "JPEG"),
+    "rgba.png": _sample((1200, 900), "RGBA", "PNG"),
+    "rgb.webp": _sample((1000, 700), "RGB", "WEBP"),
+    "rotated.jpg": _sample((1200, 800), "RGB", "JPEG", orientation=6),
+}
+
+
+def _decoded(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.format, img.convert("RGB")
+
+
+def _difference(a, b):
+    """Mean absolute per-channel difference, 0-255."""
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / 3
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.name)
+@pytest.mark.parametrize("name", sorted(CORPUS))
+@pytest.mark.parametrize("mode", sorted(resize_engines.RESIZE_MODES))
+def test_engines_match_pillow_reference(engine, name, mode):
+    reference = resize_engines.PillowEngine().render(io.BytesIO(CORPUS[name]), RENDITIONS, "quality")
+    outputs = engine.render(io.BytesIO(CORPUS[name]), RENDITIONS, mode)
+
+    source_fmt = Image.open(io.BytesIO(CORPUS[name])).format
+    for rendition, (data, fmt), (expected, _) in zip(RENDITIONS, outputs, reference):
+        assert fmt == (rendition.get("format") or source_fmt)
+        decoded_fmt, img = _decoded(data)
+        assert decoded_fmt == fmt
+        _, expected_img = _decoded(expected)
+        assert img.size == expected_img.size
+        # Same geometry, orientation and crop; only filter and codec noise differ.
+        assert _difference(img, expected_img) < 3, rendition["name"]
+
+
+def test_exif_orientation_is_applied_before_fitting():
+    contain = [{"name": "default", "width": 100, "height": 100, "fit": "contain"}]
+    for engine in ENGINES:
+        [(data, _)] = engine.render(io.BytesIO(CORPUS["rotated.jpg"]), contain)
+        # 1200x800 stored, rotated 90 degrees for display.
+        assert Image.open(io.BytesIO(data)).size == (67, 100), engine.name
+
+
+def test_missing_engine_falls_back_to_pillow(monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "pyvips", None)
+    engine = resize_engines.load_engine("vips")
+    assert isinstance(engine, resize_engines.PillowEngine)
+    assert "[WARN]" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        resize_engines.load_engine("imagemagick")
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.name)
+def test_unsupported_sources_are_rendered_by_pillow(engine):
+    frames = [Image.new("P", (300, 200), i) for i in range(3)]
+    source = io.BytesIO()
+    frames[0].save(source, format="GIF", save_all=True, append_images=frames[1:])
+    [(data, fmt)] = engine.render(io.BytesIO(source.getvalue()), RENDITIONS[:1])
+    assert fmt == "GIF"
+    assert Image.open(io.BytesIO(data)).size == (256, 256)
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.name)
+def test_reduced_decode_keeps_geometry(engine):
+    reference = resize_engines.PillowEngine().render(io.BytesIO(CORPUS["rotated.jpg"]), RENDITIONS, "quality")
+    outputs = engine.render(io.BytesIO(CORPUS["rotated.jpg"]), RENDITIONS, "quality", reduced=True)
+    for rendition, (data, _), (expected, _) in zip(RENDITIONS, outputs, reference):
+        _, img = _decoded(data)
+        _, expected_img = _decoded(expected)
+        assert img.size == expected_img.size
+        assert _difference(img, expected_img) < 3, rendition["name"]
+
+
+def test_decode_estimate_reads_only_the_header():
+    source = io.BytesIO(CORPUS["rgb.jpg"])
+    source.seek(5)
+    size, estimate, reduced = resize_engines.decode_estimate(source, RENDITIONS, "quality")
+    assert source.tell() == 5
+    assert size == (1600, 1200)
+    outputs = (256 * 256 + 150 * 200 + 400 * 300) * 4
+    assert estimate == 1600 * 1200 * 4 + outputs
+    # Every target fits in 400x300, so libjpeg can decode at quarter scale.
+    assert reduced == 400 * 300 * 4 + outputs
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.name)
+def test_png_headers_are_read_without_decoding(engine, monkeypatch):
+    loads = []
+    original_load = Image.Image.load
+    monkeypatch.setattr(Image.Image, "load", lambda self: loads.append(self.format) or original_load(self))
+    source = io.BytesIO(CORPUS["rgba.png"])
+    assert resize_engines.decode_estimate(source, RENDITIONS)[0] == (1200, 900)
+    assert loads == []
+    if engine.name != "pillow":
+        engine.render(source, RENDITIONS[:1])
+        assert loads == []
@@ -1,13 +1,88 @@
+import hashlib
 import io
+import threading
 import uuid
+from types import SimpleNamespace
+
+import pytest
+from starlette.testclient import TestClient
 
 import server
+import server_async
+import thumb_cache
+from renditions import RENDITION_PROFILES
 
 
-def test_presigned_upload_generates_job_and_object_name(monkeypatch):
-    app = server.app
-    app.testing = True
-    client = app.test_client()
+class AsgiResponse:
+    """The parts of Flask's test response the shared tests use."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.data = response.content
+        self.mimetype = response.headers.get("content-type", "").split(";")[0]
+        self._response = response
+
+    def get_json(self):
+        return self._response.json()
+
+
+class AsgiClient:
+    """Flask-test-client-style calls against the ASGI app."""
+
+    def __init__(self, app):
+        self.client = TestClient(app, follow_redirects=False)
+
+    def get(self, url, headers=None):
+        return AsgiResponse(self.client.get(url, headers=headers))
+
+    def post(self, url, json=None, data=None, content_type=None, headers=None):
+        if content_type != "multipart/form-data":
+            return AsgiResponse(self.client.post(url, json=json, headers=headers))
+        fields = {k: v for k, v in data.items() if not isinstance(v, tuple)}
+        files = {k: (v[1], v[0]) for k, v in data.items() if isinstance(v, tuple)}
+        return AsgiResponse(self.client.post(url, data=fields, files=files, headers=headers))
+
+
+@pytest.fixture(autouse=True)
+def no_resized_cache(monkeypatch):
+    """Every test starts without cached resized images; opt in per test."""
+    monkeypatch.setattr(server, "resized_cache", thumb_cache.ThumbnailCache(max_bytes=0, directory=None))
+
+
+@pytest.fixture(params=["flask", "asgi"])
+def api(request, monkeypatch):
+    """
+    The same route tests run against server.py and server_async.py. Both
+    share server.minio_client; patch DB functions with api.patch_db(), which
+    makes fakes awaitable for the ASGI app.
+    """
+    if request.param == "flask":
+        server.app.testing = True
+        module, client = server, server.app.test_client()
+
+        def limit_upload(size):
+            monkeypatch.setitem(server.app.config, "MAX_CONTENT_LENGTH", size)
+    else:
+        module, client = server_async, AsgiClient(server_async.app)
+
+        def limit_upload(size):
+            monkeypatch.setattr(server_async, "MAX_UPLOAD_BYTES", size)
+
+    def patch_db(name, fake):
+        if module is server_async:
+            sync_fake = fake
+
+            async def fake(*args, **kwargs):
+                return sync_fake(*args, **kwargs)
+        monkeypatch.setattr(module, name, fake)
+
+    module._listing_cache.clear()
+    return SimpleNamespace(module=module, client=client, patch_db=patch_db, limit_upload=limit_upload)
+
+
+def test_presigned_upload_generates_job_and_object_name(api, monkeypatch):
+    client = api.client
 
     fixed_uuid = uuid.UUID("123e4567-e89b-12d3-a456-426614174000")
 
@@ -16,12 +91,16 @@ def test_presigned_upload_generates_job_and_object_name(monkeypatch):
 
     created_jobs = []
 
-    def fake_create_job(filename, original_filename=None, job_id=None):
+    def fake_create_job(filename, original_filename=None, job_id=None, renditions=None,
+                        priority="interactive", tenant="default"):
         created_jobs.append(
             {
                 "filename": filename,
                 "original_filename": original_filename,
                 "job_id": job_id,
+                "renditions": renditions,
+                "priority": priority,
+                "tenant": tenant,
             }
         )
         return job_id
@@ -30,7 +109,7 @@ def test_presigned_upload_generates_job_and_object_name(monkeypatch):
         # Return a simple MinIO-style URL
         return f"http://minio:9000/{bucket}/{object_name}"
 
-    monkeypatch.setattr(server, "create_job", fake_create_job)
+    api.patch_db("create_job", fake_create_job)
     monkeypatch.setattr(server.minio_client, "presigned_put_object", fake_presigned_put_object)
     monkeypatch.setattr(server.uuid, "uuid4", fake_uuid4)
 
@@ -54,14 +133,15 @@ def test_presigned_upload_generates_job_and_object_name(monkeypatch):
             "filename": expected_object_name,
             "original_filename": "example.png",
             "job_id": expected_job_id,
+            "renditions": RENDITION_PROFILES["default"],
+            "priority": "interactive",
+            "tenant": "default",
         }
     ]
 
 
-def test_upload_image_creates_job_and_stores_in_minio(monkeypatch):
-    app = server.app
-    app.testing = True
-    client = app.test_client()
+def test_upload_image_creates_job_and_stores_in_minio(api, monkeypatch):
+    client = api.client
 
     fixed_uuid = uuid.UUID("123e4567-e89b-12d3-a456-426614174001")
 
@@ -70,29 +150,35 @@ def test_upload_image_creates_job_and_stores_in_minio(monkeypatch):
 
     created_jobs = []
 
-    def fake_create_job(filename, original_filename=None, job_id=None):
+    def fake_create_job(filename, original_filename=None, job_id=None, renditions=None,
+                        priority="interactive", tenant="default"):
         created_jobs.append(
             {
                 "filename": filename,
                 "original_filename": original_filename,
                 "job_id": job_id,
+                "renditions": renditions,
+                "priority": priority,
+                "tenant": tenant,
             }
         )
         return job_id
 
     stored_objects = []
 
-    def fake_put_object(bucket, object_name, data, length, content_type):
+    def fake_put_object(bucket, object_name, data, length, part_size, content_type, metadata):
         stored_objects.append(
             {
                 "bucket": bucket,
                 "object_name": object_name,
+                "data": data.read(part_size),
                 "length": length,
                 "content_type": content_type,
+                "metadata": metadata,
             }
         )
 
-    monkeypatch.setattr(server, "create_job", fake_create_job)
+    api.patch_db("create_job", fake_create_job)
     monkeypatch.setattr(server.minio_client, "put_object", fake_put_object)
     monkeypatch.setattr(server.uuid, "uuid4", fake_uuid4)
 
@@ -117,6 +203,12 @@ def test_upload_image_creates_job_and_stores_in_minio(monkeypatch):
     # MinIO put_object should have been called with the derived key
     assert stored_objects[0]["bucket"] == server.UPLOAD_BUCKET
     assert stored_objects[0]["object_name"] == expected_object_name
+    # The body is streamed (unknown length) rather than buffered.
+    assert stored_objects[0]["length"] == -1
+    assert stored_objects[0]["data"] == b"fake-image-bytes"
+    assert stored_objects[0]["metadata"] == {"priority": "interactive", "tenant": "default"}
+    assert body["size"] == len(b"fake-image-bytes")
+    assert body["sha256"] == hashlib.sha256(b"fake-image-bytes").hexdigest()
 
     # DB job creation should reflect the same identifiers
     assert created_jobs == [
@@ -124,21 +216,857 @@ def test_upload_image_creates_job_and_stores_in_minio(monkeypatch):
             "filename": expected_object_name,
             "original_filename": "photo.jpg",
             "job_id": expected_job_id,
+            "renditions": RENDITION_PROFILES["default"],
+            "priority": "interactive",
+            "tenant": "default",
         }
     ]
 
 
-def test_job_status_404_when_missing(monkeypatch):
-    app = server.app
-    app.testing = True
-    client = app.test_client()
+def test_job_status_404_when_missing(api, monkeypatch):
+    client = api.client
 
     def fake_get_job(job_id):
         return None
 
-    monkeypatch.setattr(server, "get_job", fake_get_job)
+    api.patch_db("get_job", fake_get_job)
 
     resp = client.get("/api/jobs/nonexistent-id")
     assert resp.status_code == 404
     assert resp.get_json()["error"] == "Job not found"
 
+
+def _job_row(job_id, status, minute, **fields):
+    from datetime import datetime, timezone
+
+    return {"id": job_id, "status": status, "error_message": None, "cache_hit": None,
+            "updated_at": datetime(2025, 1, 2, 3, minute, tzinfo=timezone.utc), **fields}
+
+
+def test_bulk_job_lookup_uses_one_query_and_reports_missing_ids(api):
+    ids = [str(uuid.UUID(int=i)) for i in range(1, 4)]
+    rows = {
+        ids[0]: _job_row(ids[0], "completed", 5, cache_hit=True),
+        ids[2]: _job_row(ids[2], "error", 4, error_message="broken"),
+    }
+    queries = []
+
+    def fake_get_jobs(**query):
+        queries.append(query)
+        return [rows[job_id] for job_id in query["job_ids"] if job_id in rows]
+
+    api.patch_db("get_jobs", fake_get_jobs)
+
+    resp = api.client.get(f"/api/jobs?ids={ids[2]},{ids[0]},not-a-uuid&ids={ids[1]}&ids={ids[0]}")
+    assert resp.status_code == 200
+    assert resp.get_json() == {
+        "jobs": [
+            {"id": ids[2], "status": "error", "error_message": "broken", "updated_at": "2025-01-02T03:04:00+00:00"},
+            {"id": ids[0], "status": "completed", "cache_hit": True, "updated_at": "2025-01-02T03:05:00+00:00"},
+        ],
+        "missing": ["not-a-uuid", ids[1]],
+    }
+    assert queries == [{"job_ids": [ids[2], ids[0], ids[1]], "statuses": None, "since": None, "until": None}]
+
+    resp = api.client.post("/api/jobs", json={"ids": [ids[0], ids[2]], "status": "completed"})
+    assert resp.status_code == 200
+    assert queries[-1]["statuses"] == ["completed"]
+
+    too_many = ",".join(str(uuid.UUID(int=i)) for i in range(server.JOB_LOOKUP_MAX_IDS + 1))
+    assert api.client.post("/api/jobs", json={"ids": too_many}).status_code == 400
+    assert api.client.get("/api/jobs?status=finished").status_code == 400
+    assert api.client.post("/api/jobs", json={"ids": [1, 2]}).status_code == 400
+    assert api.client.post("/api/jobs", json=["not", "an", "object"]).status_code == 400
+    assert len(queries) == 2
+
+
+def test_bulk_job_lookup_answers_304_while_results_are_unchanged(api):
+    job_id = str(uuid.UUID(int=7))
+    rows = [_job_row(job_id, "in_progress", 1)]
+    api.patch_db("get_jobs", lambda **query: rows)
+
+    first = api.client.get(f"/api/jobs?ids={job_id}")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = api.client.get(f"/api/jobs?ids={job_id}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+    rows[0] = _job_row(job_id, "completed", 2)
+    changed = api.client.get(f"/api/jobs?ids={job_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.get_json()["jobs"][0]["status"] == "completed"
+
+
+def test_job_lookup_by_filters_pages_newest_first(api):
+    from datetime import datetime, timezone
+
+    rows = [_job_row(str(uuid.UUID(int=i)), "error", 10 - i) for i in range(1, 3)]
+    queries = []
+    api.patch_db("get_jobs", lambda **query: queries.append(query) or rows)
+
+    resp = api.client.get("/api/jobs?status=error,retrying&since=2025-01-02T03:00:00+00:00&limit=2")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert [job["id"] for job in data["jobs"]] == [row["id"] for row in rows]
+    assert server.decode_cursor(data["next_cursor"]) == (rows[1]["updated_at"], rows[1]["id"])
+    assert queries == [{
+        "statuses": ["error", "retrying"],
+        "since": datetime(2025, 1, 2, 3, 0, tzinfo=timezone.utc),
+        "until": None,
+        "limit": 2,
+        "cursor": None,
+    }]
+
+    resp = api.client.get(f"/api/jobs?status=error&limit=2&cursor={data['next_cursor']}")
+    assert queries[-1]["cursor"] == (rows[1]["updated_at"], rows[1]["id"])
+    assert api.client.get("/api/jobs?since=yesterday").status_code == 400
+
+
+
+def test_job_status_json_is_identical_across_servers(monkeypatch):
+    from datetime import datetime, timezone
+
+    job = {
+        "id": uuid.UUID("123e4567-e89b-12d3-a456-426614174002"),
+        "status": "completed",
+        "renditions": None,
+        "updated_at": datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    }
+    monkeypatch.setattr(server, "get_job", lambda job_id: job)
+
+    async def get_job(job_id):
+        return job
+
+    monkeypatch.setattr(server_async, "get_job", get_job)
+    flask_resp = server.app.test_client().get("/api/jobs/x")
+    asgi_resp = TestClient(server_async.app).get("/api/jobs/x")
+    assert asgi_resp.status_code == flask_resp.status_code == 200
+    assert asgi_resp.content == flask_resp.data
+    assert asgi_resp.headers["content-type"] == flask_resp.headers["Content-Type"]
+
+
+def test_asgi_requests_are_timed_per_route(monkeypatch):
+    async def get_job(job_id):
+        return None
+
+    monkeypatch.setattr(server_async, "get_job", get_job)
+    client = TestClient(server_async.app)
+    before = server_async.ASYNC_REQUEST_SECONDS.count(method="GET", route="/api/jobs/{job_id}", status=404)
+    client.get("/api/jobs/a")
+    client.get("/api/jobs/b")
+    assert server_async.ASYNC_REQUEST_SECONDS.count(
+        method="GET", route="/api/jobs/{job_id}", status=404) == before + 2
+    assert "http_async_request_duration_seconds_bucket" in client.get("/metrics").text
+
+
+def test_presigned_upload_with_profile_returns_rendition_keys(api, monkeypatch):
+    client = api.client
+
+    created = {}
+    api.patch_db("create_job", lambda **kw: created.update(kw))
+    monkeypatch.setattr(
+        server.minio_client,
+        "presigned_put_object",
+        lambda bucket, object_name, expires: f"http://minio:9000/{bucket}/{object_name}",
+    )
+
+    resp = client.post("/api/presigned-upload", json={"filename": "cat.png", "profile": "web"})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    object_name = data["object_name"]
+
+    assert created["renditions"] == RENDITION_PROFILES["web"]
+    assert data["renditions"] == [
+        {"name": "default", "key": object_name},
+        {"name": "thumb", "key": f"thumb/{object_name[:-4]}.webp"},
+        {"name": "medium", "key": f"medium/{object_name[:-4]}.jpg"},
+        {"name": "webp", "key": f"webp/{object_name[:-4]}.webp"},
+    ]
+
+
+def test_presigned_upload_rejects_invalid_renditions(api, monkeypatch):
+    client = api.client
+
+    api.patch_db("create_job", lambda **kw: pytest.fail("job must not be created"))
+
+    resp = client.post(
+        "/api/presigned-upload",
+        json={"filename": "cat.png", "renditions": [{"name": "huge", "width": 100000, "height": 10}]},
+    )
+    assert resp.status_code == 400
+    assert "width" in resp.get_json()["error"]
+
+    # On-demand sizes own the <w>x<h>- names and the keys they map to.
+    resp = client.post(
+        "/api/presigned-upload",
+        json={"filename": "cat.png", "renditions": [{"name": "256x256-contain-png", "width": 256, "height": 256}]},
+    )
+    assert resp.status_code == 400
+    assert "reserved" in resp.get_json()["error"]
+
+
+def test_presigned_upload_tags_priority_and_tenant(api, monkeypatch):
+    client = api.client
+    created = []
+    api.patch_db("create_job", lambda **kw: created.append((kw["priority"], kw["tenant"])) or kw["job_id"])
+    monkeypatch.setattr(
+        server.minio_client,
+        "presigned_put_object",
+        lambda bucket, object_name, expires: f"http://minio:9000/{bucket}/{object_name}",
+    )
+
+    resp = client.post(
+        "/api/presigned-upload", json={"filename": "a.png", "priority": "bulk"}, headers={"X-Tenant-Id": "acme"}
+    )
+    assert resp.status_code == 200
+    assert resp.get_json()["priority"] == "bulk"
+    assert created == [("bulk", "acme")]
+
+    for headers, body in (({"X-Tenant-Id": "no spaces"}, {}), ({}, {"priority": "urgent"})):
+        resp = client.post("/api/presigned-upload", json={"filename": "a.png", **body}, headers=headers)
+        assert resp.status_code == 400
+    assert len(created) == 1
+
+
+def test_cache_stats_exposes_hit_rate_and_bytes_saved(monkeypatch):
+    app = server.app
+    app.testing = True
+    client = app.test_client()
+
+    stats = {"job_hits": 3, "completed_jobs": 4, "hit_rate": 0.75, "entries": 1, "rendition_hits": 3, "bytes_saved": 300}
+    monkeypatch.setattr(server, "get_cache_stats", lambda: stats)
+
+    resp = client.get("/api/cache/stats")
+    assert resp.status_code == 200
+    assert resp.get_json() == stats
+
+
+def test_presigned_upload_batch_inserts_all_jobs_at_once(monkeypatch):
+    app = server.app
+    app.testing = True
+    client = app.test_client()
+
+    inserts = []
+    lanes = []
+    monkeypatch.setattr(
+        server, "create_jobs", lambda jobs, priority, tenant: inserts.append(jobs) or lanes.append((priority, tenant))
+    )
+    monkeypatch.setattr(
+        server.minio_client,
+        "presigned_put_object",
+        lambda bucket, object_name, expires: f"http://minio:9000/{bucket}/{object_name}",
+    )
+
+    files = [{"filename": f"img{i}.png", "content_type": "image/png"} for i in range(3)]
+    resp = client.post("/api/presigned-upload/batch", json={"files": files}, headers={"X-Tenant-Id": "acme"})
+    assert resp.status_code == 200
+    uploads = resp.get_json()["uploads"]
+
+    assert [u["filename"] for u in uploads] == ["img0.png", "img1.png", "img2.png"]
+    assert all(u["object_name"] == f"{u['job_id']}_{u['filename']}" for u in uploads)
+    assert all(u["object_name"] in u["url"] for u in uploads)
+    assert len(inserts) == 1
+    assert [job[0] for job in inserts[0]] == [u["job_id"] for u in uploads]
+    # Batches default to the bulk lane.
+    assert lanes == [("bulk", "acme")]
+
+    # ...and cannot ask their way into the interactive lane.
+    resp = client.post("/api/presigned-upload/batch", json={"files": files, "priority": "interactive"})
+    assert resp.status_code == 200
+    assert lanes[-1] == ("bulk", "default")
+
+
+def test_presigned_upload_batch_enforces_limit(monkeypatch):
+    app = server.app
+    app.testing = True
+    client = app.test_client()
+    monkeypatch.setattr(server, "BATCH_MAX_FILES", 2)
+
+    resp = client.post("/api/presigned-upload/batch", json={"files": [{"filename": "a"}] * 3})
+    assert resp.status_code == 400
+
+
+def test_upload_batch_streams_files_and_marks_failures(monkeypatch):
+    app = server.app
+    app.testing = True
+    client = app.test_client()
+
+    log, errors = [], []
+    monkeypatch.setattr(server, "create_job", lambda **kw: log.append(("create", kw["filename"], kw["priority"])))
+    monkeypatch.setattr(server, "update_job_status", lambda job_id, status, error_message=None: errors.append(job_id))
+    monkeypatch.setattr(server, "BATCH_MAX_FILES", 3)
+    monkeypatch.setattr(
+        server.app.request_class, "files", property(lambda self: pytest.fail("body must not be buffered")), raising=False)
+
+    def fake_put_object(bucket, object_name, data, length, part_size, content_type, metadata):
+        if object_name.endswith("bad.jpg"):
+            raise RuntimeError("MinIO unavailable")
+        log.append(("put", object_name, data.read(), length, part_size))
+
+    monkeypatch.setattr(server.minio_client, "put_object", fake_put_object)
+
+    data = {
+        "profile": "web",
+        "priority": "interactive",
+        "images": [
+            (io.BytesIO(b"first"), "a.jpg"),
+            (io.BytesIO(b"second"), "bad.jpg"),
+            (io.BytesIO(b"third"), "c.jpg"),
+            (io.BytesIO(b"fourth"), "d.jpg"),
+        ],
+    }
+    resp = client.post("/api/upload/batch", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 202
+    uploads = resp.get_json()["uploads"]
+
+    assert [u["status"] for u in uploads] == ["pending", "error", "pending", "error"]
+    assert "At most 3 files" in uploads[3]["error"]
+    assert uploads[0]["size"] == 5
+    a, bad, c = (u["object_name"] for u in uploads[:3])
+    # Each row is inserted before its object is stored.
+    assert log == [
+        ("create", a, "bulk"),
+        ("put", a, b"first", -1, server.UPLOAD_PART_SIZE),
+        ("create", bad, "bulk"),
+        ("create", c, "bulk"),
+        ("put", c, b"third", -1, server.UPLOAD_PART_SIZE),
+    ]
+    assert errors == [uploads[1]["job_id"]]
+    assert uploads[0]["renditions"][1]["name"] == "thumb"
+
+
+def test_upload_batch_reports_failures_per_file_and_keeps_stored_files(monkeypatch):
+    client = server.app.test_client()
+    stored = []
+
+    def create_job(**kw):
+        if kw["original_filename"] == "nodb.jpg":
+            raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(server, "create_job", create_job)
+    monkeypatch.setattr(server, "update_job_status", lambda *a, **kw: None)
+    monkeypatch.setattr(
+        server.minio_client, "put_object", lambda bucket, name, data, **kw: stored.append((name, data.read())))
+
+    boundary = "batch-boundary"
+
+    def part(filename, data):
+        return (f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="{filename}"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n').encode() + data + b"\r\n"
+
+    body = part("a.jpg", b"first") + part("nodb.jpg", b"second") + part("c.jpg", b"third")
+    # The client goes away in the middle of a fourth file.
+    body += f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="d.jpg"\r\n\r\nfou'.encode()
+    resp = client.post(
+        "/api/upload/batch", data=body, content_type=f"multipart/form-data; boundary={boundary}")
+
+    assert resp.status_code == 202
+    uploads = resp.get_json()["uploads"]
+    assert [u["status"] for u in uploads] == ["pending", "error", "pending", "error", "error"]
+    assert uploads[1] == {"filename": "nodb.jpg", "status": "error", "error": "Could not create the job"}
+    assert "ended early" in uploads[4]["error"]
+    assert [data for _, data in stored] == [b"first", b"third"]
+    assert [u["object_name"] for u in uploads if u["status"] == "pending"] == [name for name, _ in stored]
+
+
+def test_upload_batch_limits_each_file_not_the_whole_body(monkeypatch):
+    app = server.app
+    app.testing = True
+    client = app.test_client()
+
+    errors = []
+    monkeypatch.setattr(server, "create_job", lambda **kw: None)
+    monkeypatch.setattr(server, "update_job_status", lambda job_id, status, error_message=None: errors.append(error_message))
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 512)
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", 512)
+    stored = {}
+
+    def fake_put_object(bucket, object_name, data, length, part_size, content_type, metadata):
+        stored[object_name.split("_", 1)[1]] = data.read()
+
+    monkeypatch.setattr(server.minio_client, "put_object", fake_put_object)
+
+    data = {"images": [
+        (io.BytesIO(b"a" * 400), "a.jpg"),
+        (io.BytesIO(b"b" * 1024), "big.jpg"),
+        (io.BytesIO(b"c" * 400), "c.jpg"),
+    ]}
+    resp = client.post("/api/upload/batch", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 202
+    uploads = resp.get_json()["uploads"]
+    assert [u["status"] for u in uploads] == ["pending", "error", "pending"]
+    assert uploads[1]["error"] == errors[0] == "File exceeds the 512 byte limit"
+    assert stored["a.jpg"] == b"a" * 400 and stored["c.jpg"] == b"c" * 400
+
+
+def test_upload_image_honours_fields_and_rejects_oversized_body(api, monkeypatch):
+    client = api.client
+
+    created = {}
+    api.patch_db("create_job", lambda **kw: created.update(kw))
+    monkeypatch.setattr(
+        server.minio_client, "put_object", lambda bucket, name, data, length, part_size, content_type, metadata: data.read()
+    )
+
+    resp = client.post(
+        "/api/upload",
+        data={"profile": "web", "image": (io.BytesIO(b"x" * 1024), "big.jpg")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 202
+    assert created["renditions"] == RENDITION_PROFILES["web"]
+
+    api.limit_upload(512)
+    resp = client.post(
+        "/api/upload",
+        data={"image": (io.BytesIO(b"x" * 1024), "big.jpg")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 413
+
+
+def test_upload_image_creates_the_job_before_storing_the_object(api, monkeypatch):
+    log = []
+    api.patch_db("create_job", lambda **kw: log.append(("create", kw["renditions"])))
+    api.patch_db("update_job_status", lambda job_id, status, error_message=None: log.append((status, error_message)))
+
+    def put_object(bucket, name, data, length, part_size, content_type, metadata):
+        log.append(("put", data.read()))
+
+    monkeypatch.setattr(server.minio_client, "put_object", put_object)
+    resp = api.client.post(
+        "/api/upload",
+        data={"profile": "web", "image": (io.BytesIO(b"pixels"), "a.jpg")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 202
+    assert log == [("create", RENDITION_PROFILES["web"]), ("put", b"pixels")]
+
+    def broken_put_object(*args, **kwargs):
+        raise RuntimeError("MinIO unavailable")
+
+    log.clear()
+    monkeypatch.setattr(server.minio_client, "put_object", broken_put_object)
+    with pytest.raises(RuntimeError):
+        api.client.post(
+            "/api/upload", data={"image": (io.BytesIO(b"pixels"), "a.jpg")}, content_type="multipart/form-data")
+    assert [entry[0] for entry in log] == ["create", "error"]
+    assert log[1] == ("error", "MinIO unavailable")
+
+
+class FakeObject:
+    def __init__(self, payload):
+        self.payload = payload
+        self.released = False
+
+    def stream(self, amt):
+        for i in range(0, len(self.payload), amt):
+            yield self.payload[i:i + amt]
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        self.released = True
+
+
+def fake_resized_store(monkeypatch, payload=b"0123456789" * 10):
+    from datetime import datetime, timezone
+
+    reads = []
+    stat = SimpleNamespace(
+        etag="abc123",
+        last_modified=datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        size=len(payload),
+        content_type="image/png",
+    )
+
+    def fake_get_object(bucket, name, offset=0, length=0):
+        reads.append((offset, length))
+        return FakeObject(payload[offset:offset + length])
+
+    monkeypatch.setattr(server.minio_client, "stat_object", lambda bucket, name: stat)
+    monkeypatch.setattr(server.minio_client, "get_object", fake_get_object)
+    return reads
+
+
+def test_resized_file_streams_with_cache_headers(api, monkeypatch):
+    client = api.client
+    reads = fake_resized_store(monkeypatch)
+
+    resp = client.get("/api/resized/thumb/photo.png")
+    assert resp.status_code == 200
+    assert resp.data == b"0123456789" * 10
+    assert resp.mimetype == "image/png"
+    assert resp.headers["ETag"] == '"abc123"'
+    assert resp.headers["Last-Modified"] == "Thu, 02 Jan 2025 03:04:05 GMT"
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert reads == [(0, 100)]
+
+
+def test_resized_file_conditional_requests_return_304(api, monkeypatch):
+    client = api.client
+    reads = fake_resized_store(monkeypatch)
+
+    resp = client.get("/api/resized/photo.png", headers={"If-None-Match": '"abc123"'})
+    assert resp.status_code == 304
+    resp = client.get("/api/resized/photo.png", headers={"If-Modified-Since": "Thu, 02 Jan 2025 03:04:05 GMT"})
+    assert resp.status_code == 304
+    resp = client.get("/api/resized/photo.png", headers={"If-None-Match": '"stale"'})
+    assert resp.status_code == 200
+    # Only the last request read the object body.
+    assert reads == [(0, 100)]
+
+
+def test_resized_file_range_requests(api, monkeypatch):
+    client = api.client
+    reads = fake_resized_store(monkeypatch)
+
+    resp = client.get("/api/resized/photo.png", headers={"Range": "bytes=10-19"})
+    assert resp.status_code == 206
+    assert resp.data == b"0123456789"
+    assert resp.headers["Content-Range"] == "bytes 10-19/100"
+    assert reads == [(10, 10)]
+
+    resp = client.get("/api/resized/photo.png", headers={"Range": "bytes=500-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == "bytes */100"
+
+
+def test_resized_file_served_from_cache_without_minio(api, monkeypatch, tmp_path):
+    client = api.client
+    monkeypatch.setattr(server, "resized_cache", thumb_cache.ThumbnailCache(directory=str(tmp_path)))
+    reads = fake_resized_store(monkeypatch)
+
+    first = client.get("/api/resized/photo.png", headers={"Range": "bytes=10-19"})
+    assert first.status_code == 206 and first.data == b"0123456789"
+    # The miss fetched the whole object to fill the cache.
+    assert reads == [(0, 100)]
+
+    def unreachable(*args, **kwargs):
+        pytest.fail("cache hit must not touch MinIO")
+
+    monkeypatch.setattr(server.minio_client, "stat_object", unreachable)
+    monkeypatch.setattr(server.minio_client, "get_object", unreachable)
+    resp = client.get("/api/resized/photo.png")
+    assert resp.status_code == 200
+    assert resp.data == b"0123456789" * 10
+    assert resp.mimetype == "image/png"
+    assert resp.headers["ETag"] == '"abc123"'
+    assert resp.headers["Last-Modified"] == "Thu, 02 Jan 2025 03:04:05 GMT"
+    assert client.get("/api/resized/photo.png", headers={"If-None-Match": '"abc123"'}).status_code == 304
+    assert client.get("/api/resized/photo.png", headers={"Range": "bytes=95-"}).data == b"56789"
+
+    # A fresh process finds the entry in the shared disk tier.
+    monkeypatch.setattr(server, "resized_cache", thumb_cache.ThumbnailCache(directory=str(tmp_path)))
+    assert client.get("/api/resized/photo.png").data == b"0123456789" * 10
+
+    stats = server.app.test_client().get("/api/cache/resized").get_json()
+    assert stats["hits"]["disk"] >= 1 and stats["hit_ratio"] > 0
+
+
+def test_resized_file_redirects_to_presigned_url(api, monkeypatch):
+    client = api.client
+    fake_resized_store(monkeypatch)
+    monkeypatch.setattr(api.module, "RESIZED_REDIRECT", True)
+    monkeypatch.setattr(
+        server.minio_client,
+        "presigned_get_object",
+        lambda bucket, name, expires: f"http://minio:9000/{bucket}/{name}?X-Amz-Signature=sig",
+    )
+
+    resp = client.get("/api/resized/photo.png")
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "http://localhost:8080/minio/resized/photo.png?X-Amz-Signature=sig"
+
+
+def test_resized_file_404_when_missing(api, monkeypatch):
+    client = api.client
+
+    def missing(bucket, name):
+        raise server.S3Error("NoSuchKey", "missing", name, "req", "host", None)
+
+    monkeypatch.setattr(server.minio_client, "stat_object", missing)
+    assert client.get("/api/resized/nope.png").status_code == 404
+
+
+def fake_bucket_store(monkeypatch, objects):
+    """MinIO stand-in over a {(bucket, key): bytes} dict; returns the list of GETs."""
+    from datetime import datetime, timezone
+
+    gets = []
+
+    def stat_object(bucket, name):
+        if (bucket, name) not in objects:
+            raise server.S3Error("NoSuchKey", "missing", name, "req", "host", None)
+        data = objects[(bucket, name)]
+        return SimpleNamespace(
+            etag=hashlib.md5(data).hexdigest(), size=len(data), content_type="image/png",
+            last_modified=datetime(2025, 1, 2, tzinfo=timezone.utc),
+        )
+
+    def get_object(bucket, name, offset=0, length=0):
+        stat_object(bucket, name)
+        gets.append((bucket, name))
+        data = objects[(bucket, name)]
+        return FakeObject(data[offset:offset + length] if length else data[offset:])
+
+    def put_object(bucket, name, data, length, content_type):
+        objects[(bucket, name)] = data.read()
+        return SimpleNamespace(etag=hashlib.md5(objects[(bucket, name)]).hexdigest())
+
+    monkeypatch.setattr(server.minio_client, "stat_object", stat_object)
+    monkeypatch.setattr(server.minio_client, "get_object", get_object)
+    monkeypatch.setattr(server.minio_client, "put_object", put_object)
+    return gets
+
+
+def _image_bytes(size, fmt="PNG"):
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new("RGB", size, "orange").save(output, format=fmt)
+    return output.getvalue()
+
+
+def test_on_demand_rendition_is_rendered_once_and_stored(api, monkeypatch):
+    from PIL import Image
+
+    client = api.client
+    upload = "11111111-1111-1111-1111-111111111111_photo.png"
+    objects = {(server.UPLOAD_BUCKET, upload): _image_bytes((1200, 900))}
+    gets = fake_bucket_store(monkeypatch, objects)
+    monkeypatch.setattr(server, "get_job", lambda job_id: None)
+
+    resp = client.get(f"/api/resized/{upload}?w=320&h=320&fmt=webp")
+    assert resp.status_code == 200
+    assert resp.mimetype == "image/webp"
+    key = f"320x320-contain-webp/{upload[:-4]}.webp"
+    assert Image.open(io.BytesIO(objects[(server.RESIZED_BUCKET, key)])).size == (320, 240)
+    assert resp.data == objects[(server.RESIZED_BUCKET, key)]
+
+    # Later hits are plain reads of the stored rendition.
+    monkeypatch.setattr(server.resize_engine, "render", lambda *a, **kw: pytest.fail("must not render again"))
+    resp = client.get(f"/api/resized/{upload}?fmt=webp&w=320")
+    assert resp.status_code == 200
+    assert gets == [(server.UPLOAD_BUCKET, upload), (server.RESIZED_BUCKET, key)]
+
+
+def test_on_demand_rendition_uses_a_larger_stored_rendition(api, monkeypatch):
+    from PIL import Image
+
+    client = api.client
+    upload = "11111111-1111-1111-1111-111111111111_photo.png"
+    medium = {"name": "medium", "width": 1024, "height": 1024, "fit": "contain", "format": "JPEG"}
+    objects = {(server.RESIZED_BUCKET, f"medium/{upload[:-4]}.jpg"): _image_bytes((1024, 768), "JPEG")}
+    gets = fake_bucket_store(monkeypatch, objects)
+    monkeypatch.setattr(
+        server, "get_job", lambda job_id: {"status": "completed", "renditions": [medium]}
+    )
+
+    resp = client.get(f"/api/resized/{upload}?w=256&fit=cover")
+    assert resp.status_code == 200
+    assert gets == [(server.RESIZED_BUCKET, f"medium/{upload[:-4]}.jpg")]
+    # Rendered from the JPEG rendition, but in the upload's format.
+    stored = objects[(server.RESIZED_BUCKET, f"256x256-cover-png/{upload}")]
+    assert Image.open(io.BytesIO(stored)).format == "PNG"
+    assert resp.mimetype == "image/png"
+
+
+def test_on_demand_rendition_of_a_huge_image_is_rejected_without_decoding(api, monkeypatch):
+    import struct
+    import zlib
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # A PNG header claiming 60000x60000 pixels, with almost no data.
+    ihdr = struct.pack(">IIBBBBB", 60000, 60000, 8, 2, 0, 0, 0)
+    bomb = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+    upload = "11111111-1111-1111-1111-111111111111_bomb.png"
+    objects = {(server.UPLOAD_BUCKET, upload): bomb}
+    fake_bucket_store(monkeypatch, objects)
+    monkeypatch.setattr(server, "get_job", lambda job_id: None)
+    monkeypatch.setattr(server.resize_engine, "render", lambda *a, **kw: pytest.fail("must not decode"))
+
+    resp = api.client.get(f"/api/resized/{upload}?w=256")
+    assert resp.status_code == 413
+    assert "60000x60000" in resp.get_json()["error"]
+    assert server._render_budget.reserved == 0
+    assert list(objects) == [(server.UPLOAD_BUCKET, upload)]
+
+
+def test_on_demand_render_surfaces_pillow_bomb_errors_as_413(api, monkeypatch):
+    from PIL import Image
+
+    upload = "11111111-1111-1111-1111-111111111111_photo.png"
+    fake_bucket_store(monkeypatch, {(server.UPLOAD_BUCKET, upload): _image_bytes((64, 64))})
+    monkeypatch.setattr(server, "get_job", lambda job_id: None)
+
+    def render(*args, **kwargs):
+        raise Image.DecompressionBombError("Image size exceeds limit")
+
+    monkeypatch.setattr(server.resize_engine, "render", render)
+    assert api.client.get(f"/api/resized/{upload}?w=256").status_code == 413
+
+
+def test_on_demand_rendition_rejects_sizes_outside_the_allow_list(api, monkeypatch):
+    client = api.client
+    monkeypatch.setattr(server.minio_client, "stat_object", lambda *a: pytest.fail("must not reach MinIO"))
+    for query in ("w=333", "w=256&h=abc", "w=256&fit=fill", "w=256&fmt=tiff", "fit=cover"):
+        assert client.get(f"/api/resized/x_photo.png?{query}").status_code == 400, query
+    assert client.get("/api/resized/thumb/photo.png?w=256").status_code == 400
+
+    fake_bucket_store(monkeypatch, {})
+    monkeypatch.setattr(server, "get_job", lambda job_id: None)
+    assert client.get("/api/resized/missing.png?w=256").status_code == 404
+
+
+def completed_job(n, renditions=None):
+    from datetime import datetime, timezone
+
+    return {
+        "id": f"00000000-0000-0000-0000-{n:012d}",
+        "filename": f"00000000-0000-0000-0000-{n:012d}_img{n}.png",
+        "renditions": renditions,
+        "updated_at": datetime(2025, 1, 1, 0, 0, n, tzinfo=timezone.utc),
+    }
+
+
+def test_list_resized_images_paginates_with_cursor(api, monkeypatch):
+    client = api.client
+    jobs = [completed_job(n) for n in (5, 4, 3)]
+    calls = []
+
+    def fake_list_completed_jobs(limit, cursor=None, since=None):
+        calls.append((limit, cursor, since))
+        if cursor is None:
+            return jobs[:limit]
+        return [j for j in jobs if (j["updated_at"], j["id"]) < cursor][:limit]
+
+    api.patch_db("list_completed_jobs", fake_list_completed_jobs)
+
+    first = client.get("/api/resized?limit=2").get_json()
+    assert first["images"] == [jobs[0]["filename"], jobs[1]["filename"]]
+    assert first["latest"] == "2025-01-01T00:00:05+00:00"
+    assert first["next_cursor"]
+
+    second = client.get(f"/api/resized?limit=2&cursor={first['next_cursor']}").get_json()
+    assert second["images"] == [jobs[2]["filename"]]
+    assert second["next_cursor"] is None
+    assert calls[1][1] == (jobs[1]["updated_at"], jobs[1]["id"])
+
+
+def test_list_resized_images_uses_feed_rendition_and_ttl_cache(api, monkeypatch):
+    client = api.client
+    calls = []
+    thumb_only = [{"name": "thumb", "width": 100, "height": 100, "fit": "cover", "format": "WEBP"}]
+    jobs = [completed_job(2, RENDITION_PROFILES["web"]), completed_job(1, thumb_only)]
+    api.patch_db("list_completed_jobs", lambda limit, cursor=None, since=None: calls.append(1) or jobs)
+
+    for _ in range(3):
+        data = client.get("/api/resized").get_json()
+    assert data["images"] == [jobs[0]["filename"], f"thumb/{jobs[1]['filename'][:-4]}.webp"]
+    assert len(calls) == 1
+
+
+def test_list_resized_images_since_and_bad_params(api, monkeypatch):
+    client = api.client
+    seen = []
+    api.patch_db("list_completed_jobs", lambda limit, cursor=None, since=None: seen.append(since) or []
+    )
+
+    data = client.get("/api/resized?since=2025-01-01T00:00:05+00:00").get_json()
+    assert data == {"images": [], "next_cursor": None, "latest": "2025-01-01T00:00:05+00:00"}
+    assert seen[0].isoformat() == "2025-01-01T00:00:05+00:00"
+
+    assert client.get("/api/resized?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/resized?limit=abc").status_code == 400
+
+
+WAIT_JOB = "11111111-aaaa-4bbb-8ccc-111111111111"
+UUID_B = "22222222-2222-2222-2222-222222222222"
+
+
+def test_job_events_stream_reads_job_once_then_follows_notifications(monkeypatch):
+    client = server.app.test_client()
+    hub = server.job_events.JobEventHub(listen=False)
+    monkeypatch.setattr(server.job_events, "hub", hub)
+    reads = []
+    monkeypatch.setattr(server, "get_job", lambda job_id: reads.append(job_id) or {"id": job_id, "status": "pending"})
+
+    resp = client.get(f"/api/jobs/{WAIT_JOB.upper()}/events", buffered=False)
+    assert resp.mimetype == "text/event-stream"
+    assert resp.headers["Cache-Control"] == "no-cache"
+    chunks = iter(resp.response)
+    assert b'"status":"pending"' in next(chunks).replace(b" ", b"")
+
+    hub.publish({"id": WAIT_JOB, "status": "processing"})
+    hub.publish({"id": "22222222-2222-2222-2222-222222222222", "status": "error"})
+    hub.publish({"id": WAIT_JOB, "status": "completed"})
+    rest = [chunk.decode() for chunk in chunks]
+    assert [line for line in "".join(rest).splitlines() if line.startswith("event:")] == ["event: status"] * 2
+    assert '"completed"' in rest[-1]
+    assert reads == [WAIT_JOB]
+    assert hub.subscriber_count() == 0
+
+
+def test_job_wait_long_polls_until_status_changes(monkeypatch):
+    client = server.app.test_client()
+    hub = server.job_events.JobEventHub(listen=False)
+    monkeypatch.setattr(server.job_events, "hub", hub)
+    job = {"id": WAIT_JOB, "status": "processing"}
+    monkeypatch.setattr(server, "get_job", lambda job_id: dict(job) if job_id == WAIT_JOB else None)
+
+    # A client that is behind gets the current state straight away.
+    assert client.get(f"/api/jobs/{{{WAIT_JOB}}}/wait?status=pending").get_json()["status"] == "processing"
+    # Nothing happens: the known state comes back after the timeout.
+    assert client.get(f"/api/jobs/{WAIT_JOB}/wait?status=processing&timeout=0").get_json()["status"] == "processing"
+
+    real_subscribe = hub.subscribe
+
+    def subscribe_and_complete(job_ids=None):
+        subscription = real_subscribe(job_ids)
+        hub.publish({"id": WAIT_JOB, "status": "completed", "cache_hit": True})
+        return subscription
+
+    monkeypatch.setattr(hub, "subscribe", subscribe_and_complete)
+    data = client.get(f"/api/jobs/{WAIT_JOB}/wait?status=processing&timeout=5").get_json()
+    assert data["status"] == "completed" and data["cache_hit"] is True
+    assert client.get("/api/jobs/missing/wait").status_code == 404
+    assert client.get(f"/api/jobs/{UUID_B}/wait").status_code == 404
+    assert hub.subscriber_count() == 0
+
+
+def test_job_waits_are_capped_below_the_thread_count(monkeypatch):
+    client = server.app.test_client()
+    monkeypatch.setattr(server.job_events, "hub", server.job_events.JobEventHub(listen=False))
+    monkeypatch.setattr(server, "get_job", lambda job_id: {"id": job_id, "status": "pending"})
+    monkeypatch.setattr(server, "_wait_slots", threading.BoundedSemaphore(1))
+
+    stream = client.get(f"/api/jobs/{WAIT_JOB}/events", buffered=False)
+    assert stream.status_code == 200
+    for url in (f"/api/jobs/{WAIT_JOB}/events", f"/api/jobs/{WAIT_JOB}/wait?timeout=0"):
+        resp = client.get(url)
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == str(server.JOB_WAIT_RETRY_AFTER)
+    # Closing the stream frees its slot.
+    stream.close()
+    assert client.get(f"/api/jobs/{WAIT_JOB}/wait?timeout=0").status_code == 200
+    assert client.get("/api/jobs/not-a-uuid/events").status_code == 404
+
+
+def test_metrics_endpoint_reports_latency_per_route(monkeypatch):
+    client = server.app.test_client()
+    monkeypatch.setattr(server, "get_job", lambda job_id: None)
+
+    client.get("/api/jobs/a")
+    client.get("/api/jobs/b")
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/jobs/<job_id>",status="404"}' in text
+    assert "/api/jobs/a" not in text
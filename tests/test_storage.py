@@ -0,0 +1,59 @@
+import pytest
+from minio.error import S3Error
+
+import storage
+
+
+class _Buckets:
+    def __init__(self, existing=(), race=False):
+        self.existing = set(existing)
+        self.race = race
+        self.calls = []
+
+    def bucket_exists(self, bucket):
+        self.calls.append(("bucket_exists", bucket))
+        return bucket in self.existing
+
+    def make_bucket(self, bucket):
+        self.calls.append(("make_bucket", bucket))
+        if self.race:
+            raise S3Error(None, "BucketAlreadyOwnedByYou", "exists", bucket, "req", "host")
+        self.existing.add(bucket)
+
+
+def test_ensure_bucket_is_memoized_per_client():
+    client, other = _Buckets(), _Buckets(existing={"resized"})
+
+    for _ in range(3):
+        storage.ensure_bucket(client, "resized")
+    storage.ensure_bucket(other, "resized")
+
+    assert client.calls == [("bucket_exists", "resized"), ("make_bucket", "resized")]
+    assert other.calls == [("bucket_exists", "resized")]
+
+    storage.forget_bucket(client, "resized")
+    storage.ensure_bucket(client, "resized")
+    assert client.calls[-1] == ("bucket_exists", "resized")
+    assert len(client.calls) == 3
+
+
+def test_ensure_bucket_tolerates_concurrent_creation():
+    client = _Buckets(race=True)
+    storage.ensure_bucket(client, "uploads")
+    storage.ensure_bucket(client, "uploads")
+    assert len(client.calls) == 2
+
+    class Denied(_Buckets):
+        def make_bucket(self, bucket):
+            raise S3Error(None, "AccessDenied", "no", bucket, "req", "host")
+
+    with pytest.raises(S3Error):
+        storage.ensure_bucket(Denied(), "uploads")
+
+
+def test_create_client_uses_tuned_pool():
+    client = storage.create_client(pool_size=12)
+    http = client._http
+    assert http.connection_pool_kw["maxsize"] == 12
+    assert http.connection_pool_kw["timeout"].connect_timeout == storage.MINIO_CONNECT_TIMEOUT
+    assert http.connection_pool_kw["retries"].total == storage.MINIO_RETRIES
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import job_events
+import thumb_cache
+from renditions import RENDITION_PROFILES, rendition_key
+
+MODIFIED = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+def put(cache, key, size):
+    cache.put(key, b"x" * size, "etag-" + key, "image/png", MODIFIED)
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    cache = thumb_cache.ThumbnailCache(max_bytes=250, max_item_bytes=200, directory=None)
+    before = thumb_cache.CACHE_EVICTIONS.value(tier="memory")
+
+    put(cache, "a", 100)
+    put(cache, "b", 100)
+    assert cache.get("a") is not None  # a is now the most recently used
+    put(cache, "c", 100)
+
+    assert cache.get("b") is None
+    assert cache.get("a").etag == "etag-a"
+    assert cache.memory.bytes == 200
+    assert thumb_cache.CACHE_EVICTIONS.value(tier="memory") == before + 1
+
+    put(cache, "huge", 300)
+    assert cache.get("huge") is None
+
+
+def test_disk_tier_is_shared_and_capped(tmp_path):
+    writer = thumb_cache.ThumbnailCache(max_bytes=0, directory=str(tmp_path), disk_bytes=2000)
+    reader = thumb_cache.ThumbnailCache(max_bytes=1000, directory=str(tmp_path), disk_bytes=2000)
+
+    put(writer, "thumb/a.webp", 500)
+    entry = reader.get("thumb/a.webp")
+    assert entry.data == b"x" * 500
+    assert entry.last_modified == MODIFIED
+    assert entry.content_type == "image/png"
+    # Promoted into the reader's memory tier.
+    assert reader.memory.get("thumb/a.webp") is not None
+
+    # Oldest files go first once the directory exceeds its cap.
+    for i, key in enumerate(["b", "c", "d", "e"]):
+        put(writer, key, 500)
+        os.utime(writer.disk.path(key), (1000 + i, 1000 + i))
+    os.utime(writer.disk.path("thumb/a.webp"), (0, 0))
+    writer.disk.evict()
+    assert not os.path.exists(writer.disk.path("thumb/a.webp"))
+    assert os.path.exists(writer.disk.path("e"))
+    assert sum(size for _, size, _ in writer.disk._files()) <= 2000 * thumb_cache.DISK_EVICT_TARGET
+
+
+def test_invalidate_and_revalidation_age(tmp_path):
+    cache = thumb_cache.ThumbnailCache(directory=str(tmp_path), revalidate_seconds=60)
+    put(cache, "k", 10)
+    cache.invalidate("k")
+    assert cache.get("k") is None
+
+    cache = thumb_cache.ThumbnailCache(directory=None, revalidate_seconds=60)
+    put(cache, "old", 10)
+    cache.memory.get("old").stored_at = time.time() - 120
+    assert cache.get("old") is None
+
+
+def test_unreadable_disk_entry_is_dropped(tmp_path):
+    cache = thumb_cache.ThumbnailCache(max_bytes=0, directory=str(tmp_path))
+    put(cache, "k", 10)
+    with open(cache.disk.path("k"), "wb") as fh:
+        fh.write(b"\x00\x00\x00\x09{broken")
+    assert cache.get("k") is None
+    assert not os.path.exists(cache.disk.path("k"))
+
+
+def test_completed_job_events_invalidate_written_keys():
+    filename = "job_photo.png"
+    web = RENDITION_PROFILES["web"]
+    keys = [rendition_key(filename, r) for r in web]
+    cache = thumb_cache.ThumbnailCache(directory=None)
+    for key in keys:
+        put(cache, key, 10)
+    hub = job_events.JobEventHub(listen=False)
+    thumb_cache.follow_job_events(cache, hub)
+
+    hub.publish({"id": "job", "status": "processing", "filename": filename, "renditions": web})
+    hub.publish({"id": "job", "status": "completed", "filename": filename, "renditions": web})
+    deadline = time.monotonic() + 2
+    while len(cache.memory) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(cache.memory) == 0
+    assert thumb_cache.written_keys({"status": "completed", "filename": filename, "renditions": None}) == [
+        rendition_key(filename, r) for r in RENDITION_PROFILES["default"]
+    ]
+
+
+def test_single_flight_collapses_concurrent_calls():
+    flight = thumb_cache.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def render():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "rendered"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", render))) for _ in range(5)]
+    threads[0].start()
+    started.wait(2)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == ["rendered"] * 5
+
+    # Failures reach every waiter and are not remembered.
+    def fail():
+        raise OSError("broken")
+
+    with pytest.raises(OSError):
+        flight.do("k", fail)
+    assert flight.do("k", lambda: "again") == "again"
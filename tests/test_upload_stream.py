@@ -0,0 +1,74 @@
+import hashlib
+import io
+
+import pytest
+
+from upload_stream import HashingReader, MultipartUpload
+
+
+BOUNDARY = b"----test-boundary"
+
+
+def multipart_body(*parts):
+    chunks = []
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        chunks.append(b"--" + BOUNDARY + b"\r\n")
+        chunks.append(f"Content-Disposition: {disposition}\r\n".encode())
+        if filename is not None:
+            chunks.append(b"Content-Type: image/png\r\n")
+        chunks.append(b"\r\n" + value + b"\r\n")
+    chunks.append(b"--" + BOUNDARY + b"--\r\n")
+    return b"".join(chunks)
+
+
+def test_multipart_upload_streams_named_file_in_small_reads():
+    payload = bytes(range(256)) * 1000
+    body = multipart_body(
+        ("profile", b"web", None),
+        ("other", b"skip me", "other.png"),
+        ("image", payload, "photo.png"),
+        ("trailing", b"after", None),
+    )
+    upload = MultipartUpload(io.BytesIO(body), BOUNDARY, chunk_size=1000)
+
+    part = upload.next_file("image")
+    assert (part.name, part.filename, part.content_type) == ("image", "photo.png", "image/png")
+    assert upload.form == {"profile": "web"}
+
+    reader = HashingReader(upload)
+    received = b"".join(iter(lambda: reader.read(4096), b""))
+    assert received == payload
+    assert reader.size == len(payload)
+    assert reader.hexdigest() == hashlib.sha256(payload).hexdigest()
+
+    upload.drain()
+    assert upload.form == {"profile": "web", "trailing": "after"}
+
+
+def test_multipart_upload_without_matching_file():
+    upload = MultipartUpload(io.BytesIO(multipart_body(("name", b"value", None))), BOUNDARY)
+    assert upload.next_file("image") is None
+
+
+def test_multipart_upload_rejects_truncated_body():
+    body = multipart_body(("image", b"x" * 5000, "photo.png"))[:-200]
+    upload = MultipartUpload(io.BytesIO(body), BOUNDARY, chunk_size=512)
+    upload.next_file("image")
+    with pytest.raises(ValueError):
+        upload.read()
+
+
+def test_multipart_upload_limits_each_file():
+    from werkzeug.exceptions import RequestEntityTooLarge
+
+    body = multipart_body(("image", b"x" * 5000, "big.png"), ("image", b"y" * 100, "small.png"))
+    upload = MultipartUpload(io.BytesIO(body), BOUNDARY, chunk_size=512, max_file_size=1000)
+    upload.next_file("image")
+    with pytest.raises(RequestEntityTooLarge):
+        upload.read()
+    # The rest of the oversized part is skipped and the next file reads in full.
+    assert upload.next_file("image").filename == "small.png"
+    assert upload.read() == b"y" * 100
@@ -0,0 +1,377 @@
+"""
+Two-level cache for resized images served by the API: a per-process LRU
+bounded by bytes, backed by an optional on-disk tier in a directory that
+all gunicorn workers on the host share. Entries keep the object's ETag and
+headers, so a hit is answered without asking MinIO anything.
+
+Disk entries are written to a temp file and renamed into place, so a
+reader sees either the old or the new entry, never a partial one; reads
+mmap the file, which stays valid even if another worker evicts it at the
+same time. Eviction is least-recently-used by file mtime (bumped on hits)
+and runs in one worker at a time, under an flock on the directory.
+
+Entries are dropped when the processor completes a job that (re)writes
+their keys (see follow_job_events), and are refetched once they are older
+than THUMB_CACHE_REVALIDATE_SECONDS as a backstop for writes that send no
+notification, such as the bulk command.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime
+
+import metrics
+from renditions import DEFAULT_PROFILE, rendition_key, resolve_renditions
+
+
+THUMB_CACHE_BYTES = int(os.environ.get('THUMB_CACHE_BYTES', 64 * 1024 * 1024))
+# Larger objects are streamed from MinIO as before and never cached.
+THUMB_CACHE_MAX_ITEM_BYTES = int(os.environ.get('THUMB_CACHE_MAX_ITEM_BYTES', 1024 * 1024))
+THUMB_CACHE_DIR = os.environ.get('THUMB_CACHE_DIR') or None
+THUMB_CACHE_DISK_BYTES = int(os.environ.get('THUMB_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+THUMB_CACHE_REVALIDATE_SECONDS = float(os.environ.get('THUMB_CACHE_REVALIDATE_SECONDS', 300))
+# Eviction trims the disk tier to this fraction of its cap, so it does not
+# rescan the directory on every write once full.
+DISK_EVICT_TARGET = 0.9
+# Hits bump an entry's mtime at most this often.
+DISK_TOUCH_SECONDS = 60
+
+_HEADER = struct.Struct('>I')
+
+CACHE_HITS = metrics.Counter('thumb_cache_hits_total', 'Resized-image cache hits by tier.', ['tier'])
+CACHE_MISSES = metrics.Counter('thumb_cache_misses_total', 'Resized-image cache misses.')
+CACHE_EVICTIONS = metrics.Counter('thumb_cache_evictions_total', 'Resized-image cache evictions by tier.', ['tier'])
+CACHE_INVALIDATIONS = metrics.Counter('thumb_cache_invalidations_total', 'Keys dropped after being rewritten.')
+CACHE_BYTES = metrics.Gauge('thumb_cache_bytes', 'Bytes held by the resized-image cache by tier.', ['tier'])
+
+
+@dataclass
+class CachedObject:
+    data: bytes
+    etag: str
+    content_type: str
+    last_modified: datetime | None
+    stored_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def meta(self) -> dict:
+        return {
+            'etag': self.etag,
+            'content_type': self.content_type,
+            'last_modified': self.last_modified.isoformat() if self.last_modified else None,
+            'stored_at': self.stored_at,
+        }
+
+
+class MemoryTier:
+    """Thread-safe LRU holding at most `max_bytes` of object data."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict[str, CachedObject] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CachedObject | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedObject):
+        if entry.size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.bytes -= dropped.size
+                evicted += 1
+            resident = self.bytes
+        if evicted:
+            CACHE_EVICTIONS.inc(evicted, tier='memory')
+        CACHE_BYTES.set(resident, tier='memory')
+
+    def discard(self, key: str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            resident = self.bytes
+        CACHE_BYTES.set(resident, tier='memory')
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """
+    Directory of cache files shared between processes. Each file is a
+    4-byte header length, a JSON header (key and metadata), then the data.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, '.lock')
+        # Estimate of the directory's size; corrected by every eviction scan.
+        self._approx_bytes = self._scan_bytes()
+        self._approx_lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key: str) -> CachedObject | None:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if size < _HEADER.size:
+                    raise ValueError('truncated cache file')
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    (header_len,) = _HEADER.unpack_from(mapped, 0)
+                    start = _HEADER.size + header_len
+                    header = json.loads(mapped[_HEADER.size:start])
+                    if header['key'] != key:
+                        return None
+                    data = mapped[start:]
+                mtime = os.fstat(fh.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            print(f"[WARN] Dropping unreadable cache file {path}: {e}")
+            self._unlink(path)
+            return None
+        if time.time() - mtime > DISK_TOUCH_SECONDS:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        last_modified = header.get('last_modified')
+        return CachedObject(
+            data=data,
+            etag=header['etag'],
+            content_type=header['content_type'],
+            last_modified=datetime.fromisoformat(last_modified) if last_modified else None,
+            stored_at=header['stored_at'],
+        )
+
+    def put(self, key: str, entry: CachedObject):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({'key': key, **entry.meta()}).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(_HEADER.pack(len(header)))
+                fh.write(header)
+                fh.write(entry.data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[WARN] Could not write cache file {path}: {e}")
+            self._unlink(tmp_path)
+            return
+        with self._approx_lock:
+            self._approx_bytes += _HEADER.size + len(header) + entry.size
+            over = self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def discard(self, key: str):
+        self._unlink(self.path(key))
+
+    def _files(self):
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _scan_bytes(self) -> int:
+        total = sum(size for _, size, _ in self._files())
+        CACHE_BYTES.set(total, tier='disk')
+        return total
+
+    def evict(self):
+        """Delete least recently used files until under the target size."""
+        with open(self._lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is already evicting.
+                return
+            try:
+                files = sorted(self._files())
+                total = sum(size for _, size, _ in files)
+                target = self.max_bytes * DISK_EVICT_TARGET
+                evicted = 0
+                for _mtime, size, path in files:
+                    if total <= target:
+                        break
+                    self._unlink(path)
+                    total -= size
+                    evicted += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        with self._approx_lock:
+            self._approx_bytes = total
+        if evicted:
+            CACHE_EVICTIONS.inc(evicted, tier='disk')
+        CACHE_BYTES.set(total, tier='disk')
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class ThumbnailCache:
+    """Memory tier in front of an optional disk tier; see the module docstring."""
+
+    def __init__(self, max_bytes: int = THUMB_CACHE_BYTES, max_item_bytes: int = THUMB_CACHE_MAX_ITEM_BYTES,
+                 directory: str | None = THUMB_CACHE_DIR, disk_bytes: int = THUMB_CACHE_DISK_BYTES,
+                 revalidate_seconds: float = THUMB_CACHE_REVALIDATE_SECONDS):
+        self.max_item_bytes = max_item_bytes if max_bytes > 0 or directory else 0
+        self.revalidate_seconds = revalidate_seconds
+        self.memory = MemoryTier(max_bytes)
+        self.disk = DiskTier(directory, disk_bytes) if directory else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_item_bytes > 0
+
+    def cacheable(self, size: int) -> bool:
+        return 0 < size <= self.max_item_bytes
+
+    def _fresh(self, entry: CachedObject | None) -> bool:
+        return entry is not None and time.time() - entry.stored_at < self.revalidate_seconds
+
+    def get(self, key: str) -> CachedObject | None:
+        if not self.enabled:
+            return None
+        entry = self.memory.get(key)
+        if self._fresh(entry):
+            CACHE_HITS.inc(tier='memory')
+            return entry
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if self._fresh(entry):
+                CACHE_HITS.inc(tier='disk')
+                self.memory.put(key, entry)
+                return entry
+        CACHE_MISSES.inc()
+        return None
+
+    def put(self, key: str, data: bytes, etag: str, content_type: str, last_modified: datetime | None):
+        if not self.cacheable(len(data)):
+            return
+        entry = CachedObject(bytes(data), etag, content_type, last_modified, time.time())
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            self.disk.put(key, entry)
+
+    def invalidate(self, key: str):
+        self.memory.discard(key)
+        if self.disk is not None:
+            self.disk.discard(key)
+        CACHE_INVALIDATIONS.inc()
+
+    def stats(self) -> dict:
+        memory_hits = CACHE_HITS.value(tier='memory')
+        disk_hits = CACHE_HITS.value(tier='disk')
+        misses = CACHE_MISSES.value()
+        lookups = memory_hits + disk_hits + misses
+        return {
+            'hits': {'memory': memory_hits, 'disk': disk_hits},
+            'misses': misses,
+            'hit_ratio': (memory_hits + disk_hits) / lookups if lookups else 0.0,
+            'bytes': {'memory': self.memory.bytes, 'disk': CACHE_BYTES.value(tier='disk')},
+            'evictions': {'memory': CACHE_EVICTIONS.value(tier='memory'),
+                          'disk': CACHE_EVICTIONS.value(tier='disk')},
+        }
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one: the first caller
+    runs `fn`, and callers arriving while it runs wait for its result (or
+    its exception) instead of repeating the work. Per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def written_keys(event: dict) -> list[str]:
+    """Resized-bucket keys a job's completion (re)wrote, from its status event."""
+    if event.get('status') != 'completed' or not event.get('filename'):
+        return []
+    renditions = event.get('renditions') or resolve_renditions(DEFAULT_PROFILE)
+    return [rendition_key(event['filename'], rendition) for rendition in renditions]
+
+
+def follow_job_events(cache: ThumbnailCache, hub) -> threading.Thread:
+    """
+    Invalidate keys as jobs complete, from a daemon thread. Every worker
+    runs one, so each drops its own memory entries; the disk unlink is
+    idempotent.
+    """
+    subscription = hub.subscribe()
+
+    def run():
+        while True:
+            event = subscription.get()
+            for key in written_keys(event or {}):
+                cache.invalidate(key)
+
+    thread = threading.Thread(target=run, name='thumb-cache-invalidator', daemon=True)
+    thread.start()
+    return thread
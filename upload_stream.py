@@ -0,0 +1,128 @@
+"""
+Streaming helpers for request bodies that should never be held in memory
+as a whole: an incremental multipart/form-data reader and a reader that
+hashes whatever passes through it.
+"""
+import hashlib
+from dataclasses import dataclass
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+@dataclass
+class FilePart:
+    name: str
+    filename: str
+    content_type: str
+
+
+class MultipartUpload:
+    """
+    Incremental multipart/form-data parser over a request stream. Walk the
+    file parts with next_file() and read the current file's body with
+    read(n); form fields seen on the way are collected in `form`. At most
+    one network chunk plus `n` bytes are buffered at a time, and a form
+    field larger than `max_form_memory_size` is rejected with 413, as is
+    reading more than `max_file_size` bytes of one file.
+    """
+
+    def __init__(self, stream, boundary: bytes, chunk_size: int = 64 * 1024,
+                 max_form_memory_size: int = 64 * 1024, max_file_size: int | None = None):
+        self.form: dict[str, str] = {}
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._max_form_memory_size = max_form_memory_size
+        self._max_file_size = max_file_size
+        # The decoder's own limit applies to its internal buffer, which holds
+        # at most one chunk plus whatever it could not yet emit.
+        self._decoder = MultipartDecoder(boundary, chunk_size + max_form_memory_size)
+        self._events = self._iter_events()
+        self._buffer = bytearray()
+        self._in_file = False
+        self._file_read = 0
+
+    def _iter_events(self):
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = self._stream.read(self._chunk_size)
+                # None tells the decoder the body is complete.
+                self._decoder.receive_data(chunk or None)
+                continue
+            if isinstance(event, Epilogue):
+                return
+            yield event
+
+    def next_file(self, name: str | None = None) -> FilePart | None:
+        """Advance to the next file part (called `name`, if given)."""
+        self._skip_current_file()
+        field, value = None, []
+        for event in self._events:
+            if isinstance(event, Field):
+                field, value = event.name, []
+            elif isinstance(event, File):
+                if name is None or event.name == name:
+                    self._in_file = True
+                    self._file_read = 0
+                    return FilePart(
+                        event.name,
+                        event.filename,
+                        event.headers.get('Content-Type', 'application/octet-stream'),
+                    )
+                field = None
+            elif isinstance(event, Data) and field is not None:
+                value.append(event.data)
+                if sum(map(len, value)) > self._max_form_memory_size:
+                    raise RequestEntityTooLarge()
+                if not event.more_data:
+                    self.form[field] = b''.join(value).decode('utf-8', 'replace')
+                    field = None
+        return None
+
+    def read(self, size: int = -1) -> bytes:
+        """Read from the current file part; b'' once it is exhausted."""
+        data = self._read(size)
+        self._file_read += len(data)
+        if self._max_file_size is not None and self._file_read > self._max_file_size:
+            raise RequestEntityTooLarge(f'File exceeds the {self._max_file_size} byte limit')
+        return data
+
+    def _read(self, size: int) -> bytes:
+        while self._in_file and (size < 0 or len(self._buffer) < size):
+            event = next(self._events)
+            self._buffer += event.data
+            self._in_file = event.more_data
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def drain(self):
+        """Consume the rest of the body, collecting any remaining fields."""
+        while self.next_file() is not None:
+            pass
+
+    def _skip_current_file(self):
+        while self._in_file:
+            self._read(self._chunk_size)
+        self._buffer.clear()
+
+
+class HashingReader:
+    """File-like wrapper that hashes and counts every byte read through it."""
+
+    def __init__(self, raw, algorithm: str = 'sha256'):
+        self.raw = raw
+        self.hash = hashlib.new(algorithm)
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()